@@ -137,6 +137,7 @@ class CART(sdutil.OutputFormatterMixin):
         self._x = np.column_stack(columns)
         self._boxes = None
         self._stats = None
+        self._box_init = None
 
     @property
     def boxes(self):
@@ -144,132 +145,157 @@ class CART(sdutil.OutputFormatterMixin):
         
         if self._boxes:
             return self._boxes
-    
-        # based on
-        # http://stackoverflow.com/questions/20224526/how-to-extract-the-
-        # decision-rules-from-scikit-learn-decision-tree
-        assert self.clf
         
-        left = self.clf.tree_.children_left
-        right = self.clf.tree_.children_right
-        threshold = self.clf.tree_.threshold
-        features = [self.feature_names[i] for i in self.clf.tree_.feature]
+        self._boxes = [box for box, _ in self._leaf_boxes().values()]
+        return self._boxes
     
-        # get ids of leaf nodes
-        leafs = np.argwhere(left == -1)[:,0]     
-    
-        def recurse(left, right, child, lineage=None):          
-            if lineage is None:
-                # lineage = [self.clf.tree_.value[child]]
-                lineage = []
+    def _leaf_boxes(self):
+        '''
+        
+        Derive the box for each leaf in a single top down traversal of the
+        tree, starting from the box that contains all data.
+        
+        Returns
+        -------
+        OrderedDict
+            with leaf id as key, and a tuple with the box and whether the 
+            box contains exactly the data in the leaf as value, sorted on 
+            leaf id
+        
+        '''
+        tree_ = self.clf.tree_
+        left = tree_.children_left
+        right = tree_.children_right
+        threshold = tree_.threshold
+        features = [self.feature_names[i] for i in tree_.feature]
+        
+        leafs = {}
+        
+        # the nodes still to visit, with the box of the node, and whether 
+        # this box contains exactly the data in the node
+        stack = [(0, self._get_box_init(), True)]
+        while stack:
+            node, box, exact = stack.pop()
             
-            if child in left:
-                parent = np.where(left == child)[0].item()
-                split = 'l'
-            else:
-                parent = np.where(right == child)[0].item()
-                split = 'r'
-    
-            lineage.append((parent, split, threshold[parent],
-                            features[parent]))
-    
-            if parent == 0:
-                lineage.reverse()
-                return lineage
-            else:
-                return recurse(left, right, parent, lineage)
+            if left[node] == -1:
+                leafs[node] = (box, exact)
+                continue
             
-        box_init = sdutil._make_box(self.x)
-        boxes = []
-        for leaf in leafs:
-            branch = recurse(left, right, leaf)
-            box = np.copy(box_init)
-            for node in branch:
-                direction = node[1]
-                value = node[2]
-                unc = node[3]
-                
-                if direction=='l':
-                    try:
-                        box[unc][1] = value
-                    except ValueError:
-                        unc, cat = unc.split(self.sep)
-                        cats = list(box[unc][0])
-                        cats = [str(cat) for cat in cats]
-                        cats.pop(cats.index(str(cat)))
-                        box[unc][:]=set(cats)
-                else:
-                    try:
-                        if (box.dtype.fields[unc][0])==np.int32:
-                            value = math.ceil(value)
-                        box[unc][0] = value
-                    except (ValueError, KeyError):
-                        # we are in the right hand branch, so 
-                        # the category is included
-                        pass
-                        
-            boxes.append(box) 
-        self._boxes = boxes
-        return self._boxes       
+            value = threshold[node]
+            unc = features[node]
+            
+            # left branch
+            box_left = np.copy(box)
+            try:
+                box_left[unc][1] = value
+            except ValueError:
+                unc_name, cat = unc.split(self.sep)
+                cats = list(box_left[unc_name][0])
+                cats = [str(cat) for cat in cats]
+                cats.pop(cats.index(str(cat)))
+                box_left[unc_name][:]=set(cats)
+            stack.append((left[node], box_left, exact))
+            
+            # right branch
+            box_right = np.copy(box)
+            try:
+                if (box_right.dtype.fields[unc][0])==np.int32:
+                    value = math.ceil(value)
+                box_right[unc][0] = value
+            except (ValueError, KeyError):
+                # we are in the right hand branch, so 
+                # the category is included, the box is not restricted
+                # to this category, so it can contain data outside the leaf
+                exact = False
+            stack.append((right[node], box_right, exact))
+        
+        return collections.OrderedDict(sorted(leafs.items()))
+    
+    def _get_box_init(self):
+        if self._box_init is None:
+            self._box_init = sdutil._make_box(self.x)
+        return self._box_init
     
     @property
     def stats(self):
         if self._stats:
             return self._stats
         
-        boxes = self.boxes
+        leaf_boxes = self._leaf_boxes()
+        self._boxes = [box for box, _ in leaf_boxes.values()]
+        box_init = self._get_box_init()
         
-        box_init = sdutil._make_box(self.x)
+        # the number of cases, the sum of y, and the number of cases of 
+        # each class in each leaf, in one pass over the leaf assignments
+        y = np.asarray(self.y)
+        leaf_ids = self.clf.apply(self._x)
+        nr_nodes = self.clf.tree_.node_count
+        counts = np.bincount(leaf_ids, minlength=nr_nodes)
         
+        if self.mode == sdutil.CLASSIFICATION:
+            classes = np.unique(y)
+            codes = leaf_ids*classes.shape[0] + np.searchsorted(classes, y)
+            compositions = np.bincount(codes, 
+                                minlength=nr_nodes*classes.shape[0])
+            compositions = compositions.reshape((nr_nodes, classes.shape[0]))
+            sums = None
+        else:
+            sums = np.bincount(leaf_ids, weights=y, minlength=nr_nodes)
+            compositions = None
+        
+        encoded = None
         self._stats = []
-        for box in boxes:
-            boxstats = self._boxstat_methods[self.mode](self, box, box_init)
+        for leaf, (box, exact) in leaf_boxes.items():
+            if exact:
+                count = counts[leaf]
+                y_sum = None if sums is None else sums[leaf]
+                composition = None if compositions is None else\
+                              compositions[leaf]
+            else:
+                # the box can contain data outside its leaf, so determine 
+                # the data in the box instead
+                if encoded is None:
+                    encoded = sdutil.EncodedExperiments(self.x)
+                y_in_box = y[encoded.in_box(box)]
+                count = y_in_box.shape[0]
+                y_sum = np.sum(y_in_box)
+                if compositions is not None:
+                    composition = np.asarray([np.sum(y_in_box==ci) for ci 
+                                              in classes])
+            
+            boxstats = self._boxstat_methods[self.mode](self, box, count, 
+                                                y_sum, composition, box_init)
             self._stats.append(boxstats)
         return self._stats
 
     
-    def _binary_stats(self, box, box_init):
-        indices = sdutil._in_box(self.x, box)
-            
-        y_in_box = self.y[indices]
-        box_coi = np.sum(y_in_box)
-        
-        boxstats = {'coverage': box_coi/np.sum(self.y),
-                    'density': box_coi/y_in_box.shape[0],
+    def _binary_stats(self, box, count, y_sum, composition, box_init):
+        boxstats = {'coverage': y_sum/np.sum(self.y),
+                    'density': y_sum/count,
                     'res dim':sdutil._determine_nr_restricted_dims(box,
                                                                    box_init),
-                    'mass':y_in_box.shape[0]/self.y.shape[0]}
+                    'mass':count/self.y.shape[0]}
         return boxstats
     
-    def _regression_stats(self, box, box_init):
-        indices = sdutil._in_box(self.x, box)
-            
-        y_in_box = self.y[indices]
-        
-        boxstats = {'mean': np.mean(y_in_box),
-                    'mass':y_in_box.shape[0]/self.y.shape[0],
+    def _regression_stats(self, box, count, y_sum, composition, box_init):
+        boxstats = {'mean': y_sum/count,
+                    'mass':count/self.y.shape[0],
                     'res dim':sdutil._determine_nr_restricted_dims(box,
                                                                    box_init)}
         return boxstats
 
     
-    def _classification_stats(self, box, box_init):
-        indices = sdutil._in_box(self.x, box)
-            
-        y_in_box = self.y[indices]
-        classes = set(self.y)
-        classes = list(classes)
-        classes.sort()
-        
-        counts = [y_in_box[y_in_box==ci].shape[0] for ci in classes]
+    def _classification_stats(self, box, count, y_sum, composition, 
+                              box_init):
+        counts = [int(entry) for entry in composition]
 
         total_gini = 0
-        for count in counts:
-            total_gini += (count/y_in_box.shape[0])**2
+        for entry in counts:
+            total_gini += (entry/count)**2
         gini = 1 - total_gini
         
         boxstats = {'gini': gini,
-            'mass':y_in_box.shape[0]/self.y.shape[0],
+            'mass':count/self.y.shape[0],
             'box_composition': counts,
             'res dim':sdutil._determine_nr_restricted_dims(box,
                                                            box_init)}
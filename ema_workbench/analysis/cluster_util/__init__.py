@@ -4,3 +4,4 @@ from .gonenc_distance import distance_gonenc
 from .mse_distance import distance_mse
 from .sse_distance import distance_sse
 from .triangle_distance import distance_triangle
+from .blocked_distance import distance_blocked
@@ -0,0 +1,194 @@
+'''
+
+Blocked, vectorized calculation of the condensed distance row for the
+distances that compare data series point by point (sse, mse, and triangle).
+
+Rather than comparing each pair of data series in a Python loop, the
+series are split into blocks, and the distances between two blocks are
+calculated with matrix operations. Blocks can be calculated in parallel
+using threads, and the distance row can be a memory mapped file, so the
+number of data series is not limited by the memory needed for the
+distance row.
+
+'''
+from __future__ import (absolute_import, print_function, division,
+                        unicode_literals)
+
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+
+from ema_workbench.util import info, EMAError
+
+__all__ = ['distance_blocked']
+
+
+# sse below this fraction of |a|^2+|b|^2 is calculated directly
+RECOMPUTE = 1e-4
+
+# number of pairs for which the sse is recalculated at once
+RECOMPUTE_BATCH = 4096
+
+
+def sse_block(a, b, a_norm, b_norm, a_raw=None, b_raw=None):
+    '''sum of squared errors between each row of a and each row of b
+    
+    The sse is calculated as |a|^2+|b|^2-2ab. This loses precision if the
+    sse is small compared to |a|^2+|b|^2, for series that are (nearly) the
+    same. The sse of these pairs is calculated directly instead, from 
+    a_raw and b_raw if a and b have been centered, so the relative error is
+    below about 1e-10 for all pairs.
+    
+    '''
+    if a_raw is None:
+        a_raw, b_raw = a, b
+    
+    d = np.dot(a, b.T)
+    d *= -2
+    d += a_norm[:, np.newaxis]
+    d += b_norm[np.newaxis, :]
+
+    # pairs below the largest threshold are candidates, which avoids 
+    # calculating the threshold for each pair
+    threshold = RECOMPUTE*(a_norm.max() + b_norm.max())
+    rows, columns = np.nonzero(d <= threshold)
+    keep = d[rows, columns] <= RECOMPUTE*(a_norm[rows] + b_norm[columns])
+    rows = rows[keep]
+    columns = columns[keep]
+    for start in range(0, rows.shape[0], RECOMPUTE_BATCH):
+        i = rows[start:start+RECOMPUTE_BATCH]
+        j = columns[start:start+RECOMPUTE_BATCH]
+        diff = a_raw[i] - b_raw[j]
+        d[i, j] = np.einsum('ij,ij->i', diff, diff)
+    return d
+
+
+def triangle_block(a, b, a_norm, b_norm, a_raw=None, b_raw=None):
+    '''a.b/(|a||b|) for each row of a and each row of b'''
+    d = np.dot(a, b.T)
+    d /= np.sqrt(a_norm)[:, np.newaxis]
+    d /= np.sqrt(b_norm)[np.newaxis, :]
+    return d
+
+
+# metric: (block function, whether to center the data)
+METRICS = {'sse': (sse_block, True),
+           # distance_mse does not divide by the length of the series, so
+           # neither do we
+           'mse': (sse_block, True),
+           'triangle': (triangle_block, False)}
+
+
+def make_run_logs(data):
+    '''
+    make the run logs as returned by the loop based distance functions
+
+    Parameters
+    ----------
+    data : numpy array
+
+    Returns
+    -------
+    list of tuples with a description dict and the data series
+
+    '''
+    return [({'Index':str(i)}, data[i]) for i in range(data.shape[0])]
+
+
+def row_offset(i, n):
+    '''index in the condensed distance row of the distance between i and
+    i+1'''
+    return n*i - (i*(i+1))//2
+
+
+def distance_blocked(data, metric='sse', block_size=1024, n_jobs=1,
+                     filename=None):
+    '''
+    Calculate the condensed distance row for data in blocks of block_size
+    by block_size data series. The resulting distance row is the same as
+    the one from the loop based distance functions, up to rounding errors.
+
+    Parameters
+    ----------
+    data : numpy array
+           a data series in each row
+    metric : {'sse', 'mse', 'triangle'}
+    block_size : int, optional
+                 number of data series in a block
+    n_jobs : int, optional
+             number of threads for calculating the blocks
+    filename : str, optional
+               if provided, the distance row is a memory mapped .npy file
+
+    Returns
+    -------
+    numpy array
+        the condensed distance row
+    list
+        the run logs
+
+    Raises
+    ------
+    EMAError
+        if the metric is unknown
+
+    '''
+    try:
+        block_function, center = METRICS[metric]
+    except KeyError:
+        raise EMAError("no blocked implementation for {}".format(metric))
+
+    info("calculating distances")
+
+    run_logs = make_run_logs(data)
+    
+    data = np.asarray(data, dtype=float)
+    n = data.shape[0]
+    size = (n*(n-1))//2
+
+    if filename:
+        dRow = np.lib.format.open_memmap(filename, mode='w+', dtype=float,
+                                         shape=(size,))
+    else:
+        dRow = np.zeros((size,))
+
+    raw = data
+    if center:
+        # sse is invariant to a common shift, centering reduces the
+        # rounding errors
+        data = data - np.mean(data, axis=0)
+    norm = np.einsum('ij,ij->i', data, data)
+
+    def calculate_row_block(start):
+        stop = min(start+block_size, n)
+        a = data[start:stop]
+        a_norm = norm[start:stop]
+
+        for column in range(start, n, block_size):
+            column_stop = min(column+block_size, n)
+            d = block_function(a, data[column:column_stop], a_norm,
+                               norm[column:column_stop], raw[start:stop],
+                               raw[column:column_stop])
+
+            # copy the upper triangle, row by row
+            for i in range(start, min(stop, column_stop-1)):
+                first = max(column, i+1)
+                offset = row_offset(i, n) + first - i - 1
+                dRow[offset:offset+column_stop-first] = d[i-start,
+                                                first-column:]
+
+    starts = range(0, n, block_size)
+    if n_jobs > 1:
+        pool = ThreadPool(n_jobs)
+        try:
+            pool.map(calculate_row_block, starts)
+        finally:
+            pool.close()
+    else:
+        for start in starts:
+            calculate_row_block(start)
+
+    if filename:
+        dRow.flush()
+
+    return dRow, run_logs
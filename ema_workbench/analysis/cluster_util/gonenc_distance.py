@@ -9,10 +9,14 @@ Created on Nov 8, 2011
 
 
 import random
+from collections import defaultdict
+from multiprocessing.pool import ThreadPool
 
 import numpy as np
 from ema_workbench.util import info
 
+from .blocked_distance import row_offset, sse_block
+
 
 def distance_same_length(series1, series2, wDim1, wDim2):
     '''
@@ -271,7 +275,9 @@ def distance_gonenc(data,
                     filterCurvature=True,
                     tHoldCurvature=0.1,
                     addMidExtension=True,
-                    addEndExtension=True
+                    addEndExtension=True,
+                    block_size=None,
+                    n_jobs=1
                     ):
     
     '''
@@ -311,6 +317,12 @@ def distance_gonenc(data,
                             should be extended by introducing startup/closing 
                             sections at the beginning/end of the vector.
                             (default=True)
+    :param block_size: if provided, the feature vectors are grouped by their
+                       length and the distances are calculated in blocks of 
+                       block_size data series using matrix operations, see
+                       :func:`distance_grouped`. (default=None)
+    :param n_jobs: number of threads used for calculating the blocks, only 
+                   used if block_size is provided. (default=1)
     '''
     
     
@@ -320,6 +332,18 @@ def distance_gonenc(data,
     features = construct_features(data, filterSlope, tHoldSlope, 
                                   filterCurvature, tHoldCurvature, 
                                   addMidExtension, addEndExtension)
+    
+    if block_size:
+        for i in range(data.shape[0]):
+            behaviorDesc = {'Index':str(i), 
+                            'Feature vector':str(features[i])}
+            runLogs.append((behaviorDesc, data[i]))
+        
+        dRow = distance_grouped(features, wSlopeError, wCurvatureError, 
+                                sisterCount, block_size=block_size, 
+                                n_jobs=n_jobs)
+        return dRow, runLogs
+    
     info("calculating distances")
     dRow = np.zeros(shape=(np.sum(np.arange(data.shape[0])), ))
     index = -1
@@ -358,6 +382,131 @@ def distance_gonenc(data,
     return dRow, runLogs
 
 
+def weighted_sse(a, b, weights):
+    '''
+    Weighted sum of squared errors between each feature vector in a and
+    each feature vector in b. 
+    
+    :param a: Feature vectors (3-dimensional numpy array, series by 
+              section by dimension)
+    :param b: Feature vectors of the same length as those in a.
+    :param weights: Weight of the error for each dimension.
+    
+    The sse of (nearly) identical feature vectors is calculated directly, 
+    see :func:`~blocked_distance.sse_block`, so the errors are never 
+    negative.
+    '''
+    error = np.zeros((a.shape[0], b.shape[0]))
+    for k, weight in enumerate(weights):
+        a_k = np.ascontiguousarray(a[:, :, k])
+        b_k = np.ascontiguousarray(b[:, :, k])
+        sse = sse_block(a_k, b_k, np.einsum('ij,ij->i', a_k, a_k),
+                        np.einsum('ij,ij->i', b_k, b_k))
+        error += weight*sse
+    return error
+
+def distance_grouped(features, wDim1, wDim2, sisterCount, block_size=256, 
+                     n_jobs=1):
+    '''
+    Calculates the condensed distance row for the feature vectors. The 
+    feature vectors are grouped by their length, and the distances between 
+    two groups are calculated in blocks using matrix operations. The sisters 
+    of a short feature vector are created once for each length of the 
+    feature vectors it is compared to, rather than once for each pair. So,
+    the distances between feature vectors of the same length are identical to
+    those of :func:`distance_gonenc`, while the distances between feature 
+    vectors of different length differ only in the random sisters used.
+    
+    :param features: list of feature vectors (2-dimensional numpy arrays).
+    :param wDim1: Weight of the error between the 1st dimensions of the two 
+                  feature vectors (i.e. Slope).
+    :param wDim2: Weight of the error between the 2nd dimensions of the two 
+                  feature vectors (i.e. Curvature).
+    :param sisterCount: Number of long-versions that will be created for the 
+                        short vector.
+    :param block_size: Number of feature vectors in a block.
+    :param n_jobs: Number of threads for calculating the blocks.
+    '''
+    info("calculating distances")
+    
+    n = len(features)
+    dRow = np.zeros(shape=((n*(n-1))//2, ))
+    weights = [wDim1, wDim2]
+    
+    groups = defaultdict(list)
+    for i, feature in enumerate(features):
+        groups[feature.shape[1]].append(i)
+    
+    # group by length, the features of a group are a 3d array 
+    # (series, section, dimension)
+    lengths = sorted(groups.keys())
+    indices = {length:np.asarray(groups[length]) for length in lengths}
+    stacked = {length:np.asarray([features[i].T for i in groups[length]]) 
+               for length in lengths}
+    
+    def store(rows, columns, distances):
+        rows, columns = np.meshgrid(rows, columns, indexing='ij')
+        i = np.minimum(rows, columns)
+        j = np.maximum(rows, columns)
+        upper = i < j
+        i = i[upper]
+        j = j[upper]
+        dRow[row_offset(i, n) + j - i - 1] = distances[upper]
+    
+    def calculate_block(task):
+        short_length, long_length, start = task
+        
+        rows = indices[short_length][start:start+block_size]
+        short = stacked[short_length][start:start+block_size]
+        
+        if short_length == long_length:
+            # only compare with the blocks from here onwards
+            for column in range(start, indices[long_length].shape[0], 
+                                block_size):
+                columns = indices[long_length][column:column+block_size]
+                long = stacked[long_length][column:column+block_size]
+                
+                distances = weighted_sse(short, long, weights)/long_length
+                store(rows, columns, distances)
+        else:
+            # the sisters of each short feature vector are created once and
+            # used for all feature vectors of this length
+            sisters = np.concatenate([create_sisters(features[i], 
+                                                     (2, long_length), 
+                                                     sisterCount)
+                                      for i in rows])
+            
+            for column in range(0, indices[long_length].shape[0], 
+                                block_size):
+                columns = indices[long_length][column:column+block_size]
+                long = stacked[long_length][column:column+block_size]
+                
+                distances = weighted_sse(sisters, long, weights)
+                distances = distances.reshape((rows.shape[0], sisterCount, 
+                                               columns.shape[0]))
+                distances = np.min(distances, axis=1)/long_length
+                store(rows, columns, distances)
+    
+    tasks = []
+    for a, short_length in enumerate(lengths):
+        for long_length in lengths[a::]:
+            for start in range(0, indices[short_length].shape[0], 
+                               block_size):
+                tasks.append((short_length, long_length, start))
+    
+    if n_jobs > 1:
+        pool = ThreadPool(n_jobs)
+        try:
+            pool.map(calculate_block, tasks)
+        finally:
+            pool.close()
+    else:
+        for task in tasks:
+            calculate_block(task)
+    
+    return dRow
+
+
 if __name__ == '__main__':
     tester = np.array([(0, 1, 4, 8,16,24,30,34,36,39,34,38,34)])
     #tester = np.array([(0, 3, 10,8,16,24,30,34,36,39,34,30,29),(0, 3, 10,8,16,24,30,34,36,39,34,30,29),(0, 3, 10,8,16,24,30,34,36,39,34,30,29)])
@@ -7,12 +7,14 @@ import numpy as np
 
 from ema_workbench.util import info
 
+from .blocked_distance import distance_blocked
+
 def msedist(d1,d2):
     sse = ((d1-d2)**2).sum()
     mse = np.average(sse)
     return mse
 
-def distance_mse(data):
+def distance_mse(data, block_size=None, n_jobs=1, filename=None):
     '''
     The MSE (mean squared-error) distance is equal to the SSE distance divided by the number of data points in data series.
     
@@ -23,7 +25,15 @@ def distance_mse(data):
     Given that SSE is calculated as given above, MSE equals SSE divided by N.
     
     As SSE distance, the MSE distance only works with data series of equal length.
+    
+    If block_size is provided, the distances are calculated in blocks of 
+    block_size by block_size data series using matrix operations, see
+    :func:`blocked_distance.distance_blocked`. n_jobs and filename are 
+    only used in this case. 
     '''
+    if block_size:
+        return distance_blocked(data, 'mse', block_size=block_size, 
+                                n_jobs=n_jobs, filename=filename)
     
     runLogs = []
     #Generates the feature vectors for all the time series that are contained in numpy array data
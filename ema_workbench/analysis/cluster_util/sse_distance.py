@@ -9,12 +9,14 @@ import numpy as np
 
 from ema_workbench.util import info
 
+from .blocked_distance import distance_blocked
+
 def ssedist(d1,d2):
     d = ((d1-d2)**2).sum()
 #    print d
     return d
 
-def distance_sse(data):
+def distance_sse(data, block_size=None, n_jobs=1, filename=None):
     
     '''
     The SSE (sum of squared-errors) distance between two data series is equal to the sum of squared-errors between corresponding data points of these two data series.
@@ -24,7 +26,15 @@ def distance_sse(data):
     Since SSE calculation is based on pairwise comparison of individual data points, the data series should be of equal length.
     
     SSE distance equals to the square of Euclidian distance, which is a commonly used distance metric in time series comparisons.
+    
+    If block_size is provided, the distances are calculated in blocks of 
+    block_size by block_size data series using matrix operations, see
+    :func:`blocked_distance.distance_blocked`. n_jobs and filename are 
+    only used in this case. 
     '''
+    if block_size:
+        return distance_blocked(data, 'sse', block_size=block_size, 
+                                n_jobs=n_jobs, filename=filename)
     
     runLogs = []
     #Generates the feature vectors for all the time series that are contained in numpy array data
@@ -8,6 +8,8 @@ Created on Nov 24, 2011
 import numpy as np
 from ema_workbench.util import info
 
+from .blocked_distance import distance_blocked
+
 
 def trdist(d1,d2):
     
@@ -18,7 +20,7 @@ def trdist(d1,d2):
     print(d)
     return d
 
-def distance_triangle(data):
+def distance_triangle(data, block_size=None, n_jobs=1, filename=None):
     '''
     The triangle distance is calculated as follows;
         Let ds1(.) and ds2(.) be two data series of length N. Then;
@@ -32,7 +34,15 @@ def distance_triangle(data):
      
      In the literature, it is claimed that the triangle distance can deal with noise and amplitude scaling very well, and may yield poor
      results in cases of offset translation and linear drift.   
+    
+    If block_size is provided, the distances are calculated in blocks of 
+    block_size by block_size data series using matrix operations, see
+    :func:`blocked_distance.distance_blocked`. n_jobs and filename are 
+    only used in this case. 
     '''
+    if block_size:
+        return distance_blocked(data, 'triangle', block_size=block_size, 
+                                n_jobs=n_jobs, filename=filename)
     
     
     
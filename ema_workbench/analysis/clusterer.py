@@ -99,6 +99,19 @@ def cluster(data,
                           change__in_the_slope/average_value_of_the_slope < 
                           threshold, consider curvature = 0) (for bmd distance)
     * 'no of sisters': 50 (for bmd distance)
+    * 'block_size': if provided, the feature vectors are grouped by length, 
+                    and the distances are calculated in blocks using matrix 
+                    operations, rather than pair by pair. 
+    * 'n_jobs': the number of threads for calculating the blocks
+    
+    SSE, MSE, and Triangle Distance:
+    
+    * 'block_size': if provided, the distances are calculated in blocks 
+                    of block_size by block_size data series using matrix 
+                    operations, rather than pair by pair.
+    * 'n_jobs': the number of threads for calculating the blocks
+    * 'filename': file name for storing the distances in a memory mapped
+                  file, rather than in memory
 
     '''
     
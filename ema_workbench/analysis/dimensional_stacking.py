@@ -10,6 +10,11 @@ instead. It is also possible to use the code provided here in combination
 with any other feature scoring or factor prioritization technique instead, or
 by simply selecting uncertain factors in some other manner. 
 
+For large numbers of cases, the pivot table is not created with pandas, but 
+with a :class:`BinnedAggregation`. This determines the bin of each case for
+each uncertain factor, combines these into a single cell index, and 
+aggregates the outcome for all cells at once. Cases can be added in chunks, 
+so the cases need not all be in memory at the same time.
 
 '''
 from __future__ import (division, unicode_literals, print_function,
@@ -22,6 +27,7 @@ import pandas as pd
 import seaborn as sns
 
 from . import feature_scoring
+from ..util import EMAError
 
 
 # Created on Nov 13, 2015
@@ -79,6 +85,256 @@ def discretize(data, nbins=3, with_labels=False):
     return discretized
 
 
+def determine_bins(data, names=None, nbins=3):
+    ''' Determine the bins for each column, using the same rules as 
+    :func:`discretize`.
+    
+    Parameters
+    ----------
+    data : DataFrame or structured array
+    names : list of str, optional
+            the columns for which to determine the bins, defaults to all
+            columns
+    nbins : int, optional
+            the number of bins to use (default is 3)
+    
+    Returns
+    -------
+    dict
+        with for each column either the bin edges, or, for categorical 
+        columns, the sorted categories
+    
+    '''
+    if names is None:
+        try:
+            names = data.columns
+        except AttributeError:
+            names = data.dtype.names
+    
+    bins = {}
+    for name in names:
+        values = np.asarray(data[name])
+        
+        if values.dtype == np.dtype(object):
+            bins[name] = np.unique(values)
+            continue
+        
+        n = nbins
+        if issubclass(values.dtype.type, np.integer):
+            n = min(n, np.unique(values).shape[0])
+        bins[name] = _cut_edges(values.min(), values.max(), n)
+    return bins
+
+
+def _cut_edges(minimum, maximum, n):
+    '''equal width bin edges as used by pd.cut for n bins'''
+    minimum = float(minimum)
+    maximum = float(maximum)
+    
+    if minimum == maximum:
+        minimum -= 0.001 * abs(minimum) if minimum != 0 else 0.001
+        maximum += 0.001 * abs(maximum) if maximum != 0 else 0.001
+        return np.linspace(minimum, maximum, n+1)
+    
+    edges = np.linspace(minimum, maximum, n+1)
+    edges[0] -= (maximum-minimum) * 0.001
+    return edges
+
+
+class BinnedAggregation(object):
+    ''' Aggregate an outcome over the cells of a dimensional stack.
+    
+    The bin codes of the row and column factors are combined into a single 
+    cell index, with the first row factor as the most significant digit and 
+    the last column factor as the least significant one. The count and sum 
+    of the outcome for all cells are then calculated with np.bincount. 
+    Because the cells are ordered in the same way as the stacked table, 
+    the result can be reshaped directly into the table. 
+    
+    Cases can be added in chunks using :meth:`update`. In this case, the 
+    bins have to be known beforehand, for example from the bounds of the 
+    uncertain factors.
+    
+    Parameters
+    ----------
+    bins : dict
+           for each factor the bin edges or the sorted categories, see
+           :func:`determine_bins`
+    rows : list of str
+    columns : list of str
+    
+    Attributes
+    ----------
+    count : 1d ndarray
+            the number of cases in each cell
+    sum : 1d ndarray
+          the sum of the outcome over the cases in each cell
+    
+    '''
+    
+    statistics = ['mean', 'count', 'sum']
+    
+    def __init__(self, bins, rows, columns):
+        self.rows = list(rows)
+        self.columns = list(columns)
+        self.bins = {name:np.asarray(bins[name]) for name in 
+                     self.rows+self.columns}
+        self.shape = tuple(self._nr_bins(name) for name in 
+                           self.rows+self.columns)
+        
+        size = int(np.prod(self.shape))
+        self.count = np.zeros((size,), dtype=np.int64)
+        self.sum = np.zeros((size,))
+    
+    def _nr_bins(self, name):
+        bins = self.bins[name]
+        if bins.dtype == np.dtype(object):
+            return bins.shape[0]
+        return bins.shape[0]-1
+    
+    def codes(self, data, name):
+        ''' The bin code for each case for the specified factor
+        
+        Parameters
+        ----------
+        data : DataFrame or structured array
+        name : str
+        
+        Returns
+        -------
+        1d ndarray
+        
+        Raises
+        ------
+        EMAError
+            if a value falls outside the bins
+        
+        '''
+        values = np.asarray(data[name])
+        bins = self.bins[name]
+        nr_bins = self._nr_bins(name)
+        
+        if bins.dtype == np.dtype(object):
+            codes = np.searchsorted(bins, values)
+            invalid = (codes == nr_bins)
+            invalid[~invalid] = bins[codes[~invalid]] != values[~invalid]
+        else:
+            # bins are closed on the right, like pd.cut
+            codes = np.searchsorted(bins, values, side='left') - 1
+            invalid = (codes < 0) | (codes >= nr_bins)
+        
+        if np.any(invalid):
+            raise EMAError("values of {} outside of bins".format(name))
+        return codes
+    
+    def update(self, x, y):
+        ''' Add the cases in x and y
+        
+        Parameters
+        ----------
+        x : DataFrame or structured array
+        y : 1d ndarray
+        
+        '''
+        y = np.asarray(y)
+        cells = np.zeros(y.shape, dtype=np.intp)
+        for name, nr_bins in zip(self.rows+self.columns, self.shape):
+            cells *= nr_bins
+            cells += self.codes(x, name)
+        
+        size = self.count.shape[0]
+        self.count += np.bincount(cells, minlength=size)
+        self.sum += np.bincount(cells, weights=y, minlength=size)
+    
+    def table(self, statistic='mean'):
+        ''' The stacked table for the statistic
+        
+        Parameters
+        ----------
+        statistic : {'mean', 'count', 'sum'}, optional
+                    for a boolean outcome, the mean is the fraction of 
+                    cases of interest in a cell
+        
+        Returns
+        -------
+        DataFrame
+            with a (multi) index of bin codes for the rows and columns. 
+            The mean is NaN for empty cells.
+        
+        Raises
+        ------
+        EMAError
+            if the statistic is unknown
+        
+        '''
+        if statistic == 'mean':
+            with np.errstate(invalid='ignore', divide='ignore'):
+                values = self.sum / self.count
+        elif statistic == 'count':
+            values = self.count
+        elif statistic == 'sum':
+            values = self.sum
+        else:
+            raise EMAError("unknown statistic: {}".format(statistic))
+        
+        nr_rows = int(np.prod(self.shape[0:len(self.rows)]))
+        values = values.reshape((nr_rows, -1))
+        return pd.DataFrame(values, index=self._index(self.rows), 
+                            columns=self._index(self.columns))
+    
+    def _index(self, names):
+        levels = [range(self._nr_bins(name)) for name in names]
+        if len(names) == 1:
+            return pd.Index(levels[0], name=names[0])
+        return pd.MultiIndex.from_product(levels, names=names)
+
+
+def binned_pivot_table(x, y, rows, columns, nbins=3, statistic='mean',
+                       bins=None, chunksize=None):
+    ''' Make a pivot table using a :class:`BinnedAggregation`
+    
+    This gives the same table as discretizing x and using 
+    :func:`make_pivot_table`, except that bins without any cases are
+    included.
+    
+    Parameters
+    ----------
+    x : DataFrame or structured array
+    y : 1d ndarray
+    rows : iterable of str
+    columns : iterable of str
+    nbins : int, optional
+            the number of bins to use, only used if bins is not provided
+    statistic : {'mean', 'count', 'sum'}, optional
+    bins : dict, optional
+           the bins for each factor, see :func:`determine_bins` 
+    chunksize : int, optional
+                if provided, the cases are aggregated in chunks of this 
+                size, limiting the memory used for the cell indices
+    
+    Returns
+    -------
+    DataFrame
+    
+    '''
+    rows = list(rows)
+    columns = list(columns)
+    
+    if bins is None:
+        bins = determine_bins(x, rows+columns, nbins=nbins)
+    
+    aggregation = BinnedAggregation(bins, rows, columns)
+    
+    if chunksize is None:
+        aggregation.update(x, y)
+    else:
+        for start in range(0, y.shape[0], chunksize):
+            aggregation.update(x[start:start+chunksize], 
+                               y[start:start+chunksize])
+    
+    return aggregation.table(statistic)
+
+
 def dim_ratios(axis, figsize, side_colors_ratio=0.05):
     """Get the proportions of the figure taken up by each axes
     
@@ -367,15 +623,7 @@ def create_pivot_plot(x, y, nr_levels=3, labels=True, categories=True,
     rows = [entry for entry in scores[0:n:2]]
     columns = [entry for entry in scores[1:n:2]]
 
-    data = pd.DataFrame.from_records(x)
-    discretized_x = discretize(data, nbins=3)
-    
-    ooi_label = 'y'
-    ooi = pd.DataFrame(y[:, np.newaxis], columns=[ooi_label])
-    
-    x_y_concat = pd.concat([discretized_x, ooi], axis=1)
-    pvt = make_pivot_table(x_y_concat, rows=rows, columns=columns, 
-                           values=ooi_label)
+    pvt = binned_pivot_table(x, y, rows=rows, columns=columns, nbins=nbins)
 
     fig = plot_pivot_table(pvt, plot_labels=labels, plot_cats=categories)
     
@@ -7,6 +7,8 @@ Feature scoring functionality
 from __future__ import (absolute_import, print_function, division,
                         unicode_literals)
 
+import multiprocessing
+import time
 from operator import itemgetter
 
 import numpy as np
@@ -22,6 +24,7 @@ from sklearn.linear_model.randomized_l1 import (RandomizedLogisticRegression,
                                                 RandomizedLasso)
 
 from .scenario_discovery_util import CLASSIFICATION, REGRESSION
+from ..util import info
 import collections
 
 # Created on Jul 9, 2014
@@ -43,6 +46,39 @@ F_CLASSIFICATION = f_classif
 CHI2 = chi2
 
 
+PreparedExperiments = collections.namedtuple('PreparedExperiments', 
+                                             ['uncs', 'x'])
+'''the names of the uncertainties and the experiments as returned by 
+:func:`_prepare_experiments`, so the experiments can be prepared once and 
+used for several outcomes'''
+
+
+def prepare_experiments(experiments):
+    '''
+    transform the experiments structured array into a numpy array once, so 
+    it can be passed to the feature scoring functions for several outcomes. 
+    
+    Parameters
+    ----------
+    experiments : structured array
+    
+    Returns
+    -------
+    PreparedExperiments
+    
+    '''
+    uncs = recfunctions.get_names(experiments.dtype)
+    return PreparedExperiments(uncs, _prepare_experiments(experiments))
+
+
+def _get_prepared(experiments):
+    '''returns the names of the uncertainties and the experiments as 
+    numpy array, preparing the experiments if this was not yet done'''
+    if isinstance(experiments, PreparedExperiments):
+        return experiments
+    return prepare_experiments(experiments)
+
+
 def _prepare_experiments(experiments):
     '''
     transform the experiments structured array into a numpy array.
@@ -125,7 +161,7 @@ def get_univariate_feature_scores(x,y, score_func=F_CLASSIFICATION):
     
     Parameters
     ----------
-    x : structured array
+    x : structured array or PreparedExperiments
     y : 1D nd.array
     score_func : {F_CLASSIFICATION, F_REGRESSION, CHI2}
                 the score function to use, one of f_regression (regression), or  
@@ -138,9 +174,7 @@ def get_univariate_feature_scores(x,y, score_func=F_CLASSIFICATION):
     
     
     '''
-    uncs = recfunctions.get_names(x.dtype)
-    
-    x = _prepare_experiments(x)
+    uncs, x = _get_prepared(x)
     
     pvalues = score_func(x, y)[1]
     pvalues = np.asarray(pvalues)
@@ -157,13 +191,14 @@ def get_univariate_feature_scores(x,y, score_func=F_CLASSIFICATION):
 def get_rf_feature_scores(x, y, mode=CLASSIFICATION, nr_trees=250, 
                           max_features='auto', max_depth=None, 
                           min_samples_split=2, min_samples_leaf=1, 
-                          bootstrap=True, oob_score=True, random_state=None): 
+                          bootstrap=True, oob_score=True, random_state=None,
+                          increment=None, tolerance=0.01, min_nr_trees=None): 
     '''
     Get feature scores using a random forest
 
     Parameters
     ----------
-    x : structured array
+    x : structured array or PreparedExperiments
     y : 1D nd.array
     mode : {CLASSIFICATION, REGRESSION}
     nr_trees : int, optional
@@ -182,6 +217,19 @@ def get_rf_feature_scores(x, y, mode=CLASSIFICATION, nr_trees=250,
                 see http://scikit-learn.org/stable/modules/generated/sklearn.ensemble.RandomForestClassifier.html
     random_state : int, optional
                    see http://scikit-learn.org/stable/modules/generated/sklearn.ensemble.RandomForestClassifier.html
+    increment : int, optional
+                if provided, the forest is grown in steps of increment trees
+                until the feature scores have converged, with nr_trees as 
+                maximum. The number of trees used is the n_estimators of the 
+                returned forest. 
+    tolerance : float, optional
+                the feature scores have converged if the ranking of the 
+                uncertainties is unchanged and no feature score changed by 
+                more than tolerance after adding increment trees 
+                (default=0.01)
+    min_nr_trees : int, optional
+                   the number of trees to grow before checking for 
+                   convergence, only used if increment is provided
     
     Returns
     -------
@@ -193,8 +241,7 @@ def get_rf_feature_scores(x, y, mode=CLASSIFICATION, nr_trees=250,
     
     '''
     
-    uncs = recfunctions.get_names(x.dtype)
-    x = _prepare_experiments(x)
+    uncs, x = _get_prepared(x)
     
     if mode==CLASSIFICATION:
         rfc = RandomForestClassifier
@@ -214,7 +261,7 @@ def get_rf_feature_scores(x, y, mode=CLASSIFICATION, nr_trees=250,
                 bootstrap=bootstrap,
                 oob_score=oob_score,
                 random_state=random_state)
-    forest.fit(x,y)
+    _fit_forest(forest, x, y, nr_trees, increment, tolerance, min_nr_trees)
 
     importances = forest.feature_importances_
 
@@ -227,6 +274,52 @@ def get_rf_feature_scores(x, y, mode=CLASSIFICATION, nr_trees=250,
     return importances, forest
 
 
+def _fit_forest(forest, x, y, nr_trees, increment, tolerance, 
+                min_nr_trees=None):
+    '''
+    fit the forest. If increment is provided, the forest is grown in steps
+    of increment trees, reusing the trees fitted so far, until the feature 
+    scores have converged or nr_trees is reached. Convergence is checked 
+    from min_nr_trees onwards.
+    
+    Parameters
+    ----------
+    forest : a forest estimator
+    x : ndarray
+    y : 1D nd.array
+    nr_trees : int
+    increment : int or None
+    tolerance : float
+    min_nr_trees : int, optional
+    
+    '''
+    if not increment:
+        forest.fit(x, y)
+        return
+    
+    forest.set_params(warm_start=True)
+    
+    n = min(max(increment, min_nr_trees or 0), nr_trees)
+    forest.set_params(n_estimators=n)
+    forest.fit(x, y)
+    importances = forest.feature_importances_
+    
+    while n < nr_trees:
+        n = min(n+increment, nr_trees)
+        forest.set_params(n_estimators=n)
+        forest.fit(x, y)
+        
+        new_importances = forest.feature_importances_
+        same_ranking = np.all(np.argsort(importances, kind='mergesort') == 
+                              np.argsort(new_importances, kind='mergesort'))
+        change = np.max(np.abs(new_importances-importances))
+        if same_ranking and (change <= tolerance):
+            break
+        importances = new_importances
+    
+    info("feature scores determined with {} trees".format(n))
+
+
 def get_lasso_feature_scores(x, y, mode=CLASSIFICATION, scaling=0.5, 
                              sample_fraction=0.75, n_resampling=200,
                              random_state=None):
@@ -240,7 +333,7 @@ def get_lasso_feature_scores(x, y, mode=CLASSIFICATION, scaling=0.5,
     
     Parameters
     ----------   
-    x : structured array
+    x : structured array or PreparedExperiments
     y : 1D nd.array
     mode : {CLASSIFICATION, REGRESSION}
     scaling : float, optional
@@ -263,9 +356,7 @@ def get_lasso_feature_scores(x, y, mode=CLASSIFICATION, scaling=0.5,
          
     '''
     
-    uncs = recfunctions.get_names(x.dtype)
-    
-    x = _prepare_experiments(x)
+    uncs, x = _get_prepared(x)
     
     if mode==CLASSIFICATION:
 
@@ -302,13 +393,14 @@ def get_ex_feature_scores(x, y, mode=CLASSIFICATION, nr_trees=250,
                           max_features='auto', max_depth=None, 
                           min_samples_split=2, min_samples_leaf=1, 
                           min_weight_fraction_leaf=0, max_leaf_nodes=None,
-                          bootstrap=True, oob_score=True, random_state=None): 
+                          bootstrap=True, oob_score=True, random_state=None,
+                          increment=None, tolerance=0.01, min_nr_trees=None): 
     '''
     Get feature scores using extra trees
 
     Parameters
     ----------
-    x : structured array
+    x : structured array or PreparedExperiments
     y : 1D nd.array
     mode : {CLASSIFICATION, REGRESSION}
     nr_trees : int, optional
@@ -331,6 +423,19 @@ def get_ex_feature_scores(x, y, mode=CLASSIFICATION, nr_trees=250,
                 see http://scikit-learn.org/stable/modules/generated/sklearn.ensemble.ExtraTreesClassifier.html
     random_state : int, optional
                    see http://scikit-learn.org/stable/modules/generated/sklearn.ensemble.ExtraTreesClassifier.html
+    increment : int, optional
+                if provided, the forest is grown in steps of increment trees
+                until the feature scores have converged, with nr_trees as 
+                maximum. The number of trees used is the n_estimators of the 
+                returned forest. 
+    tolerance : float, optional
+                the feature scores have converged if the ranking of the 
+                uncertainties is unchanged and no feature score changed by 
+                more than tolerance after adding increment trees 
+                (default=0.01)
+    min_nr_trees : int, optional
+                   the number of trees to grow before checking for 
+                   convergence, only used if increment is provided
     
     Returns
     -------
@@ -342,8 +447,7 @@ def get_ex_feature_scores(x, y, mode=CLASSIFICATION, nr_trees=250,
     
     '''
     
-    uncs = recfunctions.get_names(x.dtype)
-    x = _prepare_experiments(x)
+    uncs, x = _get_prepared(x)
     
     if mode==CLASSIFICATION:
         etc = ExtraTreesClassifier
@@ -365,7 +469,8 @@ def get_ex_feature_scores(x, y, mode=CLASSIFICATION, nr_trees=250,
                       bootstrap=bootstrap,
                       oob_score=oob_score,
                       random_state=random_state)
-    extra_trees.fit(x,y)
+    _fit_forest(extra_trees, x, y, nr_trees, increment, tolerance, 
+                min_nr_trees)
 
     importances = extra_trees.feature_importances_
 
@@ -383,17 +488,24 @@ algorithms = {'extra trees' : get_ex_feature_scores,
               'univariate' : get_univariate_feature_scores}
 
 def get_feature_scores_all(x, y, alg='extra trees', mode=REGRESSION,
-                   **kwargs):
+                           n_jobs=1, **kwargs):
     '''perform feature scoring for all outcomes using the specified feature 
     scoring algorithm
     
+    The experiments are prepared only once for all outcomes. The time taken 
+    by preparing the experiments, scoring the outcomes and combining the 
+    scores is logged at info level.
+    
     Parameters
     ----------
-    x : numpy structured array
+    x : numpy structured array or PreparedExperiments
     y : dict of 1d numpy arrays
         the outcomes, with a string as key, and a 1D array for each outcome
     alg : {'extra trees', 'lasso', 'random forest', 'univariate'}, optional
     mode : {REGRESSION, CLASSIFICATION}, optional
+    n_jobs : int, optional
+             the number of processes over which the outcomes are spread. If 
+             -1, the number of cpu's is used. 
     kwargs : dict, optional
              any remaining keyword arguments will be passed to the specific
              feature scoring algorithm
@@ -404,17 +516,164 @@ def get_feature_scores_all(x, y, alg='extra trees', mode=REGRESSION,
     
     
     '''
-    complete = None
-    for key, value in list(y.items()):
-        fs, _ = algorithms[alg](x,value,mode=mode, **kwargs)
+    start = time.time()
+    x = _get_prepared(x)
+    info("preparing experiments took {:.3g} seconds".format(time.time()-start))
+    
+    if n_jobs == -1:
+        n_jobs = multiprocessing.cpu_count()
+    
+    start = time.time()
+    keys = list(y.keys())
+    if n_jobs > 1:
+        pool = multiprocessing.Pool(n_jobs, initializer=_setup_scoring,
+                                    initargs=(x, alg, mode, kwargs))
+        try:
+            scores = pool.map(_score_outcome, [y[key] for key in keys])
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        _setup_scoring(x, alg, mode, kwargs)
+        scores = [_score_outcome(y[key]) for key in keys]
+    info("scoring {} outcomes took {:.3g} seconds".format(len(keys),
+                                                          time.time()-start))
+    
+    start = time.time()
+    index = scores[0][0].values
+    complete = [fs.set_index(0)[1].reindex(index).rename(key) for key, fs 
+                in zip(keys, scores)]
+    complete = pd.concat(complete, axis=1)
+    complete.index.name = 0
+    info("combining scores took {:.3g} seconds".format(time.time()-start))
+    
+    return complete
 
-        fs = fs.rename(columns={1:key})
-        fs = fs.set_index(0)
 
-        if complete is None:
-            complete = fs.T
-        else:
-            complete = complete.append(fs.T)
+def _setup_scoring(x, alg, mode, kwargs):
+    '''initializer of the processes used by 
+    :func:`get_feature_scores_all` and 
+    :func:`get_feature_scores_over_time`'''
+    global _scoring
+    _scoring = (x, alg, mode, kwargs)
 
-    return complete.T
 
+def _score_outcome(y):
+    '''feature scores for a single outcome with the experiments and 
+    algorithm set up by :func:`_setup_scoring`'''
+    x, alg, mode, kwargs = _scoring
+    fs = algorithms[alg](x, y, mode=mode, **kwargs)
+    
+    # some algorithms also return the fitted estimator
+    if isinstance(fs, tuple):
+        fs = fs[0]
+    return fs
+
+
+def get_feature_scores_over_time(x, y, alg='extra trees', mode=REGRESSION,
+                                 time_points=None, stride=1, n_jobs=1, 
+                                 warm_start=False, **kwargs):
+    '''perform feature scoring for each time point of a time series 
+    outcome using the specified feature scoring algorithm
+    
+    The experiments are prepared only once for all time points. The time 
+    points are split into consecutive chunks, which are spread over a 
+    process pool.
+    
+    Parameters
+    ----------
+    x : numpy structured array or PreparedExperiments
+    y : 2D numpy array
+        the time series outcome, with a row for each experiment, and a 
+        column for each time point
+    alg : {'extra trees', 'lasso', 'random forest', 'univariate'}, optional
+    mode : {REGRESSION, CLASSIFICATION}, optional
+    time_points : list of int, optional
+                  the columns of y for which to calculate feature scores,
+                  defaults to every stride-th column
+    stride : int, optional
+    n_jobs : int, optional
+             the number of processes over which the time points are spread.
+             If -1, the number of cpu's is used. 
+    warm_start : bool, optional
+                 only for 'extra trees' and 'random forest' with an 
+                 increment (see :func:`get_ex_feature_scores`). If True, the 
+                 growing of the forest for a time point starts from the 
+                 number of trees needed for the previous time point, rather
+                 than from increment trees. Convergence is first checked at
+                 one increment below that number, so the number of trees 
+                 can also go down. Each chunk of time points starts anew, 
+                 so with warm_start the number of trees, and hence the 
+                 feature scores, depend on n_jobs. 
+    kwargs : dict, optional
+             any remaining keyword arguments will be passed to the specific
+             feature scoring algorithm
+    
+    Returns
+    -------
+    DataFrame instance
+        with the feature scores, with a row for each time point and a 
+        column for each uncertainty
+    
+    Raises
+    ------
+    ValueError
+        if warm_start is used without an increment
+    
+    '''
+    if warm_start and not kwargs.get('increment'):
+        raise ValueError('warm_start requires an increment')
+    
+    x = _get_prepared(x)
+    
+    if time_points is None:
+        time_points = list(range(0, y.shape[1], stride))
+    
+    if n_jobs == -1:
+        n_jobs = multiprocessing.cpu_count()
+    
+    chunks = [chunk.tolist() for chunk in 
+              np.array_split(np.asarray(time_points), max(n_jobs, 1)) 
+              if chunk.shape[0]]
+    
+    if n_jobs > 1:
+        pool = multiprocessing.Pool(n_jobs, initializer=_setup_scoring,
+                                    initargs=(x, alg, mode, kwargs))
+        try:
+            scores = pool.map(_score_time_points, 
+                              [(y[:, chunk], warm_start) for chunk in chunks])
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        _setup_scoring(x, alg, mode, kwargs)
+        scores = [_score_time_points((y[:, chunk], warm_start)) for chunk 
+                  in chunks]
+    
+    scores = [entry for chunk in scores for entry in chunk]
+    scores = [fs.set_index(0)[1].reindex(x.uncs).values for fs in scores]
+    return pd.DataFrame(scores, index=time_points, columns=x.uncs)
+
+
+def _score_time_points(args):
+    '''feature scores for each column of y with the experiments and 
+    algorithm set up by :func:`_setup_scoring`'''
+    y, warm_start = args
+    x, alg, mode, kwargs = _scoring
+    kwargs = dict(kwargs)
+    
+    scores = []
+    for i in range(y.shape[1]):
+        fs = algorithms[alg](x, y[:, i], mode=mode, **kwargs)
+        
+        # some algorithms also return the fitted estimator
+        if isinstance(fs, tuple):
+            fs, estimator = fs
+            if warm_start:
+                # the first check for convergence is at one increment 
+                # below the number of trees of the previous time point, so
+                # the number of trees can go down again
+                kwargs['min_nr_trees'] = (estimator.n_estimators - 
+                                          2*kwargs['increment'])
+        scores.append(fs)
+    return scores
@@ -17,7 +17,10 @@ from __future__ import (absolute_import, print_function, division,
                         unicode_literals)
 
 import copy
+import itertools
 import math
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 from operator import itemgetter
 
 import matplotlib as mpl
@@ -50,13 +53,17 @@ from . import scenario_discovery_util as sdutil
 
 # TODO:: make separate qp-test for the lower limit and the upper limit
 
-__all__ = ['ABOVE', 'BELOW', 'setup_prim', 'Prim', 'PrimBox', 'PrimException',
-           'MultiBoxesPrim']
+__all__ = ['ABOVE', 'BELOW', 'BASIC', 'SORTED', 'setup_prim', 'Prim', 
+           'PrimBox', 'PrimException', 'MultiBoxesPrim', 'PrimBatch']
 
 LENIENT2 = 'lenient2'
 LENIENT1 = 'lenient1'
 ORIGINAL = 'original'
 
+# peeling engines
+BASIC = 'basic'
+SORTED = 'sorted'
+
 ABOVE = 1
 BELOW = -1
 PRECISION = '.2f'
@@ -76,9 +83,7 @@ def get_quantile(data, quantile):
     assert quantile>0
     assert quantile<1
  
-    data = data.compressed()
-    data = list(data) #TODO do we really need a list? I doubt it
-    data.sort()    
+    data = np.sort(data.compressed())
     
     i = (len(data)-1)*quantile
     index_lower =  int(math.floor(i))
@@ -181,7 +186,11 @@ class CurEntry(object):
         self.name = name
         
     def __get__(self, instance, owner):
-        return instance.peeling_trajectory[self.name][instance._cur_box]
+        column = PrimBox.columns.index(self.name)
+        value = instance._stats[instance._cur_box, column]
+        if self.name == 'res dim':
+            value = int(value)
+        return value
     
     def __set__(self, instance, value):
         raise PrimException("this property cannot be assigned to")
@@ -205,7 +214,7 @@ class PrimBox(object):
     peeling_trajectory : pandas dataframe
                          stats for each box in peeling trajectory
     box_lims : list
-               list of box lims for each box in peeling trajectory
+               box lims for each box in peeling trajectory
 
     
     by default, the currently selected box is the last box on the peeling
@@ -219,6 +228,8 @@ class PrimBox(object):
     res_dim = CurEntry('res dim')
     mass = CurEntry('mass')
     
+    columns = ['coverage', 'density', 'mean', 'res dim', 'mass']
+    
     _frozen=False
     
     def __init__(self, prim, box_lims, indices):
@@ -235,15 +246,40 @@ class PrimBox(object):
         
         self.prim = prim
         
-        # peeling and pasting trajectory
-        colums = ['coverage', 'density', 'mean', 'res dim', 'mass']
-        self.peeling_trajectory = pd.DataFrame(columns=colums)
-        
-        self.box_lims = []
+        # peeling and pasting trajectory, the stats and box lims are stored
+        # in arrays which double in size when full, the dataframe is only 
+        # created when the trajectory is requested
+        self._nr_boxes = 0
+        self._stats = np.zeros((16, len(self.columns)))
+        self._box_lims = np.zeros((16, 2), dtype=box_lims.dtype)
+        self._trajectory = None
         self._cur_box = -1
         
         # indices van data in box
         self.update(box_lims, indices)
+    
+    @property
+    def peeling_trajectory(self):
+        '''dataframe with the stats for each box in the peeling 
+        trajectory'''
+        if self._trajectory is None:
+            trajectory = pd.DataFrame(self._stats[0:self._nr_boxes], 
+                                      columns=self.columns)
+            trajectory['res dim'] = trajectory['res dim'].astype(int)
+            self._trajectory = trajectory
+        return self._trajectory
+    
+    @property
+    def box_lims(self):
+        '''list with the box lims for each box in the peeling trajectory. 
+        The list is created anew on each access, so changes to the list 
+        itself do not affect the box.'''
+        return list(self._box_lims[0:self._nr_boxes])
+    
+    def _get_box_lim(self, i):
+        '''the box lim of box i in the peeling trajectory, without creating
+        the list of all box lims'''
+        return self._box_lims[0:self._nr_boxes][i]
 
     def __getattr__(self, name):
         '''
@@ -253,7 +289,7 @@ class PrimBox(object):
         '''
         
         if name=='box_lim':
-            return self.box_lims[self._cur_box]
+            return self._get_box_lim(self._cur_box)
         else:
             raise AttributeError
 
@@ -304,7 +340,7 @@ class PrimBox(object):
                                columns=columns)
         
         for unc in uncs:
-            values = self.box_lims[i][unc][:]
+            values = self._get_box_lim(i)[unc][:]
             box_lim.loc[unc] = [values[0], values[1], qp_values[unc]]
         
         print(box_lim)
@@ -319,7 +355,7 @@ class PrimBox(object):
         # box_init, which is visualized by a grey area in this
         # plot.
         box_lim_init = self.prim.box_init
-        box_lim = self.box_lims[i]
+        box_lim = self._get_box_lim(i)
         norm_box_lim =  sdutil._normalize(box_lim, box_lim_init, uncs)
         
         fig, ax = sdutil._setup_figure(uncs)
@@ -363,13 +399,13 @@ class PrimBox(object):
                 x = norm_box_lim[j][0]
     
                 if not np.allclose(x, 0):
-                    label = "{: .2g}".format(self.box_lims[i][u][0])
+                    label = "{: .2g}".format(self._get_box_lim(i)[u][0])
                     ax.text(x, y-0.2, label, ha='center', va='center',
                            bbox=props, color='blue', fontweight='normal')
     
                 x = norm_box_lim[j][1]
                 if not np.allclose(x, 1):
-                    label = "{: .2g}".format(self.box_lims[i][u][1])
+                    label = "{: .2g}".format(self._get_box_lim(i)[u][1])
                     ax.text(x, y-0.2, label, ha='center', va='center',
                            bbox=props, color='blue', fontweight='normal')
 
@@ -421,9 +457,7 @@ class PrimBox(object):
             raise PrimException("""box has been frozen because PRIM has found 
                                 at least one more recent box""")
         
-        indices = sdutil._in_box(self.prim.x[self.prim.yi_remaining], 
-                                 self.box_lims[i])
-        self.yi = self.prim.yi_remaining[indices]
+        self.yi = self.prim._in_box(self._get_box_lim(i))
         self._cur_box = i
 
     def drop_restriction(self, uncertainty):
@@ -440,10 +474,8 @@ class PrimBox(object):
         '''
         
         new_box_lim = copy.deepcopy(self.box_lim)
-        new_box_lim[uncertainty][:] = self.box_lims[0][uncertainty][:]
-        indices = sdutil._in_box(self.prim.x[self.prim.yi_remaining], 
-                                 new_box_lim)
-        indices = self.prim.yi_remaining[indices]
+        new_box_lim[uncertainty][:] = self._get_box_lim(0)[uncertainty][:]
+        indices = self.prim._in_box(new_box_lim)
         self.update(new_box_lim, indices)
         
     def update(self, box_lims, indices):
@@ -462,22 +494,38 @@ class PrimBox(object):
         self.yi = indices
         
         y = self.prim.y[self.yi]
-
-        self.box_lims.append(box_lims)
+        
+        i = self._nr_boxes
+        if i == self._stats.shape[0]:
+            self._grow()
+        
+        self._box_lims[i] = box_lims
 
         coi = self.prim.determine_coi(self.yi)
 
         data = {'coverage':coi/self.prim.t_coi, 
                 'density':coi/y.shape[0],  
                 'mean':np.mean(y),
-                'res dim':sdutil._determine_nr_restricted_dims(self.box_lims[-1], 
+                'res dim':sdutil._determine_nr_restricted_dims(box_lims, 
                                                               self.prim.box_init),
                 'mass':y.shape[0]/self.prim.n}
-        new_row = pd.DataFrame([data])
-        self.peeling_trajectory = self.peeling_trajectory.append(new_row, 
-                                                             ignore_index=True)
+        self._stats[i] = [data[column] for column in self.columns]
+        
+        self._nr_boxes += 1
+        self._trajectory = None
+        self._cur_box = i
+    
+    def _grow(self):
+        '''double the size of the arrays with the peeling trajectory'''
+        size = 2*self._stats.shape[0]
+        
+        stats = np.zeros((size, len(self.columns)))
+        stats[0:self._nr_boxes] = self._stats
+        self._stats = stats
         
-        self._cur_box = len(self.peeling_trajectory)-1
+        box_lims = np.zeros((size, 2), dtype=self._box_lims.dtype)
+        box_lims[0:self._nr_boxes] = self._box_lims
+        self._box_lims = box_lims
         
     def show_ppt(self):
         '''show the peeling and pasting trajectory in a figure'''
@@ -589,6 +637,28 @@ class PrimBox(object):
         print(self.peeling_trajectory)
         print("\n")
 
+    def quasi_p_values(self):
+        '''
+        
+        Quasi-p values for each box in the peeling trajectory, see 
+        :meth:`_calculate_quasi_p`. 
+        
+        Returns
+        -------
+        DataFrame
+            with the quasi-p value of each restricted dimension for each box,
+            NaN if a dimension is not restricted
+        
+        '''
+        boxes = list(range(self._nr_boxes))
+        qp_values = self._calculate_quasi_p_values(boxes)
+        
+        uncs = []
+        for entry in qp_values:
+            uncs.extend(u for u in entry.keys() if u not in uncs)
+        return pd.DataFrame(qp_values, index=boxes, columns=uncs, 
+                            dtype=float)
+
     def _calculate_quasi_p(self, i):
         '''helper function for calculating quasi-p values as discussed in 
         Bryant and Lempert (2010). This is a one sided  binomial test. 
@@ -600,43 +670,106 @@ class PrimBox(object):
             values are to be calculated.
         
         '''
+        return self._calculate_quasi_p_values([i])[0]
+    
+    def _calculate_quasi_p_values(self, boxes):
+        '''helper function for calculating the quasi-p values for several 
+        boxes in the peeling trajectory in one pass. 
+        
+        For each dimension, a mask with the cases within the limits of the 
+        box on that dimension is kept, together with a count of the number 
+        of dimensions on which each case is within the limits. Going from 
+        one box to the next, only the masks of the dimensions with different 
+        limits are updated. The cases in the box with the restriction on one 
+        dimension removed are those within the limits on all other 
+        dimensions, so these follow from the count and the mask.
         
-        box_lim = self.box_lims[i]
-        restricted_dims = list(sdutil._determine_restricted_dims(box_lim,
-                                                           self.prim.box_init))
+        Parameters
+        ----------
+        boxes : list of int
+                the boxes in the peeling trajectory for which the quasi-p 
+                values are to be calculated
         
-        # total nr. of cases in box
-        Tbox = self.peeling_trajectory['mass'][i] * self.prim.n 
+        Returns
+        -------
+        list of dicts
+            with the quasi-p value for each restricted dimension, in the 
+            order of boxes
         
-        # total nr. of cases of interest in box
-        Hbox = self.peeling_trajectory['coverage'][i] * self.prim.t_coi  
+        '''
+        yi = self.prim.yi_remaining
+        y = self.prim.y[yi]
+        encoded = self.prim._encoding()
+        names = rf.get_names(self._box_lims.dtype)
+        nr_dims = len(names)
+        
+        def key(name, limits):
+            if self._box_lims.dtype.fields.get(name)[0] == np.dtype(object):
+                return frozenset(limits[0])
+            return (limits[0], limits[1])
+        
+        def membership(name, limits):
+            box_lim = np.zeros((2, ), dtype=[(name, 
+                                    self._box_lims.dtype.fields.get(name)[0])])
+            box_lim[name] = limits
+            return encoded.in_box(box_lim, yi)
+        
+        masks = {}
+        init_masks = {}
+        count = np.zeros((yi.shape[0], ), dtype=np.int64)
+        
+        coverage = self._stats[:, self.columns.index('coverage')]
+        mass = self._stats[:, self.columns.index('mass')]
         
         qp_values = {}
-        
-        for u in restricted_dims:
-            temp_box = copy.deepcopy(box_lim)
-            temp_box[u] = self.box_lims[0][u]
-        
-            indices = sdutil._in_box(self.prim.x[self.prim.yi_remaining], 
-                                     temp_box)
-            indices = self.prim.yi_remaining[indices]
-            
-            # total nr. of cases in box with one restriction removed
-            Tj = indices.shape[0]  
+        for i in sorted(set(boxes)):
+            box_lim = self._get_box_lim(i)
+            for name in names:
+                limits_key = key(name, box_lim[name])
+                if (name in masks) and (masks[name][0] == limits_key):
+                    continue
+                
+                mask = membership(name, box_lim[name])
+                if name in masks:
+                    count -= masks[name][1]
+                count += mask
+                masks[name] = (limits_key, mask)
             
-            # total nr. of cases of interest in box with one restriction 
-            # removed
-            Hj = np.sum(self.prim.y[indices])
+            restricted_dims = list(sdutil._determine_restricted_dims(box_lim,
+                                                           self.prim.box_init))
+        
+            # total nr. of cases in box
+            Tbox = int(mass[i] * self.prim.n)
             
-            p = Hj/Tj
+            # total nr. of cases of interest in box
+            Hbox = int(coverage[i] * self.prim.t_coi)
             
-            Hbox = int(Hbox)
-            Tbox = int(Tbox)
+            # only cases outside the box on at most one dimension can be in
+            # the box with one restriction removed
+            candidates = np.flatnonzero(count >= nr_dims-1)
             
-            qp = binom.sf(Hbox-1, Tbox, p)
-            qp_values[u] = qp
+            qp_values[i] = {}
+            for u in restricted_dims:
+                if u not in init_masks:
+                    init_masks[u] = membership(u, self._get_box_lim(0)[u])
+                
+                logical = (count[candidates]-masks[u][1][candidates] == 
+                           nr_dims-1) & init_masks[u][candidates]
+                indices = candidates[logical]
+                
+                # total nr. of cases in box with one restriction removed
+                Tj = indices.shape[0]  
+                
+                # total nr. of cases of interest in box with one restriction 
+                # removed
+                Hj = np.sum(y[indices])
+                
+                p = Hj/Tj
+                
+                qp = binom.sf(Hbox-1, Tbox, p)
+                qp_values[i][u] = qp
             
-        return qp_values
+        return [qp_values[i] for i in boxes]
 
     def _format_stats(self, nr, stats):
         '''helper function for formating box stats'''
@@ -723,6 +856,13 @@ class Prim(sdutil.OutputFormatterMixin):
                minimum mass of a box (default = 0.05). 
     threshold_type : {ABOVE, BELOW}
                      whether to look above or below the threshold value
+    peeling_engine : {BASIC, SORTED}, optional
+                     the implementation of the peeling phase. SORTED
+                     presorts the data once, rather than sorting and 
+                     copying it for each peel, which is much faster for 
+                     large data sets, while giving the same peeling 
+                     trajectory. If SORTED cannot be used, for example 
+                     because x contains masked values, BASIC is used.
   
         
     See also
@@ -734,6 +874,14 @@ class Prim(sdutil.OutputFormatterMixin):
     
     message = "{0} points remaining, containing {1} cases of interest"
     
+    # the number of processes over which the candidate boxes of the BASIC
+    # peeling engine are spread, only if the remaining data has at least
+    # _min_parallel_size values (cases times uncertainties). This is not
+    # part of the api until a speedup has been measured, see 
+    # test/benchmarks/bench_prim.py
+    _n_jobs = 1
+    _min_parallel_size = 10**6
+    
     def __init__(self, 
                  x,
                  y, 
@@ -742,21 +890,45 @@ class Prim(sdutil.OutputFormatterMixin):
                  peel_alpha=0.05, 
                  paste_alpha=0.05,
                  mass_min=0.05, 
-                 threshold_type=ABOVE):
+                 threshold_type=ABOVE,
+                 peeling_engine=BASIC):
         
         self.x = np.ma.array(x)
-        self.y = y
-        
-        if len(self.y.shape) > 1:
-            raise PrimException("y is not a 1-d array")
         
         # store the remainder of the parameters
         self.paste_alpha = paste_alpha
         self.peel_alpha = peel_alpha
         self.mass_min = mass_min
+        self.obj_func = self._obj_functions[obj_function]
+        
+        if peeling_engine not in (BASIC, SORTED):
+            raise PrimException("unknown peeling engine {}".format(
+                                                            peeling_engine))
+        self.peeling_engine = peeling_engine
+        self._sorted_engine = None
+        
+        self._pool = None
+        self._encoded = None
+        
+        # initial box that contains all data
+        self.box_init = sdutil._make_box(self.x)
+        
+        self._set_problem(y, threshold, threshold_type)
+    
+    def _set_problem(self, y, threshold, threshold_type):
+        '''
+        
+        set the dependent variable and the threshold, and clear the boxes 
+        found so far. Everything that depends only on x is left intact.
+        
+        '''
+        self.y = y
+        
+        if len(self.y.shape) > 1:
+            raise PrimException("y is not a 1-d array")
+        
         self.threshold = threshold 
         self.threshold_type = threshold_type
-        self.obj_func = self._obj_functions[obj_function]
        
         # set the indices
         self.yi = np.arange(0, self.y.shape[0])
@@ -766,9 +938,6 @@ class Prim(sdutil.OutputFormatterMixin):
         
         # how many cases of interest do we have?
         self.t_coi = self.determine_coi(self.yi)
-        
-        # initial box that contains all data
-        self.box_init = sdutil._make_box(self.x)
     
         # make a list in which the identified boxes can be put
         self._boxes = []
@@ -914,13 +1083,29 @@ class Prim(sdutil.OutputFormatterMixin):
         # make a new box that contains all the remaining data points
         box = PrimBox(self, self.box_init, self.yi_remaining[:])
         
-        #  perform peeling phase
-        box = self._peel(box)
-        debug("peeling completed")
-
-        # perform pasting phase        
-        box = self._paste(box)
-        debug("pasting completed")
+        size = self.yi_remaining.shape[0]*len(self.x.dtype.descr)
+        if (self._n_jobs > 1) and (size >= self._min_parallel_size) and\
+           not self._use_sorted_engine():
+            # the workers start from a copy without any boxes
+            template = copy.copy(self)
+            template._boxes = []
+            template._sorted_engine = None
+            self._pool = multiprocessing.Pool(self._n_jobs, 
+                                              initializer=_setup_candidates,
+                                              initargs=(template,))
+        try:
+            #  perform peeling phase
+            box = self._peel(box)
+            debug("peeling completed")
+    
+            # perform pasting phase        
+            box = self._paste(box)
+            debug("pasting completed")
+        finally:
+            if self._pool is not None:
+                self._pool.close()
+                self._pool.join()
+                self._pool = None
         
         message = "mean: {0}, mass: {1}, coverage: {2}, density: {3} restricted_dimensions: {4}"
         message = message.format(box.mean,
@@ -946,6 +1131,107 @@ class Prim(sdutil.OutputFormatterMixin):
             self._boxes.append(box)
             return box
 
+    def resample(self, n, fraction=0.5, n_jobs=1, seed=None):
+        '''
+        
+        Analyse the stability of the first box found by PRIM by running 
+        :meth:`find_box` on n random subsets of the data, sampled without
+        replacement. The subsets are spread over a process pool. On 
+        platforms that fork, the workers share x and y with this process,
+        otherwise they are copied once to each worker. For the SORTED 
+        peeling engine, the sorted indices of a subset are derived from 
+        those of the full data, rather than sorting again.
+        
+        Parameters
+        ----------
+        n : int
+            the number of subsets
+        fraction : float, optional
+                   the size of each subset, as a fraction of all data
+        n_jobs : int, optional
+                 the number of processes, if -1, the number of cpu's is used
+        seed : int, optional
+               seed for drawing the subsets
+        
+        Returns
+        -------
+        DataFrame
+            for each uncertainty, the fraction of the boxes in which it is
+            restricted, and for numeric uncertainties the mean and standard
+            deviation of the lower and upper limit. Unrestricted limits 
+            are taken from box_init.
+        list
+            the box lims of the boxes for each subset
+        
+        Raises
+        ------
+        PrimException
+            if fraction is not between 0 and 1
+        
+        '''
+        if not 0 < fraction <= 1:
+            raise PrimException("fraction should be between 0 and 1")
+        
+        # the workers start from a copy without any boxes
+        template = copy.copy(self)
+        template._boxes = []
+        template._pool = None
+        if self.peeling_engine == SORTED:
+            engine = self._sorted_engine
+            if (engine is None) or (engine.x is not self.x):
+                engine = SortedPeelingEngine(self)
+                self._sorted_engine = engine
+            engine = copy.copy(engine)
+            engine.prim = template
+            template._sorted_engine = engine
+        
+        seeds = np.random.RandomState(seed).randint(0, 2**31-1, size=n)
+        
+        if n_jobs == -1:
+            n_jobs = multiprocessing.cpu_count()
+        
+        if n_jobs > 1:
+            pool = multiprocessing.Pool(n_jobs, initializer=_setup_resample, 
+                                        initargs=(template, fraction))
+            try:
+                results = pool.map(_resample, seeds)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            _setup_resample(template, fraction)
+            results = [_resample(entry) for entry in seeds]
+        
+        box_lims = [result[0] for result in results]
+        names = rf.get_names(self.x.dtype)
+        restricted = {name:0 for name in names}
+        for result in results:
+            for name in result[1]:
+                restricted[name] += 1
+        
+        stats = pd.DataFrame(index=names, 
+                             columns=['restricted', 'lower mean', 'lower std',
+                                      'upper mean', 'upper std'], 
+                             dtype=float)
+        for name in names:
+            stats.loc[name, 'restricted'] = restricted[name]/n
+            
+            if self.x.dtype.fields.get(name)[0] == np.dtype(object):
+                continue
+            
+            limits = np.empty((n, 2))
+            for i, (box_lim, restricted_dims) in enumerate(results):
+                if name in restricted_dims:
+                    limits[i] = box_lim[name]
+                else:
+                    limits[i] = self.box_init[name]
+            stats.loc[name, 'lower mean'] = np.mean(limits[:, 0])
+            stats.loc[name, 'lower std'] = np.std(limits[:, 0])
+            stats.loc[name, 'upper mean'] = np.mean(limits[:, 1])
+            stats.loc[name, 'upper std'] = np.std(limits[:, 1])
+        
+        return stats, box_lims
+
     def determine_coi(self, indices):
         '''        
         Given a set of indices on y, how many cases of interest are there in 
@@ -979,6 +1265,81 @@ class Prim(sdutil.OutputFormatterMixin):
         
         return coi
     
+    def _encoding(self):
+        '''returns x encoded for box membership tests, see 
+        :class:`sdutil.EncodedExperiments`'''
+        # the encoding is only valid as long as x is not replaced, e.g. 
+        # by perform_pca
+        encoded = self._encoded
+        if (encoded is None) or (encoded.x is not self.x):
+            encoded = sdutil.EncodedExperiments(self.x)
+            self._encoded = encoded
+        return encoded
+    
+    def _in_box(self, box_lim):
+        '''returns the indices of the remaining data within box_lim'''
+        logical = self._encoding().in_box(box_lim, self.yi_remaining)
+        return self.yi_remaining[logical]
+    
+    def _best_candidate(self, phase, box, names):
+        '''
+        
+        the best scoring candidate box, as returned by :meth:`_score`, 
+        over the peels or pastes of box along the uncertainties in names, 
+        or None if there are no candidates. Of equally scoring candidates,
+        the first one is returned. If the process pool is available, names
+        is split into consecutive chunks, which are spread over the pool.
+        
+        Parameters
+        ----------
+        phase : {'peel', 'paste'}
+        box : a PrimBox instance
+        names : list of str
+        
+        '''
+        if not names:
+            return None
+        
+        if self._pool is not None:
+            chunks = [chunk.tolist() for chunk in np.array_split(
+                                    np.asarray(names, dtype=object), 
+                                    min(self._n_jobs, len(names))) 
+                      if chunk.shape[0]]
+            box_lim = box._get_box_lim(-1)
+            candidates = self._pool.map(_best_candidate, 
+                                [(phase, chunk, box.yi, box_lim) for chunk
+                                 in chunks])
+        else:
+            if phase == 'peel':
+                x = self.x[box.yi]
+                candidates = (self._peels[x.dtype.fields.get(u)[0].name](
+                                                            self, box, u, x) 
+                              for u in names)
+            else:
+                candidates = (self._pastes[self.x.dtype.fields.get(u)[0].
+                                                name](self, box, u) 
+                              for u in names)
+            nr_dims = len(self.x.dtype.descr)
+            candidates = (self._score(box, nr_dims, candidate) for candidate
+                          in itertools.chain.from_iterable(candidates))
+        
+        best = None
+        for candidate in candidates:
+            if candidate is None:
+                continue
+            if (best is None) or (candidate[0:2] > best[0:2]):
+                best = candidate
+        return best
+    
+    def _score(self, box, nr_dims, candidate):
+        '''helper method for scoring a candidate box'''
+        i, box_lim = candidate
+        obj = self.obj_func(self, self.y[box.yi],  self.y[i])
+        non_res_dim = nr_dims-\
+                      sdutil._determine_nr_restricted_dims(box_lim, 
+                                                          self.box_init)
+        return (obj, non_res_dim, box_lim, i)
+    
     def _update_yi_remaining(self):
         '''
         
@@ -993,6 +1354,11 @@ class Prim(sdutil.OutputFormatterMixin):
             logical[box.yi] = False
         self.yi_remaining = self.yi[logical]
     
+    def _use_sorted_engine(self):
+        '''returns True if the peeling phase uses the sorted engine'''
+        return (self.peeling_engine == SORTED) and\
+               SortedPeelingEngine.applicable(self)
+    
     def _peel(self, box):
         '''
         
@@ -1000,36 +1366,23 @@ class Prim(sdutil.OutputFormatterMixin):
         to data type specific helper methods.
 
         '''
+        if self._use_sorted_engine():
+            # the engine is only valid as long as x is not replaced, e.g. 
+            # by perform_pca
+            engine = self._sorted_engine
+            if (engine is None) or (engine.x is not self.x):
+                engine = SortedPeelingEngine(self)
+                self._sorted_engine = engine
+            return engine.peel(box)
     
         mass_old = box.yi.shape[0]/self.n
-
-        x = self.x[box.yi]
        
-        #identify all possible peels
-        possible_peels = []
-        for entry in x.dtype.descr:
-            u = entry[0]
-            dtype = x.dtype.fields.get(u)[0].name
-            peels = self._peels[dtype](self, box, u, x)
-            [possible_peels.append(entry) for entry in peels] 
-        if not possible_peels:
+        # identify the best scoring of all possible peels
+        entry = self._best_candidate('peel', box, 
+                                     [u for u, _ in self.x.dtype.descr])
+        if entry is None:
             # there is no peel identified, so return box
             return box
-
-        # determine the scores for each peel in order
-        # to identify the next candidate box
-        scores = []
-        for entry in possible_peels:
-            i, box_lim = entry
-            obj = self.obj_func(self, self.y[box.yi],  self.y[i])
-            non_res_dim = len(x.dtype.descr)-\
-                          sdutil._determine_nr_restricted_dims(box_lim, 
-                                                              self.box_init)
-            score = (obj, non_res_dim, box_lim, i)
-            scores.append(score)
-
-        scores.sort(key=itemgetter(0,1), reverse=True)
-        entry = scores[0]
         
         obj_score = entry[0]
         box_new, indices = entry[2:]
@@ -1082,7 +1435,7 @@ class Prim(sdutil.OutputFormatterMixin):
                 if direction=='upper':
                     logical = x[u] <= box_peel
                     indices = box.yi[logical]
-                temp_box = copy.deepcopy(box.box_lims[-1])
+                temp_box = copy.deepcopy(box._get_box_lim(-1))
                 temp_box[u][i] = box_peel
                 peels.append((indices, temp_box))
             else:
@@ -1121,19 +1474,19 @@ class Prim(sdutil.OutputFormatterMixin):
 
             # determine logical associated with peel value            
             if direction=='lower':
-                if box_peel == box.box_lims[-1][u][i]:
-                    logical = (x[u] > box.box_lims[-1][u][i]) &\
-                              (x[u] <= box.box_lims[-1][u][i+1])
+                if box_peel == box._get_box_lim(-1)[u][i]:
+                    logical = (x[u] > box._get_box_lim(-1)[u][i]) &\
+                              (x[u] <= box._get_box_lim(-1)[u][i+1])
                 else:
                     logical = (x[u] >= box_peel) &\
-                              (x[u] <= box.box_lims[-1][u][i+1])
+                              (x[u] <= box._get_box_lim(-1)[u][i+1])
             if direction=='upper':
-                if box_peel == box.box_lims[-1][u][i]:
-                    logical = (x[u] < box.box_lims[-1][u][i]) &\
-                              (x[u] >= box.box_lims[-1][u][i-1])
+                if box_peel == box._get_box_lim(-1)[u][i]:
+                    logical = (x[u] < box._get_box_lim(-1)[u][i]) &\
+                              (x[u] >= box._get_box_lim(-1)[u][i-1])
                 else:
                     logical = (x[u] <= box_peel) &\
-                              (x[u] >= box.box_lims[-1][u][i-1])
+                              (x[u] >= box._get_box_lim(-1)[u][i-1])
 
             # determine value of new limit given logical
             if x[logical].shape[0] == 0:
@@ -1148,7 +1501,7 @@ class Prim(sdutil.OutputFormatterMixin):
                     new_limit = np.min(x[u][logical])            
             
             indices= box.yi[logical] 
-            temp_box = copy.deepcopy(box.box_lims[-1])
+            temp_box = copy.deepcopy(box._get_box_lim(-1))
             temp_box[u][i] = new_limit
             peels.append((indices, temp_box))
     
@@ -1173,12 +1526,12 @@ class Prim(sdutil.OutputFormatterMixin):
             a list of box lims and the associated indices
         
         '''
-        entries = box.box_lims[-1][u][0]
+        entries = box._get_box_lim(-1)[u][0]
         
         if len(entries) > 1:
             peels = []
             for entry in entries:
-                temp_box = np.copy(box.box_lims[-1])
+                temp_box = np.copy(box._get_box_lim(-1))
                 peel = copy.deepcopy(entries)
                 peel.discard(entry)
                 temp_box[u][:] = peel
@@ -1205,37 +1558,17 @@ class Prim(sdutil.OutputFormatterMixin):
         ''' Executes the pasting phase of the PRIM. Delegates pasting to data 
         type specific helper methods.'''
         
-        x = self.x[self.yi_remaining]
-        
         mass_old = box.yi.shape[0]/self.n
         
-        res_dim = sdutil._determine_restricted_dims(box.box_lims[-1],
+        res_dim = sdutil._determine_restricted_dims(box._get_box_lim(-1),
                                                     self.box_init)
         
-        possible_pastes = []
-        for u in res_dim:
-            debug("pasting "+u)
-            dtype = self.x.dtype.fields.get(u)[0].name
-            pastes = self._pastes[dtype](self, box, u)
-            [possible_pastes.append(entry) for entry in pastes] 
-        if not possible_pastes:
-            # there is no peel identified, so return box
+        # identify the best scoring of all possible pastes
+        entry = self._best_candidate('paste', box, list(res_dim))
+        if entry is None:
+            # there is no paste identified, so return box
             return box
-    
-        # determine the scores for each peel in order
-        # to identify the next candidate box
-        scores = []
-        for entry in possible_pastes:
-            i, box_lim = entry
-            obj = self.obj_func(self, self.y[box.yi],  self.y[i])
-            non_res_dim = len(x.dtype.descr)-\
-                          sdutil._determine_nr_restricted_dims(box_lim,
-                                                              self.box_init)
-            score = (obj, non_res_dim, box_lim, i)
-            scores.append(score)
-
-        scores.sort(key=itemgetter(0,1), reverse=True)
-        entry = scores[0]
+        
         obj, _, box_new, indices = entry
         mass_new = self.y[indices].shape[0]/self.n
         
@@ -1273,34 +1606,32 @@ class Prim(sdutil.OutputFormatterMixin):
 
         pastes = []
         for i, direction in enumerate(['lower', 'upper']):
-            box_paste = np.copy(box.box_lims[-1])
-            paste_box = np.copy(box.box_lims[-1]) # box containing data candidate for pasting
+            box_paste = np.copy(box._get_box_lim(-1))
+            paste_box = np.copy(box._get_box_lim(-1)) # box containing data candidate for pasting
             
             if direction == 'upper':
                 paste_box[u][0] = paste_box[u][1]
                 paste_box[u][1] = self.box_init[u][1]
-                indices = sdutil._in_box(self.x[self.yi_remaining], paste_box)
-                data = self.x[self.yi_remaining][indices][u]
+                data = self.x[self._in_box(paste_box)][u]
                 
                 paste_value = self.box_init[u][i]
                 if data.shape[0] > 0:
                     paste_value = get_quantile(data, self.paste_alpha)
                     
-                assert paste_value >= box.box_lims[-1][u][i]
+                assert paste_value >= box._get_box_lim(-1)[u][i]
                     
             elif direction == 'lower':
                 paste_box[u][0] = self.box_init[u][0]
                 paste_box[u][1] = box_paste[u][0]
                 
-                indices = sdutil._in_box(self.x[self.yi_remaining], paste_box)
-                data = self.x[self.yi_remaining][indices][u]
+                data = self.x[self._in_box(paste_box)][u]
                 
                 paste_value = self.box_init[u][i]
                 if data.shape[0] > 0:
                     paste_value = get_quantile(data, 1-self.paste_alpha)
            
-                if not paste_value <= box.box_lims[-1][u][i]:
-                    print("{}, {}".format(paste_value, box.box_lims[-1][u][i]))
+                if not paste_value <= box._get_box_lim(-1)[u][i]:
+                    print("{}, {}".format(paste_value, box._get_box_lim(-1)[u][i]))
             
             
             dtype = box_paste.dtype.fields[u][0]
@@ -1308,8 +1639,7 @@ class Prim(sdutil.OutputFormatterMixin):
                 paste_value = np.int(paste_value)
             
             box_paste[u][i] = paste_value
-            indices = sdutil._in_box(self.x[self.yi_remaining], box_paste)
-            indices = self.yi_remaining[indices]
+            indices = self._in_box(box_paste)
             
             pastes.append((indices, box_paste))
     
@@ -1334,7 +1664,7 @@ class Prim(sdutil.OutputFormatterMixin):
         
         
         '''
-        box_lim = box.box_lims[-1]
+        box_lim = box._get_box_lim(-1)
         
         c_in_b = box_lim[u][0]
         c_t = self.box_init[u][0]
@@ -1349,8 +1679,7 @@ class Prim(sdutil.OutputFormatterMixin):
                 box_paste = np.copy(box_lim)
                 box_paste[u][:] = paste
                 
-                indices = sdutil._in_box(self.x[self.yi_remaining], box_paste)
-                indices = self.yi_remaining[indices]
+                indices = self._in_box(box_paste)
                 pastes.append((indices, box_paste))
             return pastes
         else:
@@ -1540,3 +1869,517 @@ class MultiBoxesPrim(Prim):
         print(np.sum(self.y))
         
         self.yi_remaining = self.yi
+
+
+class PrimBatch(object):
+    '''Run PRIM for many problems on the same experiments
+    
+    A problem is a dependent variable with a threshold, for example the 
+    result of different classify functions or of one outcome with different
+    thresholds. x is processed only once: it is converted to a masked 
+    array, the initial box is determined, and, when using the SORTED 
+    peeling engine, each column is sorted and categorical columns are 
+    encoded. All problems share this, so none of it is copied.
+
+    Parameters
+    ----------
+    x : structured array
+        the independent variables
+    peeling_engine : {BASIC, SORTED}, optional
+    kwargs : dict
+             the remaining keyword arguments for :class:`Prim`, with the 
+             exception of threshold and threshold_type, which are 
+             specified for each problem
+    
+    '''
+    
+    def __init__(self, x, peeling_engine=SORTED, **kwargs):
+        # a prim instance that holds everything that depends only on x,
+        # with a dummy problem
+        self._prim = Prim(x, np.zeros((len(x),)), 1, 
+                          peeling_engine=peeling_engine, **kwargs)
+        
+        if peeling_engine == SORTED:
+            self._prim._sorted_engine = SortedPeelingEngine(self._prim)
+    
+    @property
+    def x(self):
+        return self._prim.x
+    
+    @property
+    def box_init(self):
+        return self._prim.box_init
+    
+    def setup(self, y, threshold, threshold_type=ABOVE):
+        '''
+        
+        Make a Prim instance for the problem, which shares the processed x
+        
+        Parameters
+        ----------
+        y : 1d ndarray
+            the dependent variable
+        threshold : float
+        threshold_type : {ABOVE, BELOW}, optional
+        
+        Returns
+        -------
+        a Prim instance
+        
+        Raises
+        ------
+        PrimException
+            if y is not a 1-d array of the same length as x
+        
+        '''
+        y = np.asarray(y)
+        if y.shape[0] != self.x.shape[0]:
+            raise PrimException("y does not have the same length as x")
+        
+        prim = copy.copy(self._prim)
+        prim._set_problem(y, threshold, threshold_type)
+        
+        engine = prim._sorted_engine
+        if engine is not None:
+            engine = copy.copy(engine)
+            engine.prim = prim
+            prim._sorted_engine = engine
+        return prim
+    
+    def run(self, problems, nr_boxes=1, n_jobs=1):
+        '''
+        
+        Find boxes for each problem
+        
+        Parameters
+        ----------
+        problems : iterable of tuples
+                   each tuple is (y, threshold) or (y, threshold, 
+                   threshold_type)
+        nr_boxes : int, optional
+                   the number of times :meth:`Prim.find_box` is called for
+                   each problem. Fewer boxes are found if no data remains.
+        n_jobs : int, optional
+                 the number of threads over which the problems are spread, 
+                 if -1, the number of cpu's is used. 
+        
+        Returns
+        -------
+        list
+            a Prim instance with the boxes found for each problem, in 
+            the order of problems
+        
+        '''
+        prims = [self.setup(*problem) for problem in problems]
+        
+        def find_boxes(prim):
+            for _ in range(nr_boxes):
+                if prim.find_box() is None:
+                    break
+            return prim
+        
+        if n_jobs == -1:
+            n_jobs = multiprocessing.cpu_count()
+        
+        if n_jobs > 1:
+            pool = ThreadPool(n_jobs)
+            try:
+                return pool.map(find_boxes, prims)
+            finally:
+                pool.close()
+        return [find_boxes(prim) for prim in prims]
+
+
+class _CandidateBox(object):
+    '''the yi and current box lim of a PrimBox, which is all that is 
+    needed for determining and scoring its candidate peels and pastes in 
+    the processes used by :meth:`Prim.find_box`'''
+    
+    def __init__(self, yi, box_lim):
+        self.yi = yi
+        self.box_lim = box_lim
+    
+    def _get_box_lim(self, i):
+        return self.box_lim
+
+
+def _setup_candidates(prim):
+    '''initializer of the processes used by :meth:`Prim.find_box`'''
+    global _candidates_prim
+    _candidates_prim = prim
+
+
+def _best_candidate(args):
+    '''the best scoring peel or paste along a chunk of uncertainties for the 
+    Prim instance set up by :func:`_setup_candidates`'''
+    phase, names, yi, box_lim = args
+    return _candidates_prim._best_candidate(phase, 
+                                            _CandidateBox(yi, box_lim), names)
+
+
+def _setup_resample(prim, fraction):
+    '''initializer of the processes used by :meth:`Prim.resample`'''
+    global _resample_prim, _resample_fraction
+    _resample_prim = prim
+    _resample_fraction = fraction
+
+
+def _resample(seed):
+    '''find a box on a random subset of the data of the Prim instance set 
+    up by :func:`_setup_resample`'''
+    prim = _resample_prim
+    
+    n = prim.y.shape[0]
+    size = max(int(round(_resample_fraction*n)), 1)
+    random_state = np.random.RandomState(seed)
+    indices = np.sort(random_state.choice(n, size, replace=False))
+    
+    obj_function = [key for key, value in prim._obj_functions.items() if 
+                    value.__name__ == prim.obj_func.__name__][0]
+    sample = type(prim)(prim.x[indices], prim.y[indices], prim.threshold,
+                        obj_function=obj_function, 
+                        peel_alpha=prim.peel_alpha, 
+                        paste_alpha=prim.paste_alpha,
+                        mass_min=prim.mass_min, 
+                        threshold_type=prim.threshold_type,
+                        peeling_engine=prim.peeling_engine)
+    if prim._sorted_engine is not None:
+        sample._sorted_engine = prim._sorted_engine.subset(sample, indices)
+    
+    box = sample.find_box()
+    box_lim = np.copy(box.box_lim)
+    restricted = sdutil._determine_restricted_dims(box_lim, sample.box_init)
+    return box_lim, list(restricted)
+
+
+class SortedPeelingEngine(object):
+    '''Peeling engine based on presorted indices
+    
+    Rather than sorting and copying the data inside the box for each step 
+    on the peeling trajectory, each numeric column of x is sorted only 
+    once. For each column, the indices of the data inside the box are kept 
+    in sorted order and are filtered after each peel, so quantiles are 
+    simple lookups and candidate peels are slices. Candidate boxes are 
+    scored using sums of y over these slices. The candidates which come 
+    closest to the best score are rescored with the objective function 
+    of the Prim instance on the actual data, so the resulting peeling 
+    trajectory is identical to the one resulting from :meth:`Prim._peel`.
+    
+    Parameters
+    ----------
+    prim : Prim instance
+    
+    '''
+    
+    REAL = 'real'
+    DISCRETE = 'discrete'
+    CATEGORICAL = 'categorical'
+    
+    def __init__(self, prim):
+        self.prim = prim
+        self.x = prim.x
+        self.names = list(rf.get_names(prim.x.dtype))
+        
+        kinds = {'_real_peel': self.REAL,
+                 '_discrete_peel': self.DISCRETE,
+                 '_categorical_peel': self.CATEGORICAL}
+        
+        self.kinds = {}
+        self.orders = {}
+        self.values = {}
+        self.codes = {}
+        for name in self.names:
+            dtype = prim.x.dtype.fields.get(name)[0].name
+            kind = kinds[prim._peels[dtype].__name__]
+            self.kinds[name] = kind
+            
+            values = np.ma.getdata(prim.x[name])
+            if kind == self.CATEGORICAL:
+                mapping = {}
+                self.codes[name] = (np.asarray([mapping.setdefault(value, 
+                                    len(mapping)) for value in values], 
+                                    dtype=np.int64), mapping)
+            else:
+                self.values[name] = values
+                self.orders[name] = np.argsort(values, kind='mergesort')
+    
+    def subset(self, prim, indices):
+        '''
+        
+        Make the engine for a Prim instance on a subset of the data of this
+        engine, without sorting the data again.
+        
+        Parameters
+        ----------
+        prim : Prim instance
+               with x equal to x[indices]
+        indices : ndarray
+                  sorted indices of the subset, without duplicates
+        
+        Returns
+        -------
+        a SortedPeelingEngine instance
+        
+        '''
+        engine = copy.copy(self)
+        engine.prim = prim
+        engine.x = prim.x
+        
+        # position of each row of x in the subset, -1 if not in the subset
+        position = np.empty((self.x.shape[0],), dtype=np.int64)
+        position.fill(-1)
+        position[indices] = np.arange(indices.shape[0])
+        
+        engine.orders = {}
+        engine.values = {}
+        for name, order in self.orders.items():
+            order = position[order]
+            engine.orders[name] = order[order >= 0]
+            engine.values[name] = self.values[name][indices]
+        engine.codes = {name:(codes[indices], mapping) for name, 
+                        (codes, mapping) in self.codes.items()}
+        return engine
+    
+    @staticmethod
+    def applicable(prim):
+        '''returns True if the engine can be used for the Prim instance'''
+        for name in rf.get_names(prim.x.dtype):
+            if np.any(np.ma.getmaskarray(prim.x[name])):
+                return False
+        if np.any(np.isnan(prim.y)):
+            return False
+        return prim.obj_func.__name__ in ('_lenient1_obj_func', 
+                                          '_lenient2_obj_func',
+                                          '_original_obj_func')
+    
+    @staticmethod
+    def _quantile(data, quantile):
+        '''quantile on sorted data, identical to :func:`get_quantile`'''
+        i = (data.shape[0]-1)*quantile
+        index_lower = int(math.floor(i))
+        index_higher = int(math.ceil(i))
+        
+        if data[index_lower] == data[index_higher]:
+            if quantile > 0.5:
+                first = np.searchsorted(data, data[index_higher], 'left')
+                index_lower = max(first-1, 0)
+            else:
+                last = np.searchsorted(data, data[index_lower], 'right')
+                index_higher = min(last, data.shape[0]-1)
+        return (data[index_lower]+data[index_higher])/2
+    
+    def _scores(self, n_old, mean_old, counts, sums):
+        '''approximate scores of the candidate boxes, based on their sums'''
+        counts = np.asarray(counts, dtype=float)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            means = np.where(counts > 0, np.asarray(sums)/counts, 0)
+        
+        obj_func = self.prim.obj_func.__name__
+        if obj_func == '_original_obj_func':
+            return np.where(counts > 0, means, -1)
+        
+        change_mass = np.abs(n_old-counts)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            obj = (means-mean_old)/change_mass
+        if obj_func == '_lenient2_obj_func':
+            obj = obj*counts
+        return np.where(change_mass > 0, obj, 0)
+    
+    def _tolerance(self, m, y_max, best):
+        '''upper bound on the error of the approximate scores'''
+        eps = np.finfo(float).eps
+        return 4*(math.log(m+1, 2)+2)*eps*m*y_max + 8*eps*abs(best)
+    
+    def peel(self, box):
+        '''
+        Executes the peeling phase of the PRIM algorithm for the given box. 
+        
+        Parameters
+        ----------
+        box : a PrimBox instance
+        
+        Returns
+        -------
+        the peeled PrimBox instance
+        
+        '''
+        prim = self.prim
+        y = prim.y
+        y_max = np.max(np.abs(y)) if y.shape[0] else 0
+        
+        mask = np.zeros(y.shape[0], dtype=bool)
+        mask[box.yi] = True
+        
+        sorted_indices = {}
+        sorted_values = {}
+        for name, order in self.orders.items():
+            order = order[mask[order]]
+            sorted_indices[name] = order
+            sorted_values[name] = self.values[name][order]
+        
+        init = prim.box_init
+        
+        while True:
+            box_lim = box._get_box_lim(-1)
+            yi = box.yi
+            m = yi.shape[0]
+            total = np.sum(y[yi])
+            mean_old = total/m
+            mass_old = m/prim.n
+            
+            restricted = {name: not ((box_lim[name][0] == init[name][0]) & 
+                                     (box_lim[name][1] == init[name][1])) 
+                          for name in self.names}
+            nr_restricted = sum(restricted.values())
+            
+            # candidates as (u, i, limit, removed, count, sum, non_res_dim)
+            def column_candidates(u):
+                if self.kinds[u] == self.CATEGORICAL:
+                    # a peeled categorical dimension is always restricted
+                    non_res_dim = len(self.names) - (nr_restricted - 
+                                                     restricted[u] + 1)
+                    return self._categorical_candidates(u, box_lim, yi, 
+                                                    total, y, non_res_dim)
+                else:
+                    return self._numeric_candidates(u, box_lim, 
+                                    sorted_values[u], sorted_indices[u], 
+                                    total, y, nr_restricted-restricted[u])
+            
+            candidates = list(itertools.chain.from_iterable(
+                                    column_candidates(u) for u in self.names))
+            
+            if not candidates:
+                return box
+            
+            scores = self._scores(m, mean_old, [c[4] for c in candidates], 
+                                  [c[5] for c in candidates])
+            best = np.max(scores)
+            tolerance = self._tolerance(m, y_max, best)
+            
+            # rescore the candidates close to the best on the actual data,
+            # in the same order as Prim._peel
+            rescored = []
+            for j in np.flatnonzero(scores >= best-tolerance):
+                candidate = candidates[j]
+                keep = mask.copy()
+                keep[candidate[3]] = False
+                indices = yi[keep[yi]]
+                
+                obj = prim.obj_func(prim, y[yi], y[indices])
+                rescored.append((obj, candidate[6], candidate, indices, keep))
+            
+            rescored.sort(key=itemgetter(0,1), reverse=True)
+            obj_score, _, candidate, indices, keep = rescored[0]
+            
+            mass_new = indices.shape[0]/prim.n
+            if (mass_new >= prim.mass_min) &\
+               (mass_new < mass_old) &\
+               (obj_score>0):
+                box.update(self._make_box_lim(box_lim, candidate), indices)
+                
+                mask = keep
+                for name, order in sorted_indices.items():
+                    logical = mask[order]
+                    sorted_indices[name] = order[logical]
+                    sorted_values[name] = sorted_values[name][logical]
+            else:
+                return box
+    
+    def _numeric_candidates(self, u, box_lim, values, indices, total, y,
+                            nr_restricted):
+        '''candidate peels for a real or discrete dimension, in the same 
+        order as :meth:`Prim._real_peel` and :meth:`Prim._discrete_peel`'''
+        kind = self.kinds[u]
+        m = indices.shape[0]
+        init = self.prim.box_init
+        
+        if (kind == self.REAL) and np.isnan(values[-1]):
+            return []
+        
+        candidates = []
+        for i, quantile in ((1, 1-self.prim.peel_alpha), 
+                            (0, self.prim.peel_alpha)):
+            box_peel = self._quantile(values, quantile)
+            
+            if kind == self.REAL:
+                limit = box_peel
+                if i == 1:
+                    k = np.searchsorted(values, box_peel, 'right')
+                else:
+                    k = np.searchsorted(values, box_peel, 'left')
+            else:
+                box_peel = int(box_peel)
+                
+                if i == 1:
+                    if box_peel == box_lim[u][i]:
+                        k = np.searchsorted(values, box_lim[u][i], 'left')
+                    else:
+                        k = np.searchsorted(values, box_peel, 'right')
+                    limit = values[k-1] if k > 0 else values[-1]
+                else:
+                    if box_peel == box_lim[u][i]:
+                        k = np.searchsorted(values, box_lim[u][i], 'right')
+                    else:
+                        k = np.searchsorted(values, box_peel, 'left')
+                    limit = values[k] if k < m else values[0]
+            
+            if i == 1:
+                removed = indices[k::]
+                count = k
+            else:
+                removed = indices[0:k]
+                count = m-k
+            sum_y = total-np.sum(y[removed])
+            
+            new_lim = [box_lim[u][0], box_lim[u][1]]
+            new_lim[i] = limit
+            lim = np.array(new_lim, dtype=box_lim.dtype.fields[u][0])
+            res = not ((lim[0] == init[u][0]) & (lim[1] == init[u][1]))
+            non_res_dim = len(self.names) - (nr_restricted + res)
+            
+            candidates.append((u, i, limit, removed, count, sum_y, 
+                               non_res_dim))
+        return candidates
+    
+    def _categorical_candidates(self, u, box_lim, yi, total, y, 
+                                non_res_dim):
+        '''candidate peels for a categorical dimension, in the same order 
+        as :meth:`Prim._categorical_peel`'''
+        entries = box_lim[u][0]
+        if len(entries) <= 1:
+            return []
+        
+        codes, mapping = self.codes[u]
+        box_codes = codes[yi]
+        counts = np.bincount(box_codes, minlength=len(mapping))
+        sums = np.bincount(box_codes, weights=y[yi], minlength=len(mapping))
+        
+        candidates = []
+        for entry in entries:
+            try:
+                code = mapping[entry]
+            except KeyError:
+                removed = yi[0:0]
+                count, sum_y = yi.shape[0], total
+            else:
+                removed = yi[box_codes==code]
+                count = yi.shape[0] - counts[code]
+                sum_y = total - sums[code]
+            candidates.append((u, entry, None, removed, count, sum_y, 
+                               non_res_dim))
+        return candidates
+    
+    def _make_box_lim(self, box_lim, candidate):
+        '''make the box lim for the selected candidate, in the same way as 
+        the peel methods of Prim'''
+        u, i, limit = candidate[0:3]
+        
+        if self.kinds[u] == self.CATEGORICAL:
+            temp_box = np.copy(box_lim)
+            peel = copy.deepcopy(box_lim[u][0])
+            peel.discard(i)
+            temp_box[u][:] = peel
+        else:
+            temp_box = copy.deepcopy(box_lim)
+            temp_box[u][i] = limit
+        return temp_box
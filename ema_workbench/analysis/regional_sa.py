@@ -5,16 +5,26 @@ module can be used to perform regional sensitivity analysis on all
 uncertainties specified in the experiment array, as well as the ability to 
 zoom in on any given uncertainty in more detail. 
 
+The regional sensitivity is quantified by :func:`cdf_distances`, which gives
+the Kolmogorov-Smirnov distance between the cdf of each uncertainty for the 
+experiments in a class and for the remaining experiments. The experiments 
+are sorted only once, see :func:`sort_experiments`, after which the 
+distances for all uncertainties and all classes follow from cumulative 
+counts. :func:`plot_cdfs` plots the cdfs from the same sorted experiments, 
+and annotates each of them with the distances.
 
 '''
 from __future__ import (absolute_import, print_function, division,
                         unicode_literals)
 
+from collections import namedtuple
+import multiprocessing
 import operator
 
 import matplotlib.pyplot as plt
 import numpy as np
 import numpy.lib.recfunctions as rf
+import pandas as pd
 import seaborn as sns
 
 # Created on Aug 18, 2015
@@ -22,10 +32,170 @@ import seaborn as sns
 # .. codeauthor:: jhkwakkel <j.h.kwakkel (at) tudelft (dot) nl>
 
 __all__ = ['plot_cdf',
-           'plot_cdfs']
+           'plot_cdfs',
+           'sort_experiments',
+           'cdf_distances']
 
 cp = sns.color_palette()
 
+SortedExperiments = namedtuple('SortedExperiments', ['uncs', 'orders', 
+                                                     'last'])
+
+
+def sort_experiments(x):
+    '''sort the experiments once for each uncertainty. Categorical 
+    uncertainties are sorted on their categories.
+    
+    Parameters
+    ----------
+    x : structured array
+    
+    Returns
+    -------
+    SortedExperiments
+        a namedtuple with the names of the uncertainties, an array with
+        for each uncertainty the indices that sort it, and a boolean array 
+        that is True for the last of a set of equal sorted values
+    
+    '''
+    uncs = rf.get_names(x.dtype)
+    n = x.shape[0]
+    
+    orders = np.empty((n, len(uncs)), dtype=np.intp)
+    last = np.ones((n, len(uncs)), dtype=np.bool)
+    for i, unc in enumerate(uncs):
+        values = x[unc]
+        if x.dtype[unc] == np.dtype('O'):
+            values = pd.factorize(values, sort=True)[0]
+        
+        order = np.argsort(values, kind='mergesort')
+        sorted_values = values[order]
+        orders[:, i] = order
+        last[0:-1, i] = sorted_values[1::] != sorted_values[0:-1]
+    return SortedExperiments(uncs, orders, last)
+
+
+def _get_sorted(x):
+    if isinstance(x, SortedExperiments):
+        return x
+    return sort_experiments(x)
+
+
+def _ks_distances(sorted_experiments, y, nr_classes):
+    '''the ks distance for each uncertainty and each class
+    
+    Parameters
+    ----------
+    sorted_experiments : SortedExperiments
+    y : 1d ndarray of ints
+    nr_classes : int
+    
+    Returns
+    -------
+    2d ndarray
+        with a row for each uncertainty and a column for each class
+    
+    '''
+    n = y.shape[0]
+    classes = np.arange(nr_classes)
+    nr_in = np.bincount(y, minlength=nr_classes)
+    nr_out = n - nr_in
+    positions = np.arange(1, n+1)[:, np.newaxis]
+    
+    distances = np.empty((len(sorted_experiments.uncs), nr_classes))
+    for i in range(len(sorted_experiments.uncs)):
+        order = sorted_experiments.orders[:, i]
+        last = sorted_experiments.last[:, i]
+        
+        # the cdfs only have to be compared at the last of a set of equal 
+        # values
+        in_class = np.cumsum(y[order][:, np.newaxis]==classes, axis=0)[last]
+        out_class = positions[last] - in_class
+        
+        with np.errstate(invalid='ignore', divide='ignore'):
+            difference = np.abs(in_class/nr_in - out_class/nr_out)
+        distances[i] = np.max(difference, axis=0)
+    return distances
+
+
+def cdf_distances(x, y, nr_bootstraps=0, n_jobs=1, seed=None):
+    '''calculate the Kolmogorov-Smirnov distance between the cdf of each 
+    uncertainty for the experiments in a class and the cdf for all other 
+    experiments.
+    
+    Parameters
+    ----------
+    x : structured array or SortedExperiments
+    y : 1d ndarray of ints
+        the class of each experiment, starting at 0
+    nr_bootstraps : int, optional
+                    the number of random permutations of y used for 
+                    estimating the significance of the distances. If 0, no
+                    significance is estimated.
+    n_jobs : int, optional
+             the number of processes for the permutations, if -1, the 
+             number of cpu's is used
+    seed : int, optional
+           seed for the permutations
+    
+    Returns
+    -------
+    DataFrame
+        the distances, with a row for each uncertainty and a column for 
+        each class. If a class contains all or none of the experiments,
+        the distance is NaN.
+    DataFrame
+        only if nr_bootstraps > 0, the fraction of permutations with a 
+        distance at least as large as the distance for y, with one added
+        to both the numerator and the denominator
+    
+    '''
+    sorted_experiments = _get_sorted(x)
+    y = np.asarray(y, dtype=np.intp)
+    nr_classes = np.max(y)+1
+    
+    distances = _ks_distances(sorted_experiments, y, nr_classes)
+    distances = pd.DataFrame(distances, index=sorted_experiments.uncs)
+    if not nr_bootstraps:
+        return distances
+    
+    seeds = np.random.RandomState(seed).randint(0, 2**31-1, 
+                                                size=nr_bootstraps)
+    
+    if n_jobs == -1:
+        n_jobs = multiprocessing.cpu_count()
+    
+    if n_jobs > 1:
+        pool = multiprocessing.Pool(n_jobs, initializer=_setup_bootstrap,
+                                    initargs=(sorted_experiments, y, 
+                                              nr_classes))
+        try:
+            results = pool.map(_bootstrap, seeds)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        _setup_bootstrap(sorted_experiments, y, nr_classes)
+        results = [_bootstrap(entry) for entry in seeds]
+    
+    exceeded = np.sum(np.asarray(results) >= distances.values, axis=0)
+    p_values = (exceeded + 1) / (nr_bootstraps + 1)
+    p_values = pd.DataFrame(p_values, index=sorted_experiments.uncs)
+    return distances, p_values
+
+
+def _setup_bootstrap(sorted_experiments, y, nr_classes):
+    '''initializer of the processes used by :func:`cdf_distances`'''
+    global _bootstrap_data
+    _bootstrap_data = (sorted_experiments, y, nr_classes)
+
+
+def _bootstrap(seed):
+    '''the ks distances for a random permutation of y'''
+    sorted_experiments, y, nr_classes = _bootstrap_data
+    y = np.random.RandomState(seed).permutation(y)
+    return _ks_distances(sorted_experiments, y, nr_classes)
+
 def build_legend(x,y):
     '''helper function for building a legend
     
@@ -37,10 +207,11 @@ def build_legend(x,y):
     '''
     proxies = []
     labels = []
+    counts = np.bincount(y)
     for i in range(np.max(y)+1):
         proxy = plt.Line2D([0,1], [0,1], color=cp[i+1])
         proxies.append(proxy) 
-        labels.append('{} (N={})'.format(i,x[y==i].shape[0]))
+        labels.append('{} (N={})'.format(i,counts[i]))
     proxies.append(plt.Line2D([0,1], [0,1], lw=1,color='darkgrey'))
     labels.append('unconditioned')
     return proxies, labels
@@ -123,7 +294,7 @@ def plot_discrete_cdf(ax, unc, x, y, xticklabels_on,
 
     
 def plot_continuous_cdf(ax, unc, x, y, xticklabels_on,
-                       ccdf):
+                       ccdf, is_sorted=False):
     '''plot a continuous cdf on ax for data,grouping data by the groups
     specified in y.
     
@@ -135,21 +306,29 @@ def plot_continuous_cdf(ax, unc, x, y, xticklabels_on,
     y : ndarray
     xticklabels_on : bool
     ccdf : bool
+    is_sorted : bool, optional
+                if true, x is already sorted, with y in the same order
     
     '''
+    # x is sorted only once, the data of each group is then sorted as well
+    if is_sorted:
+        sorted_data = x
+        sorted_y = y
+    else:
+        order = np.argsort(x, kind='mergesort')
+        sorted_data = x[order]
+        sorted_y = y[order]
     
     for i in range(np.max(y)+1):
-        data_i = x[y==i]
-        sorted_data = np.sort(data_i)
-        yvals = np.arange(len(sorted_data))/float(len(sorted_data))
+        data_i = sorted_data[sorted_y==i]
+        yvals = np.arange(len(data_i))/float(len(data_i))
         if ccdf:
             yvals = 1 - yvals
-        ax.plot(sorted_data,yvals, color=cp[i+1], label='{}'.format(i))
+        ax.plot(data_i,yvals, color=cp[i+1], label='{}'.format(i))
     
-    x0 = min(x)
-    x1 = max(x)
+    x0 = sorted_data[0]
+    x1 = sorted_data[-1]
     
-    sorted_data = np.sort(x)
     yvals = np.arange(len(x))/float(len(x))
     if ccdf:
         yvals = 1 - yvals
@@ -167,7 +346,7 @@ def plot_continuous_cdf(ax, unc, x, y, xticklabels_on,
         
 def plot_cdf(ax, unc, x, y, discrete=False,
             legend=False, xticklabels_on=False,
-            yticklabels_on=False, ccdf=False):
+            yticklabels_on=False, ccdf=False, is_sorted=False):
     '''plot cdf for x conditional on y
     
     Parameters
@@ -186,6 +365,9 @@ def plot_cdf(ax, unc, x, y, discrete=False,
     xticklabels_on : bool, optional
     ccdf : bool, optional
            if true, plot a complementary cdf instead of a normal cdf.
+    is_sorted : bool, optional
+                if true, x is already sorted, with y in the same order. Only
+                used for continuous cdfs.
     
     '''
 
@@ -194,7 +376,7 @@ def plot_cdf(ax, unc, x, y, discrete=False,
                          ccdf)
     else:
         plot_continuous_cdf(ax, unc, x, y, xticklabels_on,
-                           ccdf)
+                           ccdf, is_sorted=is_sorted)
 
     if legend:
         proxies, labels = build_legend(x,y)
@@ -215,9 +397,10 @@ def plot_cdf(ax, unc, x, y, discrete=False,
         ax.text(x0+0.01*x1, 1, str(unc), va='top', ha='left')
         
 
-def plot_cdfs(x, y, ccdf=False):
+def plot_cdfs(x, y, ccdf=False, sorted_experiments=None, distances=None):
     '''plot cumulative density functions for each column in x, based on the 
-    classification specified in y.
+    classification specified in y. Each cdf is annotated with the 
+    Kolmogorov-Smirnov distance for each class, see :func:`cdf_distances`.
     
     Parameters
     ----------
@@ -227,10 +410,20 @@ def plot_cdfs(x, y, ccdf=False):
         the categorization for the data
     ccdf : bool, optional
            if true, plot a complementary cdf instead of a normal cdf.
+    sorted_experiments : SortedExperiments, optional
+                         x sorted by :func:`sort_experiments`, for example
+                         as used for :func:`cdf_distances`
+    distances : DataFrame, optional
+                the distances as returned by :func:`cdf_distances` for 
+                x and y, calculated if not provided
     
     '''
+    if sorted_experiments is None:
+        sorted_experiments = sort_experiments(x)
+    if distances is None:
+        distances = cdf_distances(sorted_experiments, y)
     
-    uncs = rf.get_names(x.dtype)
+    uncs = sorted_experiments.uncs
     cp = sns.color_palette()
     
     n_col = 4
@@ -249,10 +442,17 @@ def plot_cdfs(x, y, ccdf=False):
         i_row = i // n_col
         ax = axes[i_row, i_col]
         
-        data = x[unc]
+        order = sorted_experiments.orders[:, i]
+        data = x[unc][order]
         if x.dtype[unc] == np.dtype('O'):
             discrete = True
-        plot_cdf(ax, unc, data, y, discrete, ccdf=ccdf)
+        plot_cdf(ax, unc, data, y[order], discrete, ccdf=ccdf, 
+                 is_sorted=True)
+        
+        for j, distance in enumerate(distances.loc[unc]):
+            ax.text(0.98, 0.02+0.08*j, 'D={:.2f}'.format(distance), 
+                    transform=ax.transAxes, ha='right', va='bottom', 
+                    color=cp[j+1])
     
     # last row might contain empty axis, 
     # let's make them disappear
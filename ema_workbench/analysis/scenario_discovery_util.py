@@ -90,7 +90,7 @@ def _make_box(x):
     for name in names:
         dtype = x.dtype.fields.get(name)[0] 
         mask = np.ma.getmaskarray(x[name])
-        values = x[name][mask==False]
+        values = np.ma.getdata(x[name])[mask==False]
         
         if dtype == 'object':
             try:
@@ -243,32 +243,8 @@ def _in_box(x, boxlim):
         valid numpy indices on x
     
     '''
-    logical = np.ones(x.shape[0], dtype=np.bool)
-    
     dims = recfunctions.get_names(boxlim.dtype)
-
-    for name in dims:
-        value = x.dtype.fields.get(name)[0]
-        
-        if value == 'object':
-            entries = boxlim[name][0]
-            l = np.ones( (x.shape[0], len(entries)), dtype=np.bool)
-            for i,entry in enumerate(entries):
-                if type(list(entries)[0]) not in (str, float, int):
-                    bools = []                
-                    for element in list(x[name]):
-                        if element == entry:
-                            bools.append(True)
-                        else:
-                            bools.append(False)
-                    l[:, i] = np.asarray(bools, dtype=bool)
-                else:
-                    l[:, i] = x[name] == entry
-            l = np.any(l, axis=1)
-            logical = logical & l
-        else:
-            logical = logical & (boxlim[name][0] <= x[name] )&\
-                                        (x[name] <= boxlim[name][1])                
+    logical = EncodedExperiments(x, dims).in_box(boxlim)
     
     indices = np.where(logical==True)
     
@@ -278,6 +254,121 @@ def _in_box(x, boxlim):
     return indices
 
 
+class EncodedExperiments(object):
+    '''
+    
+    Experiments encoded for testing whether they are within one or more 
+    boxes. Numeric columns are used as is, while categorical columns are 
+    encoded as small integers. The limits of a box on a categorical column 
+    become a lookup table on these integers, so testing for many boxes at 
+    once is a single vectorised pass over each column. Masked values are 
+    never within a box.
+    
+    Parameters
+    ----------
+    x : numpy structured array
+    names : list of str, optional
+            the columns to encode, defaults to all columns of x
+    
+    '''
+    
+    def __init__(self, x, names=None):
+        if names is None:
+            names = recfunctions.get_names(x.dtype)
+        
+        self.x = x
+        self.n = x.shape[0]
+        self.columns = {}
+        self.categories = {}
+        self.valid = {}
+        
+        for name in names:
+            values = np.ma.getdata(x[name])
+            valid = np.logical_not(np.ma.getmaskarray(x[name]))
+            
+            if x.dtype.fields.get(name)[0] == np.dtype(object):
+                codes, uniques = pd.factorize(values)
+                codes[valid==False] = -1
+                self.columns[name] = codes
+                self.categories[name] = {value:i for i, value in 
+                                         enumerate(uniques)}
+            else:
+                self.columns[name] = values
+                if not np.all(valid):
+                    self.valid[name] = valid
+    
+    def in_box(self, box_lim, indices=None):
+        '''
+        
+        Parameters
+        ----------
+        box_lim : numpy structured array
+        indices : ndarray, optional
+                  only test these experiments
+        
+        Returns
+        -------
+        ndarray
+            boolean array, True for the experiments within the box
+        
+        '''
+        return self.in_boxes([box_lim], indices)[:, 0]
+    
+    def in_boxes(self, box_lims, indices=None):
+        '''
+        
+        Parameters
+        ----------
+        box_lims : list of numpy structured arrays
+                   with the same dtype
+        indices : ndarray, optional
+                  only test these experiments
+        
+        Returns
+        -------
+        ndarray
+            boolean array of shape (nr. of experiments, nr. of boxes), True 
+            if an experiment is within a box
+        
+        '''
+        n = self.n if indices is None else indices.shape[0]
+        logical = np.ones((n, len(box_lims)), dtype=np.bool)
+        if not len(box_lims):
+            return logical
+        
+        for name in recfunctions.get_names(box_lims[0].dtype):
+            values = self.columns[name]
+            if indices is not None:
+                values = values[indices]
+            
+            if name in self.categories:
+                mapping = self.categories[name]
+                
+                # the last entry is for code -1, so masked values are 
+                # never in a box
+                lookup = np.zeros((len(mapping)+1, len(box_lims)), 
+                                  dtype=np.bool)
+                for i, box_lim in enumerate(box_lims):
+                    for entry in box_lim[name][0]:
+                        code = mapping.get(entry)
+                        if code is not None:
+                            lookup[code, i] = True
+                logical &= lookup[values]
+            else:
+                lower = np.asarray([box_lim[name][0] for box_lim in box_lims])
+                upper = np.asarray([box_lim[name][1] for box_lim in box_lims])
+                logical &= (lower[np.newaxis, :] <= values[:, np.newaxis]) &\
+                           (values[:, np.newaxis] <= upper[np.newaxis, :])
+            
+            if name in self.valid:
+                valid = self.valid[name]
+                if indices is not None:
+                    valid = valid[indices]
+                logical &= valid[:, np.newaxis]
+        
+        return logical
+
+
 class OutputFormatterMixin(object, metaclass=abc.ABCMeta):
     @abc.abstractproperty
     def boxes(self):
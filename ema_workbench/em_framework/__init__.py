@@ -4,18 +4,19 @@ from __future__ import (absolute_import, unicode_literals, division,
 
 __all__ = ["ema_parallel", "parameters"
            "model", "outcomes", "samplers", 
-           "Model", 'FileModel', "ModelEnsemble",
+           "Model", 'FileModel', "VectorizedModel", "ModelEnsemble",
            "Outcome", "ScalarOutcome", "TimeSeriesOutcome",
            "RealParameter", "IntegerParameter", "CategoricalParameter",
            "Scenario", "Policy", "Experiment", "Constant", "create_parameters",
            "parameters_to_csv", "Category", "SobolSampler", "MorrisSampler",
            "get_SALib_problem", "FASTSampler"
            "peform_experiments", "IpyparallelEvaluator", 
-           "MultiprocessingEvaluator", "SequentialEvaluator"
+           "MultiprocessingEvaluator", "SequentialEvaluator",
+           "ExperimentCache"
            ]
 
 from .outcomes import ScalarOutcome, TimeSeriesOutcome, Outcome
-from .model import Model, FileModel
+from .model import Model, FileModel, VectorizedModel
 from .parameters import (RealParameter, IntegerParameter, CategoricalParameter,
                      Scenario, Policy, Constant, Experiment, create_parameters,
                      parameters_to_csv, Category, experiment_generator)
@@ -24,5 +25,6 @@ from .samplers import (MonteCarloSampler, FullFactorialSampler, LHSSampler,
                        sample_uncertainties)
 from .salib_samplers import (SobolSampler, MorrisSampler, FASTSampler, 
                              get_SALib_problem)
+from .cache import ExperimentCache
 from .evaluators import (perform_experiments, IpyparallelEvaluator, 
                          MultiprocessingEvaluator, SequentialEvaluator)
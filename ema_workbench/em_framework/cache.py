@@ -0,0 +1,384 @@
+'''
+
+Content addressed cache for the results of experiments.
+
+An experiment is identified by a hash of everything that determines its
+result: the name and version of the model, the values of the uncertainties
+and levers of the model, the constants, the replications, and the
+outcomes. Experiments that have been run before, for example because the
+same scenarios are run against a new set of policies, can thus be served
+from the cache rather than being run again.
+
+The cache is a sqlite database, either in memory or in a file so it
+persists across runs. The least recently used results are evicted if the
+cache exceeds its maximum size.
+
+'''
+from __future__ import (absolute_import, print_function, division,
+                        unicode_literals)
+
+import hashlib
+import pickle
+import sqlite3
+import threading
+
+import numpy as np
+
+from .parameters import experiment_generator
+from ..util import EMAError
+
+__all__ = ['ExperimentCache', 'experiment_key']
+
+
+def _normalize(value):
+    '''turn value into a structure of python builtins with a stable
+    repr'''
+    if isinstance(value, np.ndarray):
+        return _normalize(value.tolist())
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, dict):
+        return sorted((str(k), _normalize(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    return value
+
+
+def _resolve(values, parameters):
+    '''the values of the parameters, using the default of a parameter if
+    it is not in values. All values are used if there are no
+    parameters.'''
+    if not parameters:
+        return dict(values)
+
+    resolved = {}
+    for par in parameters:
+        try:
+            resolved[par.name] = values[par.name]
+        except KeyError:
+            if par.default is not None:
+                resolved[par.name] = par.default
+    return resolved
+
+
+def experiment_key(model, scenario, policy):
+    '''
+    the key of an experiment in the cache
+
+    Parameters
+    ----------
+    model : AbstractModel instance
+    scenario : Scenario instance
+    policy : Policy instance
+
+    Returns
+    -------
+    str
+        hex digest of the sha1 hash of the model name and version, the
+        resolved values of the uncertainties and levers, the constants, the
+        replications (including any seeds in them), and the outcome names
+
+    '''
+    content = [model.name,
+               model.version,
+               _resolve(scenario, model.uncertainties),
+               _resolve(policy, model.levers),
+               {c.name:c.value for c in model.constants},
+               getattr(model, 'replications', None),
+               [o.name for o in model.outcomes]]
+
+    content = repr(_normalize(content)).encode('utf-8')
+    return hashlib.sha1(content).hexdigest()
+
+
+class ExperimentCache(object):
+    '''
+    cache for the results of experiments, with least recently used
+    eviction.
+
+    Parameters
+    ----------
+    filename : str, optional
+               the sqlite database in which the results are stored. If
+               not provided, the cache is kept in memory.
+    max_size : int, optional
+               the maximum number of results in the cache. If None, the
+               size of the cache is not limited.
+
+    Attributes
+    ----------
+    hits : int
+           the number of experiments found in the cache
+    misses : int
+             the number of experiments not found in the cache
+
+    Raises
+    ------
+    EMAError
+        if max_size is smaller than 1
+
+    Results are pickled, so the cache is only as portable as the outcomes
+    of the model. Change the version of a model if it has been changed in
+    a way that affects its results, so that old results are not served.
+
+    '''
+
+    def __init__(self, filename=None, max_size=None):
+        if (max_size is not None) and (max_size < 1):
+            raise EMAError('max_size should be at least 1, not {}'.format(
+                                                                    max_size))
+
+        self.filename = filename
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+        # results are stored from the thread handling the results of the
+        # pool
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(filename or ':memory:',
+                                           check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        with self._connection:
+            self._connection.execute(('CREATE TABLE IF NOT EXISTS results '
+                                      '(key TEXT PRIMARY KEY, value BLOB, '
+                                      'accessed INTEGER)'))
+            self._connection.execute(('CREATE INDEX IF NOT EXISTS accessed '
+                                      'ON results (accessed)'))
+
+        self._size, clock = self._connection.execute(
+                    'SELECT COUNT(*), MAX(accessed) FROM results').fetchone()
+        self._clock = clock or 0
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, key):
+        with self._lock:
+            return self._connection.execute(
+                        'SELECT 1 FROM results WHERE key=?',
+                        (key,)).fetchone() is not None
+
+    def _tick(self):
+        self._clock += 1
+        return self._clock
+
+    def get(self, key):
+        '''
+        the result for key, or None if key is not in the cache
+
+        Parameters
+        ----------
+        key : str
+
+        Returns
+        -------
+        dict or None
+
+        '''
+        with self._lock:
+            row = self._connection.execute(
+                        'SELECT value FROM results WHERE key=?',
+                        (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+
+            # the update is committed together with the next results
+            # stored, or upon flush
+            self._connection.execute(
+                        'UPDATE results SET accessed=? WHERE key=?',
+                        (self._tick(), key))
+        return pickle.loads(row[0])
+
+    def put(self, key, result):
+        '''
+        store the result for key
+
+        Parameters
+        ----------
+        key : str
+        result : dict
+
+        '''
+        self.put_many([(key, result)])
+
+    def put_many(self, items):
+        '''
+        store a batch of results in a single transaction
+
+        Parameters
+        ----------
+        items : list of (key, dict) tuples
+
+        '''
+        rows = [(key, sqlite3.Binary(pickle.dumps(result,
+                                            pickle.HIGHEST_PROTOCOL)))
+                for key, result in items]
+
+        with self._lock, self._connection:
+            for key, value in rows:
+                new = self._connection.execute(
+                        'SELECT 1 FROM results WHERE key=?',
+                        (key,)).fetchone() is None
+                self._connection.execute(
+                        'INSERT OR REPLACE INTO results VALUES (?, ?, ?)',
+                        (key, value, self._tick()))
+                self._size += new
+
+            if self.max_size and self._size > self.max_size:
+                self._connection.execute(
+                        ('DELETE FROM results WHERE key IN (SELECT key FROM '
+                         'results ORDER BY accessed LIMIT ?)'),
+                        (self._size-self.max_size,))
+                self._size = self.max_size
+
+    def flush(self):
+        '''commit any pending changes to the database'''
+        with self._lock:
+            self._connection.commit()
+
+    def clear(self):
+        '''remove all results from the cache'''
+        with self._lock, self._connection:
+            self._connection.execute('DELETE FROM results')
+            self._size = 0
+
+    def close(self):
+        '''commit any pending changes and close the database'''
+        with self._lock:
+            self._connection.commit()
+            self._connection.close()
+
+    def reset_counters(self):
+        '''reset the hits and misses counters to zero'''
+        self.hits = 0
+        self.misses = 0
+
+
+def _is_complete(result, outcomes):
+    '''returns True if result has a value without nan's for each of the
+    outcomes. The results of experiments for which the model raised a
+    CaseError lack outcomes or contain nan's.'''
+    for name in outcomes:
+        try:
+            value = result[name]
+        except KeyError:
+            return False
+
+        try:
+            if np.any(np.isnan(value)):
+                return False
+        except TypeError:
+            # not a numeric outcome
+            pass
+    return True
+
+
+class CachingCallback(object):
+    '''
+    wrapper around a callback, which stores each result it receives in the
+    cache before passing it on to the callback. The results of failed
+    experiments, which lack outcomes or contain nan's, are not stored.
+
+    Parameters
+    ----------
+    callback : AbstractCallback instance
+    cache : ExperimentCache instance
+    keys : dict
+           the cache key for each experiment_id
+    outcomes : dict
+               the names of the outcomes for each model name
+
+    '''
+
+    def __init__(self, callback, cache, keys, outcomes):
+        self.callback = callback
+        self.cache = cache
+        self.keys = keys
+        self.outcomes = outcomes
+
+    def _key(self, experiment, result):
+        '''the cache key for result, or None if it should not be cached'''
+        key = self.keys.pop(experiment.experiment_id)
+        if _is_complete(result, self.outcomes[experiment.model_name]):
+            return key
+        return None
+
+    def __call__(self, experiment, result):
+        key = self._key(experiment, result)
+        if key is not None:
+            self.cache.put(key, result)
+        self.callback(experiment, result)
+
+    def store_batch(self, batch):
+        items = [(self._key(experiment, result), result) for experiment,
+                 result in batch]
+        self.cache.put_many([(key, result) for key, result in items if
+                             key is not None])
+        self.callback.store_batch(batch)
+
+    def __getattr__(self, name):
+        return getattr(self.callback, name)
+
+
+def serve_from_cache(cache, models, scenarios, policies, callback, skip=None,
+                     batch_size=1000):
+    '''
+    pass the results of the experiments that are in the cache to callback
+
+    Parameters
+    ----------
+    cache : ExperimentCache instance
+    models : list of AbstractModel instances
+    scenarios : iterable of Scenario instances
+    policies : iterable of Policy instances
+    callback : AbstractCallback instance
+    skip : collection of ints, optional
+           experiment_ids of experiments that should not be considered
+    batch_size : int, optional
+                 the number of cached results passed to the callback at
+                 once
+
+    Returns
+    -------
+    set
+        skip extended with the experiment_ids of the experiments that are
+        served from the cache
+    CachingCallback instance
+        the callback to use for the remaining experiments, which stores
+        their results in the cache
+
+    '''
+    by_name = {model.name:model for model in models}
+
+    keys = {}
+    hits = []
+    batch = []
+    for experiment in experiment_generator(scenarios, models, policies,
+                                           skip=skip):
+        key = experiment_key(by_name[experiment.model_name],
+                             experiment.scenario, experiment.policy)
+        result = cache.get(key)
+
+        if result is None:
+            keys[experiment.experiment_id] = key
+        else:
+            hits.append(experiment.experiment_id)
+            batch.append((experiment, result))
+            if len(batch) >= batch_size:
+                callback.store_batch(batch)
+                batch = []
+
+    if batch:
+        callback.store_batch(batch)
+    cache.flush()
+
+    skip = set(skip or ())
+    skip.update(hits)
+    outcomes = {model.name:[o.name for o in model.outcomes] for model in
+                models}
+    return skip, CachingCallback(callback, cache, keys, outcomes)
@@ -16,11 +16,14 @@ from __future__ import (absolute_import, print_function, division,
                         unicode_literals)
 
 import abc
+from collections import defaultdict
+import os
 from threading import Lock
 
 import numpy as np
 
 from ..util import ema_logging, ema_exceptions
+from ..util.utilities import ResultsStore
 from .parameters import CategoricalParameter, IntegerParameter
 
 #
@@ -30,7 +33,12 @@ from .parameters import CategoricalParameter, IntegerParameter
 #
 
 __all__ = ['AbstractCallback',
-           'DefaultCallback']
+           'DefaultCallback',
+           'ColumnarCallback',
+           'StreamingCallback',
+           'PersistentCallback',
+           'AbstractSink',
+           'NpzSink']
 
 class AbstractCallback(object, metaclass=abc.ABCMeta):
     '''
@@ -101,6 +109,21 @@ class AbstractCallback(object, metaclass=abc.ABCMeta):
         if self.i % self.reporting_interval == 0:
             ema_logging.info(str(self.i)+" cases completed")
 
+    def store_batch(self, batch):
+        '''
+        Method for storing a batch of results at once. The default 
+        implementation simply calls the callback for each experiment in the 
+        batch. Extensions of AbstractCallback can override this method to 
+        amortize the cost of storing over the entire batch.
+        
+        Parameters
+        ----------
+        batch : list of (Experiment, dict) tuples
+        
+        '''
+        for experiment, result in batch:
+            self(experiment, result)
+
     @abc.abstractmethod
     def get_results(self):
         """
@@ -255,4 +278,577 @@ class DefaultCallback(AbstractCallback):
         self.lock.release()
         
     def get_results(self):
-        return self.cases, self.results
\ No newline at end of file
+        return self.cases, self.results
+
+class ColumnarCallback(AbstractCallback):
+    """
+    callback which stores the experiments in typed, preallocated columns.
+    
+    In contrast to :class:`DefaultCallback`, the experiments are not written
+    as a tuple per case into a structured array. Instead, each parameter has
+    its own numpy array and the column for each parameter is determined once
+    at initialization. Categorical parameters, as well as the model and 
+    policy names, are stored as integer codes. Results can be written in 
+    batches using :meth:`store_batch`, which amortizes the locking and the 
+    handling of the outcomes over all experiments in the batch.
+    
+    :meth:`get_results` returns the experiments as a structured array and
+    the outcomes as a dict of arrays, identical to :class:`DefaultCallback`.
+    
+    Parameters
+    ----------
+    uncs : list
+            a list of the parameters over which the experiments 
+            are being run.
+    levers : list
+             a list of the levers over which the experiments are being
+             run.
+    outcomes : list
+               a list of outcomes
+    nr_experiments : int
+                     the total number of experiments to be executed
+    reporting_interval : int, optional 
+                         the interval at which to provide progress 
+                         information via logging.
+    
+    """
+    
+    MISSING = -1
+    shape_error_msg = "can only save up to 2d arrays, this array is {}d"
+    
+    def __init__(self, 
+                 uncs, 
+                 levers,
+                 outcomes, 
+                 nr_experiments, 
+                 reporting_interval=100):
+        super(ColumnarCallback, self).__init__(uncs, 
+                                               levers,
+                                               outcomes, 
+                                               nr_experiments, 
+                                               reporting_interval)
+        self.i = 0
+        self.results = {}
+        self.lock = Lock()
+        self.nr_experiments = nr_experiments
+        self.outcomes = [outcome.name for outcome in outcomes]
+        
+        self.parameters = []
+        self.dtypes = []
+        self.column_index = {}
+        self.columns = []
+        
+        # for each coded column, a mapping from value to code and the
+        # list of values in code order
+        self.codes = {}
+        self.categories = {}
+        
+        for parameter in uncs + levers:
+            name = parameter.name
+            
+            if isinstance(parameter, CategoricalParameter):
+                categories = [cat.value for cat in parameter.categories]
+                self._add_column(name, object, categories)
+            elif isinstance(parameter, IntegerParameter):
+                self._add_column(name, int)
+            else:
+                self._add_column(name, float)
+            self.parameters.append(name)
+            
+        self._add_column('model', object, [])
+        self._add_column('policy', object, [])
+    
+    def _add_column(self, name, dtype, categories=None):
+        self.column_index[name] = len(self.columns)
+        self.dtypes.append((str(name), dtype))
+        
+        if categories is None:
+            column = np.zeros((self.nr_experiments, ), dtype=dtype)
+            if dtype is float:
+                column[:] = np.NAN
+        else:
+            column = np.empty((self.nr_experiments, ), dtype=np.int32)
+            column[:] = self.MISSING
+            self.categories[name] = list(categories)
+            self.codes[name] = {value:code for code, value in 
+                                enumerate(categories)}
+        self.columns.append(column)
+
+    def _encode(self, name, values):
+        '''translate values into their integer codes, values that have not 
+        been seen before are added as a new code'''
+        codes = self.codes[name]
+        categories = self.categories[name]
+        
+        encoded = np.empty((len(values), ), dtype=np.int32)
+        for j, value in enumerate(values):
+            try:
+                encoded[j] = codes[value]
+            except KeyError:
+                if value is None:
+                    encoded[j] = self.MISSING
+                    continue
+                
+                code = len(categories)
+                codes[value] = code
+                categories.append(value)
+                encoded[j] = code
+        return encoded
+    
+    def _store_cases(self, case_ids, experiments):
+        designs = []
+        for experiment in experiments:
+            scenario = getattr(experiment.scenario, 'data', experiment.scenario)
+            policy = getattr(experiment.policy, 'data', experiment.policy)
+            designs.append((scenario, policy))
+        
+        for name in self.parameters:
+            column = self.columns[self.column_index[name]]
+            
+            if name in self.codes:
+                values = [scenario.get(name, policy.get(name)) for 
+                          scenario, policy in designs]
+                column[case_ids] = self._encode(name, values)
+            else:
+                values = [scenario.get(name, policy.get(name, np.nan)) for 
+                          scenario, policy in designs]
+                column[case_ids] = values
+        
+        models = [experiment.model_name for experiment in experiments]
+        policies = [experiment.policy.name for experiment in experiments]
+        
+        column = self.columns[self.column_index['model']]
+        column[case_ids] = self._encode('model', models)
+        column = self.columns[self.column_index['policy']]
+        column[case_ids] = self._encode('policy', policies)
+    
+    def _allocate(self, outcome, shape):
+        if len(shape)>2:
+            raise ema_exceptions.EMAError(self.shape_error_msg.format(len(shape)))
+        
+        shape = list(shape)
+        shape.insert(0, self.nr_experiments)
+        
+        stored = np.empty(shape)
+        stored[:] = np.NAN
+        self.results[outcome] = stored
+        return stored
+    
+    def _store_case(self, experiment):
+        case_id = experiment.experiment_id
+        scenario = experiment.scenario
+        policy = experiment.policy
+        
+        for name in self.parameters:
+            try:
+                value = scenario[name]
+            except KeyError:
+                try:
+                    value = policy[name]
+                except KeyError:
+                    value = None if name in self.codes else np.nan
+            
+            if name in self.codes:
+                value = self._encode(name, [value])[0]
+            self.columns[self.column_index[name]][case_id] = value
+
+        column = self.columns[self.column_index['model']]
+        column[case_id] = self._encode('model', [experiment.model_name])[0]
+        column = self.columns[self.column_index['policy']]
+        column[case_id] = self._encode('policy', [policy.name])[0]
+    
+    def _store_result(self, case_id, result):
+        for outcome in self.outcomes:
+            try:
+                outcome_res = result[outcome]
+            except KeyError:
+                ema_logging.debug("%s not specified as outcome in msi" % outcome)
+            else:
+                try:
+                    stored = self.results[outcome]
+                except KeyError:
+                    shape = np.asarray(outcome_res).shape
+                    stored = self._allocate(outcome, shape)
+                stored[case_id, ] = outcome_res
+    
+    def _store_results(self, case_ids, results):
+        for outcome in self.outcomes:
+            ids = []
+            values = []
+            for case_id, result in zip(case_ids, results):
+                try:
+                    values.append(result[outcome])
+                except KeyError:
+                    ema_logging.debug("%s not specified as outcome in msi" % 
+                                      outcome)
+                else:
+                    ids.append(case_id)
+            
+            if not ids:
+                continue
+            
+            values = np.asarray(values)
+            
+            try:
+                stored = self.results[outcome]
+            except KeyError:
+                stored = self._allocate(outcome, values.shape[1::])
+            stored[ids, ] = values
+    
+    def __call__(self, experiment, result):
+        '''
+        Method responsible for storing results. This method calls 
+        :meth:`super` first, thus utilizing the logging provided there
+        
+        Parameters
+        ----------
+        experiment: Experiment instance
+        result: dict
+                the result dict
+        
+        '''
+        super(ColumnarCallback, self).__call__(experiment, result)
+        
+        with self.lock:
+            self._store_case(experiment)
+            self._store_result(experiment.experiment_id, result)
+    
+    def store_batch(self, batch):
+        '''
+        Method responsible for storing a batch of results. 
+        
+        Parameters
+        ----------
+        batch : list of (Experiment, dict) tuples
+        
+        '''
+        if not batch:
+            return
+        
+        experiments, results = zip(*batch)
+        case_ids = np.fromiter((e.experiment_id for e in experiments), 
+                               dtype=int, count=len(experiments))
+        
+        with self.lock:
+            self._store_cases(case_ids, experiments)
+            self._store_results(case_ids, results)
+            
+            previous = self.i
+            self.i += len(batch)
+        
+        ema_logging.debug(str(self.i)+" cases completed")
+        if (self.i // self.reporting_interval) > \
+           (previous // self.reporting_interval):
+            ema_logging.info(str(self.i)+" cases completed")
+    
+    def get_results(self):
+        cases = np.empty((self.nr_experiments,), dtype=self.dtypes)
+        
+        for name, _ in self.dtypes:
+            column = self.columns[self.column_index[name]]
+            
+            if name in self.codes:
+                # the MISSING code indexes the trailing nan
+                categories = np.empty((len(self.categories[name])+1,),
+                                      dtype=object)
+                for code, value in enumerate(self.categories[name]):
+                    categories[code] = value
+                categories[-1] = np.nan
+                column = categories[column]
+            cases[name] = column
+        
+        return cases, self.results
+
+
+class AbstractSink(object, metaclass=abc.ABCMeta):
+    '''
+    Abstract base class for sinks to which a :class:`StreamingCallback` 
+    writes the results in chunks.
+    
+    '''
+    
+    @abc.abstractmethod
+    def write(self, experiment_ids, experiments, outcomes):
+        '''
+        write a chunk of results
+        
+        Parameters
+        ----------
+        experiment_ids : numpy array of ints
+        experiments : structured numpy array 
+                      the experiments in the chunk, in the same order as 
+                      experiment_ids
+        outcomes : dict
+                   with the outcome name as key and an array with the 
+                   results for the chunk as value.
+        
+        '''
+    
+    def close(self):
+        '''
+        called after all experiments have been completed. The return value
+        is returned by :meth:`StreamingCallback.get_results`. 
+        
+        '''
+        return self
+
+
+class NpzSink(AbstractSink):
+    '''
+    sink which writes each chunk to a separate npz file in a directory.
+    
+    Parameters
+    ----------
+    directory : str
+                the directory in which to write the chunks. It is created
+                if it does not exist.
+    
+    '''
+    
+    file_name = 'chunk_{:06d}.npz'
+    
+    def __init__(self, directory):
+        self.directory = os.path.abspath(directory)
+        self.nr_chunks = 0
+        
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+    
+    def write(self, experiment_ids, experiments, outcomes):
+        arrays = {'outcome_{}'.format(k):v for k, v in outcomes.items()}
+        arrays['experiment_ids'] = experiment_ids
+        arrays['experiments'] = experiments
+        
+        fn = os.path.join(self.directory, self.file_name.format(self.nr_chunks))
+        np.savez(fn, **arrays)
+        self.nr_chunks += 1
+    
+    def load(self):
+        '''
+        load all chunks into memory, ordered by experiment_id 
+        
+        Returns
+        -------
+        experiments : structured numpy array
+        outcomes : dict
+        
+        '''
+        file_names = sorted(fn for fn in os.listdir(self.directory) if 
+                            fn.endswith('.npz'))
+        
+        ids = []
+        experiments = []
+        outcomes = defaultdict(list)
+        for fn in file_names:
+            with np.load(os.path.join(self.directory, fn), 
+                         allow_pickle=True) as data:
+                ids.append(data['experiment_ids'])
+                experiments.append(data['experiments'])
+                
+                for key in data.files:
+                    if key.startswith('outcome_'):
+                        outcomes[key[len('outcome_')::]].append(data[key])
+        
+        order = np.argsort(np.concatenate(ids), kind='mergesort')
+        experiments = np.concatenate(experiments)[order]
+        outcomes = {k:np.concatenate(v)[order] for k, v in outcomes.items()}
+        return experiments, outcomes
+
+
+class StreamingCallback(AbstractCallback):
+    '''
+    callback which buffers the results and flushes them in chunks to a 
+    sink, rather than keeping all results in memory. Memory use is 
+    therefore bounded by chunk_size, rather than the number of experiments.
+    
+    Parameters
+    ----------
+    uncs : list
+            a list of the parameters over which the experiments 
+            are being run.
+    levers : list
+             a list of the levers over which the experiments are being
+             run.
+    outcomes : list
+               a list of outcomes
+    nr_experiments : int
+                     the total number of experiments to be executed
+    reporting_interval : int, optional 
+                         the interval at which to provide progress 
+                         information via logging.
+    sink : AbstractSink instance
+    chunk_size : int, optional
+                 the number of experiments after which the results are
+                 written to the sink
+    
+    
+    Because perform_experiments instantiates the callback, use e.g. 
+    functools.partial to specify the sink. 
+    
+    '''
+    
+    def __init__(self, 
+                 uncs, 
+                 levers,
+                 outcomes, 
+                 nr_experiments, 
+                 reporting_interval=100,
+                 sink=None,
+                 chunk_size=10000):
+        super(StreamingCallback, self).__init__(uncs, 
+                                                levers,
+                                                outcomes, 
+                                                nr_experiments, 
+                                                reporting_interval)
+        if sink is None:
+            raise ValueError('no sink specified')
+        
+        self.i = 0
+        self.uncs = uncs
+        self.levers = levers
+        self.outcomes = outcomes
+        self.nr_experiments = nr_experiments
+        self.sink = sink
+        self.chunk_size = chunk_size
+        
+        self.lock = Lock()
+        self.buffer = []
+    
+    def flush(self):
+        '''write the buffered results to the sink'''
+        with self.lock:
+            batch = self.buffer
+            self.buffer = []
+        
+            if not batch:
+                return
+            
+            experiments, results = zip(*batch)
+            experiment_ids = np.fromiter((e.experiment_id for e in 
+                                          experiments), dtype=int, 
+                                         count=len(batch))
+            
+            chunk = ColumnarCallback(self.uncs, self.levers, self.outcomes, 
+                                     len(batch), reporting_interval=len(batch))
+            local_ids = np.arange(len(batch))
+            chunk._store_cases(local_ids, experiments)
+            chunk._store_results(local_ids, results)
+            
+            chunk_experiments, chunk_outcomes = chunk.get_results()
+            self.sink.write(experiment_ids, chunk_experiments, chunk_outcomes)
+        
+    def __call__(self, experiment, result):
+        '''
+        Method responsible for storing results. This method calls 
+        :meth:`super` first, thus utilizing the logging provided there
+        
+        Parameters
+        ----------
+        experiment: Experiment instance
+        result: dict
+                the result dict
+        
+        '''
+        super(StreamingCallback, self).__call__(experiment, result)
+        
+        with self.lock:
+            self.buffer.append((experiment, result))
+            full = len(self.buffer) >= self.chunk_size
+        
+        if full:
+            self.flush()
+    
+    def get_results(self):
+        self.flush()
+        return self.sink.close()
+
+
+class PersistentCallback(StreamingCallback):
+    '''
+    callback which appends the results in chunks to a 
+    :class:`~utilities.ResultsStore` on disk. If a run is interrupted, at 
+    most chunk_size experiments are lost, and the run can be resumed by 
+    calling perform_experiments with resume=True and the same directory.
+    
+    Parameters
+    ----------
+    uncs : list
+            a list of the parameters over which the experiments 
+            are being run.
+    levers : list
+             a list of the levers over which the experiments are being
+             run.
+    outcomes : list
+               a list of outcomes
+    nr_experiments : int
+                     the total number of experiments to be executed
+    reporting_interval : int, optional 
+                         the interval at which to provide progress 
+                         information via logging.
+    directory : str
+                the directory of the store
+    chunk_size : int, optional
+                 the number of experiments after which the results are
+                 written to disk
+    resume : bool, optional
+             whether to add the results to those of an interrupted run in 
+             directory. perform_experiments sets this if it is called 
+             with resume=True.
+    
+    Raises
+    ------
+    EMAError
+        if directory already contains results and resume is False, or if
+        the number of experiments or the parameters do not match those of
+        the results in directory
+    
+    
+    Because perform_experiments instantiates the callback, use e.g. 
+    functools.partial to specify the directory. 
+    
+    '''
+    
+    def __init__(self, 
+                 uncs, 
+                 levers,
+                 outcomes, 
+                 nr_experiments, 
+                 reporting_interval=100,
+                 directory=None,
+                 chunk_size=1000,
+                 resume=False):
+        if directory is None:
+            raise ValueError('no directory specified')
+        
+        parameters = sorted(p.name for p in list(uncs)+list(levers))
+        store = ResultsStore(directory, nr_experiments, parameters)
+        if store.chunks and not resume:
+            raise ema_exceptions.EMAError(('{} already contains results, '
+                                'resume the run or use another '
+                                'directory').format(directory))
+        
+        super(PersistentCallback, self).__init__(uncs, levers, outcomes,
+                                                 nr_experiments, 
+                                                 reporting_interval,
+                                                 sink=store, 
+                                                 chunk_size=chunk_size)
+    
+    def completed_experiments(self):
+        '''
+        Returns
+        -------
+        set with the ids of the experiments already in the store
+        
+        '''
+        return set(self.sink.experiment_ids().tolist())
+    
+    def get_results(self):
+        '''
+        Returns
+        -------
+        the results of all experiments in the store, including those of 
+        earlier, interrupted, runs
+        
+        '''
+        store = super(PersistentCallback, self).get_results()
+        return store.load()
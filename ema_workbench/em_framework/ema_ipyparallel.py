@@ -12,6 +12,7 @@ import os
 import shutil
 import socket
 import threading
+import time
 
 import zmq
 from zmq.eventloop import ioloop, zmqstream
@@ -292,6 +293,17 @@ class Engine(object):
             raise
         except Exception:
             raise ema_exceptions.EMAParallelError(str(Exception))
+
+    def run_experiments(self, experiments):
+        '''run a block of experiments, the actual running is delegated
+        to an ExperimentRunner instance'''
+        
+        try:
+            return self.runner.run_experiments(experiments) 
+        except ema_exceptions.EMAError:
+            raise
+        except Exception:
+            raise ema_exceptions.EMAParallelError(str(Exception))
        
 
 def initialize_engines(client, msis, cwd):
@@ -318,7 +330,23 @@ def cleanup(client):
 # these functions are wrappers around the relevant Engine methods
 # the engine instance is part of the namespace of the module. 
 def _run_experiment(experiment):
-    return experiment, engine.run_experiment(experiment)
+    '''returns the experiment, its result, the number of calls to 
+    model_init, and the run time'''
+    start = time.time()
+    nr_model_inits = engine.runner.nr_model_inits
+    result = engine.run_experiment(experiment)
+    return (experiment, result, engine.runner.nr_model_inits-nr_model_inits,
+            time.time()-start)
+
+
+def _run_experiments(experiments):
+    '''returns a list of (experiment, result) tuples, the number of calls
+    to model_init, and the run time'''
+    start = time.time()
+    nr_model_inits = engine.runner.nr_model_inits
+    results = list(zip(experiments, engine.run_experiments(experiments)))
+    return (results, engine.runner.nr_model_inits-nr_model_inits, 
+            time.time()-start)
 
 
 def _initialize_engine(engine_id, msis, cwd):
@@ -1,5 +1,19 @@
 '''
 
+support for performing experiments using a multiprocessing pool. 
+
+Next to submitting the experiments themselves to the pool, the experiments
+can be run using :class:`SharedBuffers`. In this case, the scenarios are 
+written once to memory mapped files, which are shared by all processes, 
+and the workers write their results directly into preallocated memory 
+mapped result arrays. A task then only consists of the row indices of the 
+scenarios to run. 
+
+Since a model is initialized whenever it receives an experiment for another
+policy than the previous one, the experiments can also be submitted using 
+:func:`add_tasks_affinity`, which submits a few large chunks of 
+experiments for each process, so each process runs long contiguous runs of
+experiments for the same model and policy.
 
 '''
 from __future__ import (unicode_literals, print_function, absolute_import,
@@ -7,19 +21,26 @@ from __future__ import (unicode_literals, print_function, absolute_import,
 
 from collections import defaultdict
 import io
+import itertools
 import logging
+import math
 import multiprocessing
 import os
+import pickle
 import sys
 import threading
 import time
 import shutil
 import traceback
 
-from ..util import ema_logging
+import numpy as np
+
+from ..util import ema_logging, EMAError
 from .experiment_runner import ExperimentRunner
 from .util import NamedObjectMap
 from .model import AbstractModel
+from .parameters import Experiment
+from .samplers import DesignMatrix
 
 # Created on 22 Feb 2017
 #
@@ -27,6 +48,11 @@ from .model import AbstractModel
 
 __all__ = []
 
+AUTO = 'auto'
+
+# the SharedBuffers most recently used by a worker
+shared_buffers = None
+
 
 def initializer(*args):
     '''initializer for a worker process
@@ -162,9 +188,271 @@ def worker(experiment):
     ----------
     experiment : dict
     
+    Returns
+    -------
+    dict
+        the result of the experiment
+    int
+        the number of calls to model_init
+    
     '''
     global experiment_runner
-    return experiment_runner.run_experiment(experiment)
+    nr_model_inits = experiment_runner.nr_model_inits
+    result = experiment_runner.run_experiment(experiment)
+    return result, experiment_runner.nr_model_inits-nr_model_inits
+
+
+def chunk_worker(experiments):
+    '''the worker function for executing a chunk of experiments
+    
+    Parameters
+    ----------
+    experiments : list of Experiment instances
+    
+    Returns
+    -------
+    list
+        the result for each experiment, up to the experiment that failed 
+        if any
+    float
+        the wall clock time it took to run the chunk
+    int
+        the number of calls to model_init
+    tuple or None
+        the experiment_id of the experiment that failed and the error 
+        message, or None if all experiments were run
+    
+    '''
+    global experiment_runner
+    start = time.time()
+    nr_model_inits = experiment_runner.nr_model_inits
+    results, error = run_chunk(experiments)
+    return (results, time.time()-start, 
+            experiment_runner.nr_model_inits-nr_model_inits, error)
+
+
+def run_chunk(experiments):
+    '''run the experiments, stopping at the first experiment that raises
+    an exception, because the experiment runner cleans up its models in 
+    that case
+    
+    Returns
+    -------
+    list
+        the results of the experiments that have been run
+    tuple or None
+        the experiment_id of the experiment that failed and the error 
+        message, or None if all experiments were run
+    
+    '''
+    if experiment_runner.msis is None:
+        return [], (experiments[0].experiment_id, 
+                    ('not run, the models of this worker have been cleaned '
+                     'up after an earlier failure'))
+    
+    results = []
+    try:
+        experiment_runner.run_experiments(experiments, results)
+    except (EMAError, Exception) as e:
+        # EMAError derives from BaseException
+        experiment = experiments[len(results)]
+        return results, (experiment.experiment_id, 
+                         '{}: {}'.format(type(e).__name__, e))
+    return results, None
+
+
+class SharedBuffers(object):
+    '''scenarios and results in memory mapped .npy files in directory, 
+    shared between the main process and the workers
+    
+    The scenarios are written when the buffers are created. The result 
+    arrays are allocated with :meth:`allocate`, given the result of a 
+    single experiment, so the shape of each outcome has to be the same for
+    all experiments. The results are stored as floats, with NaN for missing
+    results.
+    
+    Parameters
+    ----------
+    directory : str
+    designs : DesignMatrix
+    
+    '''
+    
+    metadata_file = 'buffers.pickle'
+    
+    def __init__(self, directory, designs):
+        self.directory = directory
+        self.parameters = designs.parameters
+        self.kind = designs.kind
+        self.n = designs.n
+        self.outcomes = {}
+        self._designs = designs
+        self._results = None
+        
+        os.makedirs(directory)
+        for i, name in enumerate(designs.params):
+            np.save(self._path('design', i), designs.column(name))
+    
+    def _path(self, kind, index):
+        # names need not be valid file names, so files are numbered
+        return os.path.join(self.directory, '{}_{}.npy'.format(kind, index))
+    
+    def allocate(self, nr_experiments, result):
+        '''allocate the result arrays
+        
+        Parameters
+        ----------
+        nr_experiments : int
+        result : dict
+                 the result of a single experiment
+        
+        '''
+        self.outcomes = {name:np.asarray(value).shape for name, value in 
+                         result.items()}
+        self.nr_experiments = nr_experiments
+        
+        for i, name in enumerate(sorted(self.outcomes)):
+            shape = self.outcomes[name]
+            values = np.lib.format.open_memmap(self._path('result', i),
+                                    mode='w+', dtype=np.float64, 
+                                    shape=(nr_experiments,)+shape)
+            values[:] = np.nan
+            values.flush()
+        
+        # the workers read the buffers from the metadata file
+        with open(os.path.join(self.directory, self.metadata_file), 
+                  'wb') as fh:
+            pickle.dump(self, fh)
+    
+    @classmethod
+    def load(cls, directory):
+        '''load the buffers in directory'''
+        with open(os.path.join(directory, cls.metadata_file), 'rb') as fh:
+            return pickle.load(fh)
+    
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_designs'] = None
+        state['_results'] = None
+        return state
+    
+    @property
+    def designs(self):
+        '''the scenarios as a DesignMatrix'''
+        if self._designs is None:
+            columns = {p.name:np.load(self._path('design', i), 
+                                      mmap_mode='r') for i, p in 
+                       enumerate(self.parameters)}
+            self._designs = DesignMatrix(self.parameters, columns, n=self.n)
+            self._designs.kind = self.kind
+        return self._designs
+    
+    @property
+    def results(self):
+        '''dict with the memory mapped array for each outcome'''
+        if self._results is None:
+            self._results = {name:np.load(self._path('result', i), 
+                                          mmap_mode='r+') for i, name in 
+                             enumerate(sorted(self.outcomes))}
+        return self._results
+    
+    def store(self, experiment_ids, results):
+        '''write the results of the experiments to the result arrays
+        
+        Raises
+        ------
+        EMAError
+            if the shape of an outcome differs from the allocated shape
+        
+        '''
+        arrays = self.results
+        for experiment_id, result in zip(experiment_ids, results):
+            for name, value in result.items():
+                try:
+                    stored = arrays[name]
+                except KeyError:
+                    ema_logging.debug("no buffer for outcome {}".format(name))
+                    continue
+                
+                value = np.asarray(value)
+                if value.shape != self.outcomes[name]:
+                    raise EMAError(("shape of {} is {}, expected {}, shared "
+                                    "buffers require outcomes of the same "
+                                    "shape").format(name, value.shape, 
+                                                    self.outcomes[name]))
+                stored[experiment_id] = value
+    
+    def get(self, experiment_ids):
+        '''a copy of the results for the experiments
+        
+        Returns
+        -------
+        list of dicts
+        
+        '''
+        values = {name:array[experiment_ids] for name, array in 
+                  self.results.items()}
+        return [{name:value[i] for name, value in values.items()} for i in 
+                range(len(experiment_ids))]
+
+
+def shared_chunk_worker(directory, model_name, policy, indices, offset):
+    '''the worker function for executing a chunk of experiments using
+    shared buffers
+    
+    Parameters
+    ----------
+    directory : str
+                the directory of the SharedBuffers
+    model_name : str
+    policy : Policy instance
+    indices : 1d array of ints
+              the indices of the scenarios
+    offset : int
+             the experiment id of the first scenario for model_name and 
+             policy
+    
+    Returns
+    -------
+    float
+        the wall clock time it took to run the chunk
+    int
+        the number of calls to model_init
+    int
+        the number of experiments that have been run
+    tuple or None
+        the experiment_id of the experiment that failed and the error 
+        message, or None if all experiments were run
+    
+    '''
+    global experiment_runner, shared_buffers
+    start = time.time()
+    nr_model_inits = experiment_runner.nr_model_inits
+    
+    # keep only the most recent buffers open
+    buffers = shared_buffers
+    if buffers is None or buffers.directory != directory:
+        buffers = shared_buffers = SharedBuffers.load(directory)
+    
+    experiment_ids = indices + offset
+    experiments = make_experiments(buffers.designs, model_name, policy, 
+                                   indices, experiment_ids)
+    results, error = run_chunk(experiments)
+    if results:
+        buffers.store(experiment_ids[0:len(results)], results)
+    return (time.time()-start, 
+            experiment_runner.nr_model_inits-nr_model_inits, len(results),
+            error)
+
+
+def make_experiments(designs, model_name, policy, indices, experiment_ids):
+    '''the experiments for the scenarios in designs with the given 
+    indices'''
+    return [Experiment('{} {} {}'.format(model_name, policy.name, 
+                                         experiment_id), 
+                       model_name, policy, scenario, experiment_id) for
+            scenario, experiment_id in zip(designs.take(indices), 
+                                           experiment_ids)]
 
 
 class SubProcessLogHandler(logging.Handler):
@@ -254,7 +542,7 @@ class LogQueueReader(threading.Thread):
                 traceback.print_exc(file=sys.stderr)
 
 
-def result_handler(callback, experiment):
+def result_handler(callback, experiment, statistics=None):
     '''handler for the results
     
     to link experiment and output, we use a functional programming
@@ -262,24 +550,411 @@ def result_handler(callback, experiment):
     
     '''
     
-    def my_actual_callback(result):
+    def my_actual_callback(value):
+        result, nr_model_inits = value
+        if statistics is not None:
+            statistics.update(1, nr_model_inits)
         callback(experiment, result)
     return my_actual_callback
 
 
-def add_tasks(pool, experiments, callback):
+def add_tasks(pool, experiments, callback, max_pending=None, 
+              statistics=None):
     '''add experiments to pool
     
+    Parameters
+    ----------
+    pool : multiprocessing.Pool instance
+    experiments : iterable of Experiment instances
+    callback : AbstractCallback instance
+    max_pending : int, optional
+                  if provided, the maximum number of experiments that are 
+                  queued at the same time. This bounds memory use because
+                  experiments are only consumed once a slot is available.
+    statistics : RunStatistics instance, optional
+    
     '''
     
-    results = []
+    if max_pending is None:
+        results = []
+        for e in experiments:
+            
+            # TODO:: code won't work on Python 3.4 or lower
+            # error_callback only exists in 3.5 and up
+            res = pool.apply_async(worker, [e], 
+                                   callback=result_handler(callback, e, 
+                                                           statistics))
+            results.append(res)
+    
+        for res in results:
+            res.wait()
+        return
+    
+    semaphore = threading.BoundedSemaphore(max_pending)
     for e in experiments:
+        semaphore.acquire()
+        pool.apply_async(worker, [e], 
+                         callback=bounded_result_handler(callback, e, 
+                                                    semaphore, statistics),
+                         error_callback=error_handler(semaphore))
+    wait_for_pending(semaphore, max_pending)
+
+
+def bounded_result_handler(callback, experiment, semaphore, 
+                           statistics=None):
+    '''handler for the results of an experiment submitted with a bounded
+    number of pending experiments'''
+    
+    def my_actual_callback(value):
+        try:
+            result, nr_model_inits = value
+            if statistics is not None:
+                statistics.update(1, nr_model_inits)
+            callback(experiment, result)
+        finally:
+            semaphore.release()
+    return my_actual_callback
+
+
+def wait_for_pending(semaphore, max_pending):
+    '''block until all slots of the semaphore are free again, i.e. until 
+    all pending tasks have been handled'''
+    for _ in range(max_pending):
+        semaphore.acquire()
+    for _ in range(max_pending):
+        semaphore.release()
+
+
+class ChunkSizer(object):
+    '''helper class for determining the number of experiments per chunk
+    
+    If chunksize is AUTO, the chunksize is tuned based on the measured run 
+    time per experiment, such that each chunk takes approximately 
+    target_duration seconds. Until the first chunk has returned, chunks of a
+    single experiment are used. 
+    
+    Parameters
+    ----------
+    chunksize : int or AUTO
+    target_duration : float, optional
+                      desired wall clock time in seconds for running a 
+                      single chunk
+    max_chunksize : int, optional
+    
+    '''
+    
+    def __init__(self, chunksize=AUTO, target_duration=0.5, 
+                 max_chunksize=1000):
+        self.auto = chunksize == AUTO
         
-        # TODO:: code won't work on Python 3.4 or lower
-        # error_callback only exists in 3.5 and up
-        res = pool.apply_async(worker, [e], 
-                                     callback=result_handler(callback, e))
-        results.append(res)
-
-    for res in results:
-        res.wait()
\ No newline at end of file
+        if self.auto:
+            chunksize = 1
+        elif int(chunksize) < 1:
+            raise ValueError('chunksize should be larger than 0')
+        
+        self.chunksize = int(chunksize)
+        self.target_duration = target_duration
+        self.max_chunksize = max_chunksize
+        self.latency = None
+    
+    def update(self, nr_experiments, duration):
+        '''update the chunksize given the time it took to run a chunk
+        
+        Parameters
+        ----------
+        nr_experiments : int
+                         the number of experiments in the chunk
+        duration : float
+                   wall clock time for running the chunk
+        
+        '''
+        if not nr_experiments:
+            # e.g. the first experiment of a chunk failed
+            return
+        
+        latency = duration / nr_experiments
+        
+        if self.latency is None:
+            self.latency = latency
+        else:
+            # exponential smoothing to dampen the effect of outliers
+            self.latency = 0.8 * self.latency + 0.2 * latency
+        
+        if not self.auto:
+            return
+        
+        if self.latency > 0:
+            chunksize = int(self.target_duration / self.latency)
+        else:
+            chunksize = self.max_chunksize
+        self.chunksize = min(max(1, chunksize), self.max_chunksize)
+
+
+def chunk_result_handler(callback, chunk, sizer, semaphore, 
+                         statistics=None, failures=None):
+    '''handler for the results of a chunk of experiments
+    
+    the results for the chunk are passed to the callback as a single batch, 
+    after which the slot for the chunk is released. If an experiment 
+    failed, the results of the experiments before it are passed to the 
+    callback, and the failure is added to failures.
+    
+    '''
+    
+    def my_actual_callback(value):
+        results, duration, nr_model_inits, error = value
+        try:
+            sizer.update(len(results), duration)
+            if statistics is not None:
+                statistics.update(len(results), nr_model_inits, duration)
+            callback.store_batch(list(zip(chunk, results)))
+            if error is not None:
+                chunk_failed(failures, *error)
+        finally:
+            semaphore.release()
+    return my_actual_callback
+
+
+def chunk_failed(failures, experiment_id, message):
+    '''log and register the failure of an experiment in a chunk'''
+    message = 'experiment {} failed: {}'.format(experiment_id, message)
+    ema_logging.error(message)
+    if failures is not None:
+        failures.append(message)
+
+
+def error_handler(semaphore, failures=None, experiments=None):
+    '''handler for a task that raised an exception in the worker
+    
+    If failures is provided, a message identifying the experiments is 
+    added to it, otherwise the failure is only logged.
+    
+    '''
+    
+    def my_actual_callback(exception):
+        if failures is None:
+            ema_logging.warning("task failed: {}".format(exception))
+        else:
+            ids = [e.experiment_id for e in experiments]
+            message = 'chunk of experiments {} to {} failed: {}: {}'.format(
+                                    ids[0], ids[-1], 
+                                    type(exception).__name__, exception)
+            ema_logging.error(message)
+            failures.append(message)
+        semaphore.release()
+    return my_actual_callback
+
+
+def raise_failures(failures):
+    '''raise an EMAError if any chunk has failed'''
+    if failures:
+        raise EMAError(('{} chunk(s) of experiments failed, the first '
+                        'failure: {}').format(len(failures), failures[0]))
+
+
+def add_tasks_chunked(pool, experiments, callback, n_processes, 
+                      chunksize=AUTO, statistics=None):
+    '''add experiments to pool in chunks
+    
+    Each chunk is executed by a single worker in one pass of the 
+    ExperimentRunner, and the results of the chunk are returned to the
+    callback as a single batch. The number of chunks that are queued at
+    the same time is bounded to twice the number of processes, so the 
+    experiments are consumed lazily.
+    
+    Parameters
+    ----------
+    pool : multiprocessing.Pool instance
+    experiments : iterable of Experiment instances
+    callback : AbstractCallback instance
+    n_processes : int
+    chunksize : int or AUTO, optional
+    statistics : RunStatistics instance, optional
+    
+    '''
+    sizer = ChunkSizer(chunksize)
+    submit_chunks(pool, chunk_generator(experiments, sizer), callback, 
+                  sizer, n_processes, statistics)
+
+
+def chunk_generator(experiments, sizer):
+    '''generator yielding consecutive chunks of experiments, of the size 
+    given by sizer'''
+    experiments = iter(experiments)
+    while True:
+        chunk = list(itertools.islice(experiments, sizer.chunksize))
+        if not chunk:
+            return
+        yield chunk
+
+
+def submit_chunks(pool, chunks, callback, sizer, n_processes, 
+                  statistics=None):
+    '''submit the chunks to pool, with at most twice the number of 
+    processes chunks queued at the same time'''
+    max_pending = 2 * n_processes
+    semaphore = threading.BoundedSemaphore(max_pending)
+    failures = []
+    
+    for chunk in chunks:
+        semaphore.acquire()
+        if failures:
+            # stop submitting, the results of pending chunks are still 
+            # stored
+            semaphore.release()
+            break
+        
+        pool.apply_async(chunk_worker, [chunk], 
+                         callback=chunk_result_handler(callback, chunk, 
+                                    sizer, semaphore, statistics, failures),
+                         error_callback=error_handler(semaphore, failures, 
+                                                      chunk))
+    
+    wait_for_pending(semaphore, max_pending)
+    raise_failures(failures)
+
+
+def affinity_chunksize(nr_experiments, n_processes, chunks_per_process=4):
+    '''the chunksize for splitting nr_experiments into chunks_per_process 
+    chunks for each process'''
+    return max(1, int(math.ceil(nr_experiments / 
+                                (n_processes*chunks_per_process))))
+
+
+def add_tasks_affinity(pool, experiments, nr_experiments, callback, 
+                       n_processes, chunks_per_process=4, statistics=None):
+    '''add experiments to pool in a few large chunks, to minimize the 
+    number of calls to model_init
+    
+    A model is initialized whenever it gets an experiment for a different 
+    policy than the previous one. The experiments are ordered by model and 
+    policy, so a chunk of consecutive experiments requires at most one 
+    call to model_init for each (model, policy) combination in it. 
+    Splitting the experiments into chunks_per_process chunks for each 
+    process thus bounds the total number of calls to the number of chunks
+    plus the number of (model, policy) combinations, irrespective of which
+    process gets which chunk. With small chunks, in contrast, each process
+    can end up initializing each (model, policy) combination. More chunks 
+    per process give a better balance of the load over the processes.
+    
+    Parameters
+    ----------
+    pool : multiprocessing.Pool instance
+    experiments : iterable of Experiment instances
+                  ordered by model and policy, as generated by 
+                  :func:`~parameters.experiment_generator`
+    nr_experiments : int
+    callback : AbstractCallback instance
+    n_processes : int
+    chunks_per_process : int, optional
+    statistics : RunStatistics instance, optional
+    
+    '''
+    sizer = ChunkSizer(affinity_chunksize(nr_experiments, n_processes, 
+                                          chunks_per_process))
+    submit_chunks(pool, chunk_generator(experiments, sizer), callback, 
+                  sizer, n_processes, statistics)
+
+
+def shared_result_handler(callback, buffers, experiments, sizer, semaphore,
+                          statistics=None, failures=None):
+    '''handler for the results of a chunk of experiments run using shared 
+    buffers, see :func:`chunk_result_handler`'''
+    
+    def my_actual_callback(value):
+        duration, nr_model_inits, nr_completed, error = value
+        try:
+            completed = experiments[0:nr_completed]
+            sizer.update(nr_completed, duration)
+            if statistics is not None:
+                statistics.update(nr_completed, nr_model_inits, duration)
+            if completed:
+                experiment_ids = [e.experiment_id for e in completed]
+                results = buffers.get(experiment_ids)
+                callback.store_batch(list(zip(completed, results)))
+            if error is not None:
+                chunk_failed(failures, *error)
+        finally:
+            semaphore.release()
+    return my_actual_callback
+
+
+def add_tasks_shared(pool, buffers, models, policies, callback, n_processes, 
+                     chunksize=AUTO, skip=None, statistics=None):
+    '''add experiments to pool, using shared buffers for the scenarios 
+    and results
+    
+    The experiments are the same, and have the same experiment ids, as
+    those from :func:`~parameters.experiment_generator`. The first 
+    experiment is run on its own, to determine the shape of the result 
+    arrays.
+    
+    Parameters
+    ----------
+    pool : multiprocessing.Pool instance
+    buffers : SharedBuffers instance
+    models : list of AbstractModel instances
+    policies : iterable of Policy instances
+    callback : AbstractCallback instance
+    n_processes : int
+    chunksize : int or AUTO, optional
+    skip : collection of ints, optional
+           experiment_ids of experiments that should not be run
+    statistics : RunStatistics instance, optional
+    
+    '''
+    designs = buffers.designs
+    n = designs.n
+    policies = list(policies)
+    skip = np.fromiter(skip, dtype=np.intp) if skip else None
+    
+    sizer = ChunkSizer(chunksize)
+    max_pending = 2 * n_processes
+    semaphore = threading.BoundedSemaphore(max_pending)
+    failures = []
+    
+    offset = 0
+    for model in models:
+        for policy in policies:
+            indices = np.arange(n)
+            if skip is not None:
+                indices = indices[~np.isin(indices+offset, skip)]
+            
+            while indices.shape[0] and not failures:
+                if not buffers.outcomes:
+                    # run the first experiment to allocate the results
+                    experiments = make_experiments(designs, model.name, 
+                                        policy, indices[0:1], 
+                                        indices[0:1]+offset)
+                    results, duration, nr_model_inits, error = pool.apply(
+                                            chunk_worker, [experiments])
+                    if error is not None:
+                        chunk_failed(failures, *error)
+                        raise_failures(failures)
+                    sizer.update(1, duration)
+                    if statistics is not None:
+                        statistics.update(1, nr_model_inits, duration)
+                    buffers.allocate(n*len(policies)*len(models), results[0])
+                    callback.store_batch(list(zip(experiments, results)))
+                    indices = indices[1::]
+                    continue
+                
+                chunk = indices[0:sizer.chunksize]
+                indices = indices[sizer.chunksize::]
+                
+                experiments = make_experiments(designs, model.name, 
+                                               policy, chunk, chunk+offset)
+                semaphore.acquire()
+                pool.apply_async(shared_chunk_worker, 
+                                 [buffers.directory, model.name, policy, 
+                                  chunk, offset], 
+                                 callback=shared_result_handler(callback, 
+                                            buffers, experiments, sizer, 
+                                            semaphore, statistics, 
+                                            failures),
+                                 error_callback=error_handler(semaphore, 
+                                            failures, experiments))
+            offset += n
+    
+    wait_for_pending(semaphore, max_pending)
+    raise_failures(failures)
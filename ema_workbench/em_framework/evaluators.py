@@ -5,24 +5,32 @@
 from __future__ import (unicode_literals, print_function, absolute_import,
                                         division)
 
+import inspect
+import itertools
 import multiprocessing
 import numbers 
 import os
 import random
 import string
 import threading
+import time
 
+from .cache import serve_from_cache
 from .callbacks import DefaultCallback
-from .ema_multiprocessing import LogQueueReader, initializer, add_tasks
+from .ema_multiprocessing import (LogQueueReader, initializer, add_tasks,
+                                  add_tasks_chunked, add_tasks_shared, 
+                                  add_tasks_affinity, affinity_chunksize,
+                                  SharedBuffers, AUTO)
 from .ema_ipyparallel import (start_logwatcher, set_engine_logger, 
-                              initialize_engines, cleanup, _run_experiment)
-from .experiment_runner import ExperimentRunner
-from .model import AbstractModel
+                              initialize_engines, cleanup, _run_experiment,
+                              _run_experiments)
+from .experiment_runner import ExperimentRunner, RunStatistics
+from .model import AbstractModel, VectorizedModel
 from .outcomes import AbstractOutcome
 from .parameters import experiment_generator, Scenario, Policy
 from .samplers import (MonteCarloSampler, FullFactorialSampler, LHSSampler, 
                        PartialFactorialSampler, sample_levers, 
-                       sample_uncertainties)
+                       sample_uncertainties, DesignMatrix)
 from .salib_samplers import (SobolSampler, MorrisSampler, FASTSampler) # TODO:: should become optional import
 from .util import NamedObjectMap, determine_objects
 from ..util import ema_logging, EMAError
@@ -52,6 +60,42 @@ SAMPLERS = {LHS:LHSSampler,
 
 __all__ = ['MultiprocessingEvaluator', 'IpyparallelEvaluator']
 
+def block_size(msis):
+    '''returns the number of experiments to dispatch at once to the models,
+    or None if none of the models is vectorized'''
+    sizes = [msi.block_size for msi in msis if 
+             isinstance(msi, VectorizedModel)]
+    if sizes:
+        return max(sizes)
+    return None
+
+
+def count_experiments(scenarios, msis, policies, skip=None):
+    '''the number of experiments that is to be run'''
+    return (len(scenarios) * len(msis) * len(policies) - 
+            len(skip or []))
+
+
+def _accepts_resume(callback):
+    '''returns True if the callback class, or factory, has a resume
+    argument'''
+    try:
+        parameters = inspect.signature(callback).parameters
+    except (TypeError, ValueError):
+        return False
+    return 'resume' in parameters
+
+
+def blocks(experiments, size):
+    '''generator yielding lists of at most size experiments'''
+    experiments = iter(experiments)
+    while True:
+        block = list(itertools.islice(experiments, size))
+        if not block:
+            return
+        yield block
+
+
 class BaseEvaluator(object):
     '''evaluator for experiments using a multiprocessing pool
     
@@ -64,6 +108,18 @@ class BaseEvaluator(object):
             to be used in combination with platypus, indicates whether
             you want to optimize over the union or the intersection of
             search_over
+    cache : ExperimentCache instance, optional
+            if provided, experiments whose results are in the cache are 
+            not run, but their results are taken from the cache, and the 
+            results of the experiments that are run are added to the 
+            cache. 
+    
+    Attributes
+    ----------
+    statistics : RunStatistics instance
+                 statistics on the experiments of the most recent call to
+                 evaluate_experiments, including the number of calls to 
+                 model_init
     
     Raises
     ------
@@ -71,13 +127,15 @@ class BaseEvaluator(object):
     
     '''
     
-    def __init__(self, msis, searchover=None, union=None):
+    def __init__(self, msis, searchover=None, union=None, cache=None):
         super(BaseEvaluator, self).__init__()
         
         if isinstance(msis, AbstractModel):
             msis = [msis]
         
         self._msis = msis
+        self.cache = cache
+        self.statistics = None
         
         if searchover:
             if searchover not in {'levers', 'uncertainties'}:
@@ -118,7 +176,7 @@ class BaseEvaluator(object):
         
         raise NotImplementedError
         
-    def evaluate_experiments(self, scenarios, policies, callback):
+    def evaluate_experiments(self, scenarios, policies, callback, skip=None):
         '''used by ema_workbench'''
         raise NotImplementedError
 
@@ -164,7 +222,8 @@ class BaseEvaluator(object):
     def perform_experiments(self, scenarios=0, policies=0, evaluator=None, 
                         reporting_interval=None, uncertainty_union=False, 
                         lever_union=False, outcome_union=False, 
-                        uncertainty_sampling=LHS, levers_sampling=LHS):
+                        uncertainty_sampling=LHS, levers_sampling=LHS,
+                        callback=None, resume=False):
         '''convenience method for performing experiments.
         
         is forwarded to :func:perform_experiments, with evaluator and models
@@ -178,7 +237,8 @@ class BaseEvaluator(object):
                     uncertainty_union=uncertainty_union, lever_union=lever_union, 
                     outcome_union=outcome_union, 
                     uncertainty_sampling=uncertainty_sampling, 
-                    levers_sampling=levers_sampling)
+                    levers_sampling=levers_sampling, callback=callback,
+                    resume=resume)
 
 
 class SequentialEvaluator(BaseEvaluator):
@@ -191,19 +251,37 @@ class SequentialEvaluator(BaseEvaluator):
     def finalize(self):
         pass
     
-    def evaluate_experiments(self, scenarios, policies, callback):
+    def evaluate_experiments(self, scenarios, policies, callback, skip=None):
         ema_logging.info("performing experiments sequentially")
         
-        ex_gen = experiment_generator(scenarios, self._msis, policies)
+        ex_gen = experiment_generator(scenarios, self._msis, policies, 
+                                      skip=skip)
         
         models = NamedObjectMap(AbstractModel)
         models.extend(self._msis)
         
         cwd = os.getcwd() 
         runner = ExperimentRunner(models)
-        for experiment in ex_gen:
-            result = runner.run_experiment(experiment)
-            callback(experiment, result)
+        
+        self.statistics = RunStatistics()
+        start = time.time()
+        nr_experiments = 0
+        
+        size = block_size(self._msis)
+        if size:
+            for block in blocks(ex_gen, size):
+                results = runner.run_experiments(block)
+                callback.store_batch(list(zip(block, results)))
+                nr_experiments += len(block)
+        else:
+            for experiment in ex_gen:
+                result = runner.run_experiment(experiment)
+                callback(experiment, result)
+                nr_experiments += 1
+        
+        self.statistics.update(nr_experiments, runner.nr_model_inits, 
+                               time.time()-start)
+        ema_logging.info(str(self.statistics))
         runner.cleanup()
         os.chdir(cwd)
     
@@ -215,15 +293,45 @@ class MultiprocessingEvaluator(BaseEvaluator):
     ----------
     msis : collection of models
     n_processes : int (optional)
-    
+    chunksize : {None, int, 'auto'}, optional
+                if None, each experiment is submitted to the pool 
+                separately. Otherwise, experiments are submitted in chunks
+                of chunksize experiments, and the results of a chunk are 
+                passed to the callback as a single batch. If 'auto', the 
+                chunksize is tuned based on the measured run time per 
+                experiment.
+    shared_buffers : bool, optional
+                     if True, and the scenarios are a DesignMatrix, the 
+                     scenarios are shared with the workers through memory 
+                     mapped files, and the workers write their results 
+                     directly into shared result arrays, so only the 
+                     indices of the scenarios are sent to the workers. 
+                     This requires outcomes with the same shape for all
+                     experiments. Experiments are always submitted in 
+                     chunks in this case.
+    policy_affinity : bool, optional
+                      if True, the experiments are submitted in a few 
+                      large chunks for each process, such that each 
+                      process runs contiguous runs of experiments for the
+                      same model and policy, which minimizes the number of
+                      calls to model_init. chunksize is ignored in this 
+                      case. Not used in combination with shared_buffers.
     
     '''
     
-    def __init__(self, msis, n_processes=None, **kwargs):
+    # the number of experiments per process that is queued at any one time
+    max_pending_per_process = 10
+    
+    def __init__(self, msis, n_processes=None, chunksize=None, 
+                 shared_buffers=False, policy_affinity=False, **kwargs):
         super(MultiprocessingEvaluator, self).__init__(msis, **kwargs)
         
         self._pool = None
         self.n_processes = n_processes
+        self.chunksize = chunksize
+        self.shared_buffers = shared_buffers
+        self.policy_affinity = policy_affinity
+        self._nr_buffers = 0
 
     def initialize(self):
         log_queue = multiprocessing.Queue()
@@ -266,19 +374,78 @@ class MultiprocessingEvaluator(BaseEvaluator):
         
         shutil.rmtree(self.root_dir)
         
-    def evaluate_experiments(self, scenarios, policies, callback):
-        ex_gen = experiment_generator(scenarios, self._msis, policies)
-        
-        add_tasks(self._pool, ex_gen, callback)
+    def evaluate_experiments(self, scenarios, policies, callback, skip=None):
+        self.statistics = RunStatistics()
+        self._evaluate_experiments(scenarios, policies, callback, skip)
+        ema_logging.info(str(self.statistics))
+    
+    def _evaluate_experiments(self, scenarios, policies, callback, skip):
+        n_processes = self.n_processes
+        if n_processes is None:
+            n_processes = multiprocessing.cpu_count()
+        
+        if self.shared_buffers:
+            if isinstance(scenarios, DesignMatrix):
+                self._nr_buffers += 1
+                directory = os.path.join(self.root_dir, 
+                                    'buffers{}'.format(self._nr_buffers))
+                buffers = SharedBuffers(directory, scenarios)
+                add_tasks_shared(self._pool, buffers, self._msis, policies,
+                                 callback, n_processes, 
+                                 chunksize=self.chunksize or AUTO, skip=skip,
+                                 statistics=self.statistics)
+                return
+            ema_logging.warning(('shared buffers require a DesignMatrix of '
+                                 'scenarios, submitting the experiments '
+                                 'instead'))
+        
+        ex_gen = experiment_generator(scenarios, self._msis, policies, 
+                                      skip=skip)
+        
+        if self.policy_affinity:
+            nr_experiments = count_experiments(scenarios, self._msis, 
+                                               policies, skip)
+            add_tasks_affinity(self._pool, ex_gen, nr_experiments, callback,
+                               n_processes, statistics=self.statistics)
+            return
+        
+        chunksize = self.chunksize
+        if not chunksize and block_size(self._msis):
+            # vectorized models benefit from receiving chunks of experiments
+            chunksize = AUTO
+        
+        if chunksize:
+            add_tasks_chunked(self._pool, ex_gen, callback, n_processes, 
+                              chunksize=chunksize, 
+                              statistics=self.statistics)
+        else:
+            add_tasks(self._pool, ex_gen, callback, 
+                      max_pending=self.max_pending_per_process*n_processes,
+                      statistics=self.statistics)
 
 
 class IpyparallelEvaluator(BaseEvaluator):
-    '''evaluator for using an ipypparallel pool'''
+    '''evaluator for using an ipypparallel pool
+    
+    Parameters
+    ----------
+    msis : collection of models
+    client : ipyparallel.Client instance
+    policy_affinity : bool, optional
+                      if True, the experiments are mapped over the engines
+                      in a few large chunks for each engine, such that each
+                      engine runs contiguous runs of experiments for the 
+                      same model and policy, which minimizes the number of
+                      calls to model_init.
+    kwargs : see BaseEvaluator
+    
+    '''
     
 
-    def __init__(self,  msis, client, **kwargs):
+    def __init__(self,  msis, client, policy_affinity=False, **kwargs):
         super(IpyparallelEvaluator, self).__init__(msis, **kwargs)
         self.client = client
+        self.policy_affinity = policy_affinity
         
     def initialize(self):
         import ipyparallel
@@ -311,23 +478,44 @@ class IpyparallelEvaluator(BaseEvaluator):
         cleanup(self.client)
         
         
-    def evaluate_experiments(self, scenarios, policies, callback):
-        ex_gen = experiment_generator(scenarios, self._msis, policies)
+    def evaluate_experiments(self, scenarios, policies, callback, skip=None):
+        ex_gen = experiment_generator(scenarios, self._msis, policies, 
+                                      skip=skip)
         
         lb_view = self.client.load_balanced_view()
         
-        results = lb_view.map(_run_experiment, 
-                              ex_gen, ordered=False, block=False)
-
-        for entry in results:
-            callback(*entry)
+        self.statistics = RunStatistics()
+        
+        size = block_size(self._msis)
+        if self.policy_affinity:
+            # see add_tasks_affinity
+            nr_experiments = count_experiments(scenarios, self._msis, 
+                                               policies, skip)
+            size = affinity_chunksize(nr_experiments, len(self.client.ids))
+        
+        if size:
+            results = lb_view.map(_run_experiments, blocks(ex_gen, size), 
+                                  ordered=False, block=False)
+            for entry, nr_model_inits, run_time in results:
+                self.statistics.update(len(entry), nr_model_inits, run_time)
+                callback.store_batch(entry)
+        else:
+            results = lb_view.map(_run_experiment, 
+                                  ex_gen, ordered=False, block=False)
+    
+            for experiment, result, nr_model_inits, run_time in results:
+                self.statistics.update(1, nr_model_inits, run_time)
+                callback(experiment, result)
+        
+        ema_logging.info(str(self.statistics))
         
 
 
 def perform_experiments(models, scenarios=0, policies=0, evaluator=None, 
                         reporting_interval=None, uncertainty_union=False, 
                         lever_union=False, outcome_union=False, 
-                        uncertainty_sampling=LHS, levers_sampling=LHS):
+                        uncertainty_sampling=LHS, levers_sampling=LHS,
+                        callback=None, resume=False):
     '''sample uncertainties and levers, and perform the resulting experiments
     on each of the models
     
@@ -342,7 +530,25 @@ def perform_experiments(models, scenarios=0, policies=0, evaluator=None,
     lever_union : boolean, optional
     uncertainty_sampling : {LHS, MC, FF, PFF, SOBOL, MORRIS, FAST}, optional
     lever_sampling : {LHS, MC, FF, PFF, SOBOL, MORRIS, FAST}, optional
+    callback : callable, optional
+               callable returning an AbstractCallback instance, given the
+               uncertainties, levers, outcomes, number of experiments, and
+               reporting_interval. Defaults to DefaultCallback. Use e.g.
+               functools.partial(StreamingCallback, sink=NpzSink(path)) for
+               writing the results to disk in chunks rather than keeping 
+               them in memory. 
+    resume : bool, optional
+             if True, experiments already completed according to the 
+             callback are skipped. This requires a callback with a 
+             resume argument and a completed_experiments method, such as 
+             PersistentCallback, and the same experiments as the interrupted run, so either 
+             pass the scenarios and policies explicitly, or seed the 
+             random number generator prior to sampling. 
     
+    Returns
+    -------
+    the return of the get_results method of the callback, by default a
+    tuple with the experiments and the outcomes
     
     '''
     if not scenarios and not policies:
@@ -401,16 +607,52 @@ def perform_experiments(models, scenarios=0, policies=0, evaluator=None,
     
     ema_logging.info("performing {} scenarios * {} policies * {} model(s) = {} experiments".format(n_scenarios, n_policies, n_models, nr_of_exp))
     
-    callback = DefaultCallback(uncertainties,
-                               levers,
-                               outcomes,
-                               nr_of_exp,
-                               reporting_interval=reporting_interval)
+    if callback is None:
+        callback = DefaultCallback
+    
+    kwargs = {'reporting_interval':reporting_interval}
+    if resume:
+        if not _accepts_resume(callback):
+            raise EMAError(('resume requires a callback which accepts a '
+                            'resume argument and implements '
+                            'completed_experiments, such as '
+                            'PersistentCallback'))
+        kwargs['resume'] = True
+    
+    callback = callback(uncertainties,
+                        levers,
+                        outcomes,
+                        nr_of_exp,
+                        **kwargs)
+    
+    skip = None
+    if resume:
+        try:
+            skip = callback.completed_experiments()
+        except AttributeError:
+            raise EMAError(('resume requires a callback which implements '
+                            'completed_experiments, not {}').format(
+                                                        type(callback)))
+        callback.i = len(skip)
+        ema_logging.info(("resuming, {} of {} experiments already "
+                          "completed").format(len(skip), nr_of_exp))
     
     if not evaluator:
         evaluator = SequentialEvaluator(models)
     
-    evaluator.evaluate_experiments(scenarios, policies, callback)
+    cache = evaluator.cache
+    if cache is not None:
+        cache.reset_counters()
+        skip, caching_callback = serve_from_cache(cache, evaluator._msis, 
+                                        scenarios, policies, callback, skip)
+        ema_logging.info(("{} experiments served from the cache, {} not in "
+                          "the cache").format(cache.hits, cache.misses))
+        evaluator.evaluate_experiments(scenarios, policies, caching_callback, 
+                                       skip=skip)
+        cache.flush()
+    else:
+        evaluator.evaluate_experiments(scenarios, policies, callback, 
+                                       skip=skip)
     
     if callback.i != nr_of_exp:
         raise EMAError(('some fatal error has occurred while '
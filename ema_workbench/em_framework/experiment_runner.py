@@ -5,16 +5,50 @@ has been initialized with which policy.
 from __future__ import (absolute_import, print_function, division,
                         unicode_literals)
 
+import itertools
 import sys
 import traceback
 
 from ..util import ema_logging, EMAError, CaseError
+from .model import VectorizedModel
 
 # Created on Aug 11, 2015
 # 
 # .. codeauthor:: jhkwakkel <j.h.kwakkel (at) tudelft (dot) nl>
 
-__all__ = ["ExperimentRunner"]
+__all__ = ["ExperimentRunner",
+           "RunStatistics"]
+
+
+class RunStatistics(object):
+    '''statistics on the experiments run by an evaluator
+    
+    Attributes
+    ----------
+    nr_experiments : int
+    nr_model_inits : int
+                     the number of calls to model_init
+    run_time : float
+               the summed wall clock time of running the experiments
+    
+    '''
+    
+    def __init__(self):
+        self.nr_experiments = 0
+        self.nr_model_inits = 0
+        self.run_time = 0
+    
+    def update(self, nr_experiments, nr_model_inits, run_time=0):
+        '''add the statistics of a number of experiments'''
+        self.nr_experiments += nr_experiments
+        self.nr_model_inits += nr_model_inits
+        self.run_time += run_time
+    
+    def __str__(self):
+        return ('{} experiments, {} calls to model_init, {:.3g} seconds '
+                'run time').format(self.nr_experiments, self.nr_model_inits,
+                                   self.run_time)
+
 
 class ExperimentRunner(object):
     '''Helper class for running the experiments
@@ -32,6 +66,9 @@ class ExperimentRunner(object):
     msi_initializiation : dict
                           keeps track of which model is initialized with
                           which policy. 
+    nr_model_inits : int
+                     the number of experiments for which the model had to
+                     be initialized with a new policy
     msis : dict
            models indexed by name
     model_kwargs : dict
@@ -41,6 +78,7 @@ class ExperimentRunner(object):
     
     def __init__ (self, msis):
         self.msis = msis
+        self.nr_model_inits = 0
         self.log_message = ('running scenario {scenario_id} for policy '
                             '{policy_name} on model {model_name}')
     
@@ -85,6 +123,9 @@ class ExperimentRunner(object):
                                                   policy_name=policy_name,
                                                   model_name = model_name))
         scenario = experiment.scenario.copy()
+        if not model.initialized(policy):
+            self.nr_model_inits += 1
+        
         try:
             model.run_model(scenario, policy)
         except CaseError as e:
@@ -106,4 +147,68 @@ class ExperimentRunner(object):
         output = model.output
         model.reset_model()
         
-        return output      
\ No newline at end of file
+        return output      
+
+    def run_experiments(self, experiments, results=None):
+        '''run a block of experiments. Consecutive experiments for the same
+        model and policy are evaluated in a single call if the model is a
+        VectorizedModel.
+        
+        Parameters
+        ----------
+        experiments : collection of Experiment instances
+        results : list, optional
+                  list to which the results are appended. If an experiment
+                  raises an exception, it contains the results of the 
+                  experiments before it.
+        
+        Returns
+        -------
+        list
+            the result dict for each experiment, in the same order as 
+            experiments
+        
+        '''
+        if results is None:
+            results = []
+        
+        key = lambda experiment: (experiment.model_name, 
+                                  experiment.policy.name)
+        for (model_name, _), group in itertools.groupby(experiments, key):
+            group = list(group)
+            model = self.msis[model_name]
+            
+            if isinstance(model, VectorizedModel):
+                results.extend(self._run_block(model, group))
+            else:
+                results.extend(self.run_experiment(experiment) for 
+                               experiment in group)
+        return results
+    
+    def _run_block(self, model, experiments):
+        '''helper method for running a block of experiments with the same
+        policy on a vectorized model'''
+        policy = experiments[0].policy.copy()
+        scenarios = [experiment.scenario.copy() for experiment in experiments]
+        if not model.initialized(policy):
+            self.nr_model_inits += 1
+        
+        ema_logging.debug(('running {} scenarios for policy {} on model '
+                           '{}').format(len(experiments), policy.name, 
+                                        model.name))
+        try:
+            return model.run_block(scenarios, policy)
+        except CaseError as e:
+            # rerun the experiments one by one, so only the experiments 
+            # raising the CaseError lack results
+            ema_logging.warning(str(e))
+            return [self.run_experiment(experiment) for experiment in 
+                    experiments]
+        except Exception as e:
+            try:
+                self.cleanup()
+            except Exception:
+                raise e
+            
+            raise EMAError(("exception in run_block"
+                   "\nCaused by: {}: {}".format(type(e).__name__, str(e))))
@@ -13,6 +13,9 @@ import operator
 import os
 import six
 import warnings
+
+import numpy as np
+
 from ema_workbench.util import ema_logging
 from ema_workbench.em_framework.parameters import CategoricalParameter
 import collections
@@ -38,7 +41,7 @@ from ..util.ema_logging import method_logger
 # 
 
 __all__ = ['AbstractModel', 'Model', 'FileModel', 'Replicator', 
-           'SingleReplication']
+           'SingleReplication', 'VectorizedModel']
 
 #==============================================================================
 # abstract Model class 
@@ -75,9 +78,15 @@ class AbstractModel(six.with_metaclass(ModelMeta, NamedObject)):
            alphanumerical name of model structure interface
     output : dict
              this should be a dict with the names of the outcomes as key
+    version : str, optional
+              tag identifying the version of the model, which is part of
+              the key of the experiments in an 
+              :class:`~cache.ExperimentCache`
     
     '''
     
+    version = None
+    
     @property
     def output(self):
         return self._output
@@ -486,4 +495,123 @@ class FileModel(AbstractModel):
         return model_specs
 
 class Model(SingleReplication, BaseModel):
-    pass
\ No newline at end of file
+    pass
+
+
+class VectorizedModel(SingleReplication, BaseModel):
+    '''
+    class for working with models implemented as a vectorized Python 
+    callable. The function is called once for a block of experiments with
+    the same policy. Each uncertainty is passed as a numpy array with a 
+    value for each experiment in the block, while levers and constants are 
+    passed as scalars. The function should return for each outcome an 
+    array with the experiments as first dimension.
+    
+    Parameters
+    ----------
+    name : str
+    function : callable
+               a function with each of the uncertain parameters as a keyword
+               argument
+    
+    Attributes
+    ----------
+    block_size : int
+                 the maximum number of experiments evaluated in a single 
+                 call of function by the evaluators
+    
+    '''
+    
+    block_size = 1000
+    
+    def _transform_block(self, scenarios):
+        '''helper method for turning a list of scenarios into a dict with 
+        an array for each variable'''
+        
+        if not self.uncertainties:
+            # no uncertainties defined, so nothing to transform, mainly
+            # useful for manual specification of scenarios without 
+            # having to define uncertainties
+            return {key:np.asarray([scenario[key] for scenario in 
+                                    scenarios]) for key in scenarios[0]}
+        
+        columns = {}
+        for par in self.uncertainties:
+            values = []
+            for scenario in scenarios:
+                try:
+                    value = scenario[par.name]
+                except KeyError:
+                    if par.default is None:
+                        break
+                    value = par.default
+                values.append(value)
+            else:
+                multivalue = isinstance(par, CategoricalParameter) and\
+                             par.multivalue
+                for i, varname in enumerate(par.variable_name):
+                    if multivalue:
+                        columns[varname] = np.asarray([v[i] for v in values])
+                    else:
+                        columns[varname] = np.asarray(values)
+                continue
+            ema_logging.debug('{} not found'.format(par.name))
+        return columns
+    
+    @method_logger
+    def run_block(self, scenarios, policy):
+        '''
+        Method for running a block of scenarios for a single policy. 
+        
+        Parameters
+        ----------
+        scenarios : list of Scenario instances
+        policy : Policy instance
+        
+        Returns
+        -------
+        list 
+            the output dict for each scenario
+        
+        '''
+        if not self.initialized(policy):
+            self.model_init(policy)
+        self._transform(policy, self.levers)
+        
+        constants = {c.name:c.value for c in self.constants}
+        experiment = combine(self._transform_block(scenarios), self.policy, 
+                             constants)
+        model_output = self.function(**experiment)
+        
+        columns = {}
+        for i, variable in enumerate(self.outcome_variables):
+            try:
+                value = model_output[variable]
+            except KeyError:
+                ema_logging.warning(variable +' not found in model output')
+                value  = None
+            except TypeError:
+                value = model_output[i]
+            columns[variable] = value
+        
+        outputs = []
+        for j in range(len(scenarios)):
+            self.output = {key:value if value is None else value[j] 
+                           for key, value in columns.items()}
+            outputs.append(self.output)
+            self.reset_model()
+        return outputs
+    
+    @method_logger
+    def run_model(self, scenario, policy):
+        """
+        Method for running an instantiated model structure. The scenario is
+        run as a block of a single experiment.
+        
+        Parameters
+        ----------
+        scenario : Scenario instance
+        policy : Policy instance
+        
+        """
+        self._output = self.run_block([scenario], policy)[0]
@@ -3,7 +3,6 @@ from __future__ import (unicode_literals, print_function, absolute_import,
                         division)
 
 import abc
-import itertools
 import numbers
 import pandas
 import six
@@ -363,7 +362,7 @@ class Experiment(NamedObject):
         self.scenario = scenario
 
 
-def experiment_generator(scenarios, model_structures, policies):
+def experiment_generator(scenarios, model_structures, policies, skip=None):
     '''
     
     generator function which yields experiments
@@ -373,18 +372,27 @@ def experiment_generator(scenarios, model_structures, policies):
     designs : iterable of dicts
     model_structures : list
     policies : list
+    skip : collection of ints, optional
+           experiment_ids of experiments that should not be yielded, for
+           example because they have already been run. 
 
     Notes
     -----
     this generator is essentially three nested loops: for each model structure,
     for each policy, for each experiment, run the experiment. This means 
     that designs should not be a generator because this will be exhausted after
-    the running the first policy on the first model. 
+    the running the first policy on the first model. Scenarios are iterated
+    over lazily, so they are not all held in memory at the same time if 
+    scenarios generates them on the fly.
     
     '''
-    jobs = itertools.product(model_structures, policies, scenarios)
+    jobs = ((msi, policy, scenario) for msi in model_structures for policy 
+            in policies for scenario in scenarios)
     
     for i, job in enumerate(jobs):
+        if skip and i in skip:
+            continue
+        
         msi, policy, scenario = job
         name = '{} {} {}'.format(msi.name, policy.name, i)
         experiment = Experiment(name, msi.name, policy, scenario, i)
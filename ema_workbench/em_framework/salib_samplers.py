@@ -17,7 +17,7 @@ from SALib.sample import saltelli, morris, fast_sampler
 
 import operator
 
-from .samplers import DefaultDesigns
+from .samplers import DesignMatrix
 from .parameters import CategoricalParameter, IntegerParameter
 
 
@@ -66,15 +66,13 @@ class SALibSampler(object):
         samples = self.sample(problem, size)
         samples = {unc.name:samples[:,i] for i, unc in enumerate(uncertainties)}
         
-        # handle integer and categorical uncertainties
+        # handle integer and categorical uncertainties, the translation
+        # of the index into the category is done when generating the designs
         for uncertainty in uncertainties:
             sample = samples[uncertainty.name]
             
-            if isinstance(uncertainty, CategoricalParameter):
-                sample = [uncertainty.cat_for_index(int(entry)) for entry in 
-                          sample]
-            elif isinstance(uncertainty, IntegerParameter):
-                sample = (int(entry) for entry in sample)
+            if isinstance(uncertainty, IntegerParameter):
+                sample = sample.astype(int)
 
             samples[uncertainty.name] = sample
         
@@ -96,23 +94,12 @@ class SALibSampler(object):
         
         Returns
         -------
-        generator
-            a generator object that yields the designs resulting from
-            combining the parameters
-        int
-            the number of experimental designs
+        DesignMatrix
         
         '''
         parameters = sorted(parameters, key=operator.attrgetter('name'))
         sampled_parameters = self.generate_samples(parameters, nr_samples)
-        
-        nr_designs = next(iter(list(sampled_parameters.values()))).shape[0]
-
-        params = sorted(sampled_parameters.keys())
-        designs = list(zip(*[sampled_parameters[u] for u in params])) 
-        designs = DefaultDesigns(designs, parameters, nr_designs)
-        
-        return designs
+        return DesignMatrix(parameters, sampled_parameters)
 
 class SobolSampler(SALibSampler):
     '''Sampler generating a Sobol design using SALib
@@ -5,6 +5,10 @@ types of samplers. These different samplers implement basic sampling
 techniques including Full Factorial sampling, Latin Hypercube sampling, and
 Monte Carlo sampling.
 
+The samplers return the designs as a :class:`DesignMatrix`, which stores the 
+sampled values of each parameter in a typed numpy array. The dicts, or 
+Scenario and Policy instances, are only created when a design is accessed.
+
 '''
 from __future__ import (absolute_import, print_function, division,
                         unicode_literals)
@@ -14,7 +18,7 @@ try:
     from future_builtins import zip
 except ImportError:
     try:
-         # < 2.5 or 3.x
+        from itertools import izip as zip # < 2.5 or 3.x
     except ImportError:
         pass
 
@@ -37,6 +41,7 @@ __all__ = ['AbstractSampler',
            'MonteCarloSampler',
            'FullFactorialSampler',
            'PartialFactorialSampler',
+           'DesignMatrix',
            'sample_levers',
            'sample_uncertainties',
            'determine_parameters']
@@ -128,19 +133,20 @@ class AbstractSampler(object):
         
         Returns
         -------
-        generator
-            a generator object that yields the designs resulting from
-            combining the parameters
-        int
-            the number of experimental designs
+        DesignMatrix
+        
+        Note
+        ----
+        All samples are drawn at once, so the memory used is proportional
+        to nr_samples times the number of parameters, see 
+        :class:`DesignMatrix`. Latin hypercube sampling, for example, 
+        permutes the intervals over all samples, so it cannot draw the 
+        samples block by block.
         
         '''
         parameters = sorted(parameters, key=operator.attrgetter('name'))
         sampled_parameters = self.generate_samples(parameters, nr_samples)
-        designs = zip(*[sampled_parameters[u.name] for u in parameters]) 
-        designs = DefaultDesigns(designs, parameters, nr_samples)
-        
-        return designs
+        return DesignMatrix(parameters, sampled_parameters, n=nr_samples)
 
 
 class LHSSampler(AbstractSampler):
@@ -295,22 +301,16 @@ class FullFactorialSampler(AbstractSampler):
         
         Returns
         -------
-        generator
-            a generator object that yields the designs resulting from
-            combining the parameters
-        int
-            the number of experimental designs
+        DesignMatrix
+            the product of the samples of the parameters, which is not 
+            materialized
         
         '''
         parameters = sorted(parameters, key=operator.attrgetter('name'))
         
         samples = self.generate_samples(parameters, nr_samples)
-        zipped_samples = itertools.product(*[samples[u.name] for u in parameters])
-        
-        n_designs = self.determine_nr_of_designs(samples)
-        designs = DefaultDesigns(zipped_samples, parameters, n_designs)
-        
-        return designs
+        return DesignMatrix.product(*[DesignMatrix([u], samples) for u in 
+                                      parameters])
 
     def determine_nr_of_designs(self, sampled_parameters):
         '''
@@ -402,11 +402,7 @@ class PartialFactorialSampler(AbstractSampler):
         
         Returns
         -------
-        generator
-            a generator object that yields the designs resulting from
-            combining the parameters
-        int
-            the number of experimental designs
+        DesignMatrix
         
         '''
         
@@ -421,12 +417,7 @@ class PartialFactorialSampler(AbstractSampler):
         other_designs = self.sampler.generate_designs(other_params, 
                                                               nr_samples)
         
-        nr_designs = other_designs.n * ff_designs.n
-        
-        designs = PartialFactorialDesigns(ff_designs, other_designs, 
-                                          parameters, nr_designs)
-        
-        return designs
+        return DesignMatrix.product(ff_designs, other_designs)
 
 
     
@@ -467,7 +458,8 @@ def sample_levers(models, n_samples, union=True, sampler=LHSSampler(),
     
     Returns
     -------
-    generator yielding Policy instances
+    DesignMatrix
+        yielding Policy instances
     
     '''
     levers = determine_parameters(models, 'levers', union=union)
@@ -492,13 +484,8 @@ def sample_uncertainties(models, n_samples, union=True, sampler=LHSSampler()):
     
     Returns
     -------
-    generator 
+    DesignMatrix
         yielding Scenario instances
-    collection
-        the collection of parameters over which to sample
-    n_samples
-        the number of scenarios (!= n_samples in case off FF sampling)
-    
     
     '''
     uncertainties = determine_parameters(models, 'uncertainties', union=union)
@@ -517,12 +504,8 @@ def from_experiments(models, experiments):
     
     Returns
     -------
-     generator 
+    DesignMatrix
         yielding Scenario instances
-    collection
-        the collection of parameters over which to sample
-    n_samples
-        the number of scenarios (!= n_samples in case off FF sampling)   
     
     '''
     policy_names = np.unique(experiments['policy'])
@@ -542,108 +525,195 @@ def from_experiments(models, experiments):
                                            union=True)
     unc_names = np.lib.recfunctions.get_names(experiments.dtype)  # @UndefinedVariable
     uncertainties = [uncertainties[unc] for unc in unc_names]
-
-    samples = {unc:experiments[unc] for unc in unc_names}
     
-    scenarios = DefaultDesigns(samples, uncertainties, experiments.shape[0])
+    # the experiments contain the categories rather than their indices
+    samples = {}
+    for unc in uncertainties:
+        values = experiments[unc.name]
+        if isinstance(unc, CategoricalParameter):
+            indices = {cat.value:i for i, cat in enumerate(unc.categories)}
+            values = [indices[value] for value in values]
+        samples[unc.name] = values
+    
+    scenarios = DesignMatrix(uncertainties, samples, 
+                             n=experiments.shape[0])
     scenarios.kind = Scenario
     
     return scenarios 
 
-class DefaultDesigns(object):
-    '''iterable for the experimental designs'''
-    
-    def __init__(self, designs, parameters, n):
-        self.designs = designs
-        self.parameters = parameters
-        self.params = [p.name for p in parameters]
-        self.kind = None
-        self.n = n
-    
-    @abc.abstractmethod 
-    def __iter__(self):
-        '''should return iterator'''
-        return design_generator(self.designs, self.parameters, self.kind)
 
-
-class PartialFactorialDesigns(object):
+class DesignMatrix(object):
+    '''columnar storage of experimental designs
     
-    @property
-    def kind(self):
-        return self._kind
+    The sampled values of each parameter are stored in a numpy array: floats
+    for real valued parameters, integers for integer parameters, and the 
+    index of the category for categorical parameters. A design is only 
+    turned into a dict, or into an instance of kind, when it is accessed,
+    either by index or by iterating over the designs. Iteration converts the
+    designs in chunks, using the arrays, so the designs are created on the
+    fly and can be iterated over more than once.
     
-    @kind.setter
-    def kind(self, value):
-        self._kind = value
-        self.ff_designs.kind = value
-        self.other_designs.kind = value
+    A design matrix can also be the product of other design matrices, see 
+    :meth:`product`, in which case the combinations are not materialized.
     
-    def __init__(self, ff_designs, other_designs, parameters, n):
-        self.ff_designs = ff_designs
-        self.other_designs = other_designs
-        
-        self.parameters = parameters
-        self.params = [p.name for p in parameters]
-
-        self._kind = None
-        self.n = n
-    
-    def __iter__(self):
-        designs =  itertools.product(self.ff_designs, self.other_designs)
-        return partial_designs_generator(designs)
-
-def partial_designs_generator(designs):
-    '''generator which combines the full factorial part of the design with
-    the non full factorial part into a single dict
+    The samples themselves are stored in full, so a design matrix takes 8 
+    bytes per parameter per design, e.g. 4 GB for 50 million designs over 10
+    parameters. For a product, only the samples of its factors are stored.
+    It is the experiments, the dicts or kind instances, and the results 
+    that are created on the fly and thus take constant memory.
     
     Parameters
     ----------
-    designs: iterable of tuples
-    
-    Yields
-    ------
-    dict
-        experimental design dict
+    parameters : list of Parameter instances
+    samples : dict
+              for each parameter, a sequence with the sampled values
+    n : int, optional
+        the number of designs, only required if there are no parameters
     
+    Attributes
+    ----------
+    parameters : list of Parameter instances
+    params : list of str
+    n : int
+        the number of designs
+    kind : callable
+           called with the values of a design as keyword arguments when a 
+           design is accessed, e.g. Scenario. If None, designs are dicts.
     
     '''
-
-    for design in designs:
-        ff_part, other_part = design
+    
+    chunk_size = 10000
+    
+    def __init__(self, parameters, samples, n=None):
+        parameters = list(parameters)
+        columns = {}
+        for param in parameters:
+            column = np.asarray(samples[param.name])
+            if isinstance(param, IntegerParameter):
+                columns[param.name] = column.astype(np.int64, copy=False)
+            else:
+                columns[param.name] = column.astype(np.float64, copy=False)
         
-        design = ff_part.copy()
-        design.update(other_part)
+        if parameters:
+            n = columns[parameters[0].name].shape[0]
         
-        yield design
-
-def design_generator(designs, params, kind):
-    '''generator that combines the sampled parameters with their correct 
-    name in order to return dicts.
+        # a single block, see product
+        self._blocks = [(parameters, columns, n)]
+        self._set_parameters()
+        self.kind = None
     
-    Parameters
-    ----------
-    designs : iterable of tuples
-    params : iterable of str
+    @classmethod
+    def product(cls, *matrices):
+        '''the full factorial combination of the designs in matrices, with
+        the designs of the last matrix varying fastest
+        
+        Parameters
+        ----------
+        matrices : DesignMatrix instances
+        
+        Returns
+        -------
+        DesignMatrix
+        
+        '''
+        matrix = cls([], {}, n=1)
+        matrix._blocks = [block for entry in matrices for block in 
+                          entry._blocks]
+        matrix._set_parameters()
+        return matrix
     
-    Yields
-    ------
-    dict
-        experimental design dictionary
+    def _set_parameters(self):
+        self.parameters = [param for block in self._blocks for param in 
+                           block[0]]
+        self.params = [param.name for param in self.parameters]
+        
+        self.n = 1
+        for block in self._blocks:
+            self.n *= block[2]
     
-    '''
+    def __len__(self):
+        return self.n
     
-    for design in designs:
-
-        design_dict = {}
-        for param, value in zip(params, design):
-            if isinstance(param, IntegerParameter):
-                value = int(value)
+    def column(self, name, indices=None):
+        '''the sampled values for a parameter
+        
+        Parameters
+        ----------
+        name : str
+        indices : 1d array of ints, optional
+                  the designs for which to return the values, defaults to 
+                  all designs
+        
+        Returns
+        -------
+        numpy array
+            for categorical parameters, the indices of the categories
+        
+        '''
+        if indices is None:
+            indices = np.arange(self.n)
+        return self._columns(np.asarray(indices))[name]
+    
+    def _columns(self, indices):
+        '''the sampled values of all parameters for the designs in 
+        indices'''
+        columns = {}
+        for parameters, block_columns, n in reversed(self._blocks):
+            indices, block_indices = np.divmod(indices, n)
+            for param in parameters:
+                columns[param.name] = block_columns[param.name][block_indices]
+        return columns
+    
+    def _converted(self, columns):
+        '''the values of each parameter as a list of python objects'''
+        converted = []
+        for param in self.parameters:
+            values = columns[param.name].tolist()
             if isinstance(param, CategoricalParameter):
-                # categorical parameter is an integer parameter, so
-                # conversion to int is already done
-                value = param.cat_for_index(value).value
-            
-            design_dict[param.name] = value
-        
-        yield kind(**design_dict)
-        
\ No newline at end of file
+                categories = [cat.value for cat in param.categories]
+                values = [categories[value] for value in values]
+            converted.append(values)
+        return converted
+    
+    def _make(self, design):
+        if self.kind is None:
+            return design
+        return self.kind(**design)
+    
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.n
+        if not (0 <= index < self.n):
+            raise IndexError("design index out of range")
+        
+        columns = self._columns(np.array([index]))
+        design = {name:values[0] for name, values in 
+                  zip(self.params, self._converted(columns))}
+        return self._make(design)
+    
+    def take(self, indices):
+        '''the designs for the specified indices
+        
+        Parameters
+        ----------
+        indices : 1d array of ints
+        
+        Returns
+        -------
+        list
+        
+        '''
+        indices = np.asarray(indices)
+        converted = self._converted(self._columns(indices))
+        
+        if converted:
+            rows = zip(*converted)
+        else:
+            rows = itertools.repeat((), indices.shape[0])
+        return [self._make(dict(zip(self.params, row))) for row in rows]
+    
+    def __iter__(self):
+        for start in range(0, self.n, self.chunk_size):
+            indices = np.arange(start, min(start+self.chunk_size, self.n))
+            for design in self.take(indices):
+                yield design
@@ -13,8 +13,11 @@ except ImportError:
 
 # import cPickle
 from io import BytesIO, StringIO
+import json
 import math
+import numbers
 import os
+import shutil
 import sys
 import tarfile
 
@@ -40,12 +43,15 @@ else:
 
 __all__ = ['load_results',
            'save_results',
+           'load_results_binary',
+           'save_results_binary',
+           'ResultsStore',
            'experiments_to_cases',
            'merge_results'
            ]
 
 
-def load_results(file_name):
+def load_results(file_name, mmap_mode=None):
     '''
     load the specified bz2 file. the file is assumed to be saves
     using save_results.
@@ -53,7 +59,12 @@ def load_results(file_name):
     Parameters
     ----------    
     file_name : str
-                the path to the file
+                the path to the file, or to the directory in case of the
+                binary format
+    mmap_mode : {None, 'r', 'r+', 'c'}, optional
+                only used for the binary format. If not None, the outcomes
+                are memory mapped with the specified mode rather than read
+                into memory. See numpy.load for details.
                 
     Raises
     ------
@@ -61,6 +72,12 @@ def load_results(file_name):
 
     '''
     file_name = os.path.abspath(file_name)
+    
+    if os.path.isdir(file_name):
+        return load_results_binary(file_name, mmap_mode=mmap_mode)
+    elif mmap_mode is not None:
+        warning('mmap_mode is ignored for tar.gz files')
+    
     outcomes = {}
     with tarfile.open(file_name, 'r:gz', encoding="UTF8") as z:
         # load x
@@ -137,12 +154,15 @@ def load_results(file_name):
     return experiments, outcomes
 
 
-def save_results(results, file_name):
+def save_results(results, file_name, binary=False):
     '''
     save the results to the specified tar.gz file. The results are stored as 
     csv files. There is an x.csv, and a csv for each outcome. In 
     addition, there is a metadata csv which contains the datatype information
     for each of the columns in the x array.
+    
+    If binary is True, the results are instead stored in the binary format 
+    in a directory, see :func:`save_results_binary`.
 
     Parameters
     ----------    
@@ -150,12 +170,16 @@ def save_results(results, file_name):
               the return of run_experiments
     file_name : str
                 the path of the file
+    binary : bool, optional
     
     Raises
     ------
     IOError if file not found
 
     '''
+    if binary:
+        return save_results_binary(results, file_name)
+    
     file_name = os.path.abspath(file_name)
 
     def add_file(tararchive, string_to_add, filename):
@@ -211,6 +235,456 @@ def save_results(results, file_name):
     info("results saved successfully to {}".format(file_name))
     
 
+BINARY_METADATA = 'metadata.json'
+BINARY_EXPERIMENTS = 'experiments.npy'
+BINARY_OUTCOME = 'outcome_{}.npy'
+BINARY_VERSION = 1
+
+
+def _json_value(value):
+    '''helper function for turning a category into a value that can be
+    stored as json'''
+    if isinstance(value, (bool, np.bool_)):
+        return bool(value)
+    elif isinstance(value, numbers.Integral):
+        return int(value)
+    elif isinstance(value, numbers.Real):
+        return float(value)
+    elif value is None or isinstance(value, str):
+        return value
+    else:
+        return str(value)
+
+
+def _encode_experiments(experiments):
+    '''replace the object columns in the experiments by integer codes, so 
+    the experiments can be stored without pickling and memory mapped'''
+    columns = []
+    dtypes = []
+    categories = {}
+    
+    for name in experiments.dtype.names:
+        column = experiments[name]
+        
+        if column.dtype == object:
+            codes = {}
+            encoded = np.empty(column.shape, dtype=np.int32)
+            for i, value in enumerate(column):
+                try:
+                    encoded[i] = codes[value]
+                except KeyError:
+                    encoded[i] = codes[value] = len(codes)
+            
+            values = sorted(codes, key=codes.get)
+            categories[name] = [_json_value(value) for value in values]
+            column = encoded
+        
+        columns.append(column)
+        dtypes.append((str(name), column.dtype))
+    
+    encoded = np.empty(experiments.shape, dtype=dtypes)
+    for (name, _), column in zip(dtypes, columns):
+        encoded[name] = column
+    return encoded, categories
+
+
+def _decode_experiments(encoded, categories):
+    '''inverse of _encode_experiments'''
+    if not categories:
+        return encoded
+    
+    dtypes = []
+    for name in encoded.dtype.names:
+        dtype = object if name in categories else encoded.dtype[name]
+        dtypes.append((str(name), dtype))
+    
+    experiments = np.empty(encoded.shape, dtype=dtypes)
+    for name in encoded.dtype.names:
+        column = encoded[name]
+        
+        if name in categories:
+            values = np.empty((len(categories[name]),), dtype=object)
+            for i, value in enumerate(categories[name]):
+                values[i] = value
+            column = values[column]
+        experiments[name] = column
+    return experiments
+
+
+def save_results_binary(results, directory):
+    '''
+    save the results in binary format to the specified directory. The 
+    experiments are stored as a single structured array in 
+    experiments.npy, with object columns stored as integer codes. Each 
+    outcome is stored in its own npy file, irrespective of its number of 
+    dimensions. In addition, there is a metadata.json with the names of the
+    outcomes and the categories for each of the object columns. 
+    
+    In contrast to the tar.gz format, no conversion to text is needed, and 
+    the outcomes can be memory mapped when loading them. 
+    
+    Parameters
+    ----------    
+    results : tuple
+              the return of run_experiments
+    directory : str
+                the path of the directory, is created if it does not
+                exist.
+    
+    '''
+    directory = os.path.abspath(directory)
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    
+    experiments, outcomes = results
+    encoded, categories = _encode_experiments(experiments)
+    np.save(os.path.join(directory, BINARY_EXPERIMENTS), encoded, 
+            allow_pickle=False)
+    
+    outcome_files = {}
+    for i, (key, value) in enumerate(outcomes.items()):
+        fn = BINARY_OUTCOME.format(i)
+        np.save(os.path.join(directory, fn), np.asarray(value), 
+                allow_pickle=False)
+        outcome_files[key] = fn
+    
+    metadata = {'version': BINARY_VERSION,
+                'categories': categories,
+                'outcomes': outcome_files}
+    with open(os.path.join(directory, BINARY_METADATA), 'w') as fh:
+        json.dump(metadata, fh)
+    
+    info("results saved successfully to {}".format(directory))
+
+
+def load_results_binary(directory, mmap_mode=None):
+    '''
+    load results saved with :func:`save_results_binary`
+    
+    Parameters
+    ----------    
+    directory : str
+                the path of the directory
+    mmap_mode : {None, 'r', 'r+', 'c'}, optional
+                If not None, the outcomes are memory mapped with the 
+                specified mode rather than read into memory. If the
+                experiments have no object columns, they are memory mapped
+                as well. See numpy.load for details.
+    
+    Returns
+    -------
+    experiments : structured numpy array
+    outcomes : dict
+    
+    Raises
+    ------
+    IOError if directory not found
+    
+    '''
+    directory = os.path.abspath(directory)
+    
+    with open(os.path.join(directory, BINARY_METADATA), 'r') as fh:
+        metadata = json.load(fh)
+    
+    if metadata['version'] > BINARY_VERSION:
+        raise EMAError('unknown version {} for binary results'.format(
+                                                        metadata['version']))
+    
+    encoded = np.load(os.path.join(directory, BINARY_EXPERIMENTS), 
+                      mmap_mode=mmap_mode, allow_pickle=False)
+    experiments = _decode_experiments(encoded, metadata['categories'])
+    
+    outcomes = {}
+    for key, fn in metadata['outcomes'].items():
+        outcomes[key] = np.load(os.path.join(directory, fn), 
+                                mmap_mode=mmap_mode, allow_pickle=False)
+    
+    info("results loaded succesfully from {}".format(directory))
+    return experiments, outcomes
+    
+
+class ResultsStore(object):
+    '''
+    appendable on disk store for results, keyed by experiment_id. 
+    
+    The store is a directory with a subdirectory for each chunk of results
+    that has been written. Each chunk is stored in the binary format (see
+    :func:`save_results_binary`), together with the experiment_ids of the 
+    experiments in the chunk. A chunk is first written to a temporary 
+    directory and only renamed once it is complete, so a crash while 
+    writing does not corrupt the store. 
+    
+    The store can be used as a sink for a 
+    :class:`~callbacks.StreamingCallback`.
+    
+    Parameters
+    ----------
+    directory : str
+                the path of the directory, is created if it does not 
+                exist.
+    nr_experiments : int, optional
+                     the total number of experiments. If the store already
+                     exists, it should match the number of experiments 
+                     in the store.
+    parameters : list of str, optional
+                 the names of the parameters of the experiments. If the 
+                 store already exists, they should match the parameters 
+                 of the experiments in the store.
+    
+    Raises
+    ------
+    EMAError 
+        if nr_experiments or parameters do not match those of an existing
+        store
+    
+    Each experiment_id can be written only once, so a store cannot 
+    silently end up with multiple results for the same experiment.
+    
+    '''
+    
+    METADATA = 'store.json'
+    CHUNK = 'chunk_{:06d}'
+    IDS = 'experiment_ids.npy'
+    TMP = '.tmp_'
+    
+    def __init__(self, directory, nr_experiments=None, parameters=None):
+        self.directory = os.path.abspath(directory)
+        metadata_file = os.path.join(self.directory, self.METADATA)
+        
+        if parameters is not None:
+            parameters = list(parameters)
+        
+        if os.path.exists(metadata_file):
+            with open(metadata_file, 'r') as fh:
+                metadata = json.load(fh)
+            
+            stored = metadata['nr_experiments']
+            if (nr_experiments is not None) and (stored is not None) and\
+               (stored != nr_experiments):
+                raise EMAError(('store contains results for {} experiments, '
+                                'not {}').format(stored, nr_experiments))
+            if stored is not None:
+                nr_experiments = stored
+            
+            stored = metadata.get('parameters')
+            if (parameters is not None) and (stored is not None) and\
+               (stored != parameters):
+                raise EMAError(('store contains results for parameters {}, '
+                                'not {}').format(stored, parameters))
+            if stored is not None:
+                parameters = stored
+        else:
+            if not os.path.exists(self.directory):
+                os.makedirs(self.directory)
+            
+            with open(metadata_file, 'w') as fh:
+                json.dump({'version': BINARY_VERSION, 
+                           'nr_experiments': nr_experiments,
+                           'parameters': parameters}, fh)
+        
+        self.nr_experiments = nr_experiments
+        self.parameters = parameters
+        
+        # remove any chunks that were not completely written
+        self.chunks = []
+        for entry in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, entry)
+            if entry.startswith(self.TMP):
+                shutil.rmtree(path)
+            elif os.path.isdir(path):
+                self.chunks.append(entry)
+        
+        # which experiment_ids have been written
+        self._written = np.zeros((nr_experiments or 0,), dtype=bool)
+        for ids in self._iter_ids():
+            self._mark_written(ids)
+    
+    def _mark_written(self, ids):
+        if ids.shape[0] and (ids.max() >= self._written.shape[0]):
+            written = np.zeros((ids.max()+1,), dtype=bool)
+            written[0:self._written.shape[0]] = self._written
+            self._written = written
+        self._written[ids] = True
+    
+    def __len__(self):
+        return sum(ids.shape[0] for ids in self._iter_ids())
+    
+    def _iter_ids(self):
+        for chunk in self.chunks:
+            yield np.load(os.path.join(self.directory, chunk, self.IDS))
+    
+    def write(self, experiment_ids, experiments, outcomes):
+        '''
+        append a chunk of results to the store
+        
+        Parameters
+        ----------
+        experiment_ids : numpy array of ints
+        experiments : structured numpy array 
+        outcomes : dict
+        
+        Raises
+        ------
+        EMAError
+            if any of the experiment_ids is already in the store, or 
+            occurs more than once
+        
+        '''
+        experiment_ids = np.asarray(experiment_ids, dtype=np.int64)
+        
+        if np.unique(experiment_ids).shape[0] != experiment_ids.shape[0]:
+            raise EMAError('duplicate experiment_ids in chunk')
+        stored = experiment_ids[experiment_ids < self._written.shape[0]]
+        stored = stored[self._written[stored]]
+        if stored.shape[0]:
+            raise EMAError(('results for {} experiments, including '
+                            'experiment {}, are already in the store').format(
+                                                stored.shape[0], stored[0]))
+        
+        if self.chunks:
+            chunk = self.CHUNK.format(int(self.chunks[-1].split('_')[-1])+1)
+        else:
+            chunk = self.CHUNK.format(0)
+        tmp_dir = os.path.join(self.directory, self.TMP+chunk)
+        
+        save_results_binary((experiments, outcomes), tmp_dir)
+        np.save(os.path.join(tmp_dir, self.IDS), experiment_ids)
+        os.rename(tmp_dir, os.path.join(self.directory, chunk))
+        
+        self.chunks.append(chunk)
+        self._mark_written(experiment_ids)
+        debug("chunk {} written to {}".format(chunk, self.directory))
+    
+    def close(self):
+        return self
+    
+    def experiment_ids(self):
+        '''
+        Returns
+        -------
+        sorted numpy array with the ids of all experiments in the store
+        '''
+        ids = list(self._iter_ids())
+        if not ids:
+            return np.empty((0,), dtype=np.int64)
+        return np.sort(np.concatenate(ids))
+    
+    def iter_chunks(self, mmap_mode='r'):
+        '''
+        iterate over the chunks in the store
+        
+        Parameters
+        ----------
+        mmap_mode : {None, 'r', 'r+', 'c'}, optional
+        
+        Yields
+        ------
+        experiment_ids : numpy array
+        experiments : structured numpy array
+        outcomes : dict
+        
+        '''
+        for chunk in self.chunks:
+            path = os.path.join(self.directory, chunk)
+            ids = np.load(os.path.join(path, self.IDS))
+            experiments, outcomes = load_results_binary(path, 
+                                                        mmap_mode=mmap_mode)
+            yield ids, experiments, outcomes
+    
+    def load(self):
+        '''
+        load all results in the store into memory, ordered by experiment_id. 
+        Chunks are memory mapped while loading, so the memory needed is 
+        equal to the size of the results. 
+        
+        Returns
+        -------
+        experiments : structured numpy array
+        outcomes : dict
+        
+        Raises
+        ------
+        EMAError
+            if not all results could be loaded
+        
+        '''
+        all_ids = self.experiment_ids()
+        n = all_ids.shape[0]
+        
+        experiments = None
+        outcomes = {}
+        filled = {}
+        for ids, chunk_experiments, chunk_outcomes in self.iter_chunks():
+            rows = np.searchsorted(all_ids, ids)
+            
+            if experiments is None:
+                experiments = np.zeros((n,), dtype=chunk_experiments.dtype)
+                filled[None] = np.zeros((n,), dtype=bool)
+            experiments[rows] = chunk_experiments
+            filled[None][rows] = True
+            
+            for key, value in chunk_outcomes.items():
+                try:
+                    outcome = outcomes[key]
+                except KeyError:
+                    fill = np.nan if value.dtype.kind in 'fc' else 0
+                    outcome = np.full((n,)+value.shape[1::], fill,
+                                      dtype=value.dtype)
+                    outcomes[key] = outcome
+                    filled[key] = np.zeros((n,), dtype=bool)
+                outcome[rows] = value
+                filled[key][rows] = True
+        
+        for key, rows in filled.items():
+            if not rows.all():
+                raise EMAError(('{} is missing for {} of {} experiments in '
+                                '{}').format(key or 'experiments', 
+                                             n-rows.sum(), n, 
+                                             self.directory))
+        
+        info("results loaded succesfully from {}".format(self.directory))
+        return experiments, outcomes
+
+
+def _merge_stores(store1, store2, downsample, directory):
+    '''helper function for merging two ResultsStores chunk by chunk'''
+    if directory is None:
+        raise EMAError('a directory is needed for merging ResultsStores')
+    
+    # experiment_ids of the second store are offset by the size of the
+    # first store
+    offset = store1.nr_experiments
+    if offset is None:
+        ids = store1.experiment_ids()
+        offset = ids[-1]+1 if ids.shape[0] else 0
+    
+    nr_experiments = None
+    if (store1.nr_experiments is not None) and\
+       (store2.nr_experiments is not None):
+        nr_experiments = store1.nr_experiments + store2.nr_experiments
+    
+    keys = None
+    for store in (store1, store2):
+        for _, _, outcomes in store.iter_chunks():
+            if keys is None:
+                keys = set(outcomes.keys())
+            else:
+                keys = keys.intersection(outcomes.keys())
+            break
+    info("intersection of keys: %s" % keys)
+    
+    merged = ResultsStore(directory, nr_experiments)
+    for store, store_offset in ((store1, 0), (store2, offset)):
+        for ids, experiments, outcomes in store.iter_chunks():
+            outcomes = {k:v for k, v in outcomes.items() if k in keys}
+            
+            if downsample:
+                outcomes = {k:v[:, ::downsample] if v.ndim > 1 else v 
+                            for k, v in outcomes.items()}
+            merged.write(ids + store_offset, experiments, outcomes)
+    return merged
+
+
 def experiments_to_cases(experiments):
     '''
     
@@ -257,7 +731,7 @@ def experiments_to_cases(experiments):
     return cases
 
 
-def merge_results(results1, results2, downsample=None):
+def merge_results(results1, results2, downsample=None, directory=None):
     '''
     convenience function for merging the return from 
     :meth:`~modelEnsemble.ModelEnsemble.perform_experiments`.
@@ -274,22 +748,33 @@ def merge_results(results1, results2, downsample=None):
     performs these cases on a different model or policy, and then one wants to
     merge these new results with the old result for further analysis.  
     
+    If both results are a :class:`ResultsStore`, the stores are merged
+    chunk by chunk into a new store in directory, so neither store is loaded 
+    into memory in full. The experiment_ids of results2 are offset by the 
+    number of experiments in results1.
+    
     Parameters
     ----------
-    results1 : tuple
+    results1 : tuple or ResultsStore
                first results to be merged
-    results2 : tuple
+    results2 : tuple or ResultsStore
                second results to be merged
     downsample : int 
                  should be an integer, will be used in slicing the results
                  in order to avoid memory problems. 
+    directory : str, optional
+                the directory for the merged store, only used when merging
+                ResultsStores
 
     Returns
     -------
-    the merged results
+    the merged results, or a ResultsStore when merging stores
     
     
     '''
+    if isinstance(results1, ResultsStore) and\
+       isinstance(results2, ResultsStore):
+        return _merge_stores(results1, results2, downsample, directory)
 
     #start of merging
     old_exp, old_res = results1
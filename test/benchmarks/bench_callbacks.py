@@ -0,0 +1,78 @@
+'''
+Benchmark comparing the DefaultCallback with the ColumnarCallback. 
+
+Run as a script, e.g. python bench_callbacks.py 100000
+
+'''
+from __future__ import (absolute_import, print_function, division,
+                        unicode_literals)
+
+import sys
+import timeit
+
+import numpy as np
+
+from ema_workbench.em_framework.callbacks import (DefaultCallback, 
+                                                  ColumnarCallback)
+from ema_workbench.em_framework.outcomes import (ScalarOutcome, 
+                                                 TimeSeriesOutcome)
+from ema_workbench.em_framework.parameters import (RealParameter, 
+                        CategoricalParameter, Scenario, Policy, Experiment)
+
+
+def make_problem(nr_experiments, nr_uncertainties=20, nr_outcomes=20):
+    uncertainties = [RealParameter('u{}'.format(i), 0, 1) for i in 
+                     range(nr_uncertainties)]
+    uncertainties.append(CategoricalParameter('cat', ['a', 'b', 'c']))
+    outcomes = [ScalarOutcome('o{}'.format(i)) for i in range(nr_outcomes)]
+    outcomes.append(TimeSeriesOutcome('ts'))
+    
+    policy = Policy('none')
+    batch = []
+    for i in range(nr_experiments):
+        scenario = {u.name:np.random.rand() for u in uncertainties[0:-1]}
+        scenario['cat'] = 'b'
+        experiment = Experiment(str(i), 'model', policy, 
+                                Scenario(**scenario), i)
+        
+        result = {o.name:np.random.rand() for o in outcomes[0:-1]}
+        result['ts'] = np.random.rand(50)
+        batch.append((experiment, result))
+    return uncertainties, outcomes, batch
+
+
+def run_per_case(klass, uncertainties, outcomes, batch):
+    callback = klass(uncertainties, [], outcomes, len(batch), 
+                     reporting_interval=len(batch))
+    for experiment, result in batch:
+        callback(experiment, result)
+    return callback.get_results()
+
+
+def run_batched(klass, uncertainties, outcomes, batch, batch_size=1000):
+    callback = klass(uncertainties, [], outcomes, len(batch), 
+                     reporting_interval=len(batch))
+    for i in range(0, len(batch), batch_size):
+        callback.store_batch(batch[i:i+batch_size])
+    return callback.get_results()
+
+
+def main(nr_experiments=10000, repeat=3):
+    problem = make_problem(nr_experiments)
+    
+    timings = [('DefaultCallback, per case', 
+                lambda: run_per_case(DefaultCallback, *problem)),
+               ('ColumnarCallback, per case', 
+                lambda: run_per_case(ColumnarCallback, *problem)),
+               ('ColumnarCallback, batches of 1000', 
+                lambda: run_batched(ColumnarCallback, *problem))]
+    
+    print('storing {} experiments'.format(nr_experiments))
+    for label, function in timings:
+        timing = min(timeit.repeat(function, number=1, repeat=repeat))
+        print('{:<40}{:>8.3f} s {:>12.0f} cases/s'.format(label, timing, 
+                                                 nr_experiments/timing))
+
+
+if __name__ == '__main__':
+    main(*[int(entry) for entry in sys.argv[1:]])
@@ -0,0 +1,65 @@
+'''
+Benchmark for the scaling of Prim.find_box with the number of processes 
+used for evaluating the candidate boxes, for both peeling engines. The 
+SORTED engine ignores the number of processes, so its timings serve as a
+reference. The number of processes is set through the private Prim._n_jobs,
+which becomes part of the api of Prim once this benchmark shows a speedup
+on multi-core hardware.
+
+Run as a script, e.g. python bench_prim.py 100000 50 64, which runs 
+find_box on 100000 cases and 50 uncertainties, for 1, 2, 4, ... 64 
+processes.
+
+'''
+from __future__ import (absolute_import, print_function, division,
+                        unicode_literals)
+
+import sys
+import timeit
+
+import numpy as np
+
+from ema_workbench.analysis import prim
+
+
+def make_data(nr_cases, nr_uncertainties):
+    random_state = np.random.RandomState(42)
+    
+    dtype = [('x{}'.format(i), float) for i in range(nr_uncertainties)]
+    x = np.empty((nr_cases,), dtype=dtype)
+    for name, _ in dtype:
+        x[name] = random_state.rand(nr_cases)
+    
+    y = ((x['x0'] > 0.5) & (x['x1'] < 0.4)).astype(int)
+    return x, y
+
+
+def run(x, y, peeling_engine, n_jobs):
+    prim_obj = prim.Prim(x, y, threshold=0.8, peeling_engine=peeling_engine)
+    prim_obj._n_jobs = n_jobs
+    prim_obj._min_parallel_size = 0
+    return prim_obj.find_box()
+
+
+def main(nr_cases=100000, nr_uncertainties=50, max_jobs=64, repeat=1):
+    x, y = make_data(nr_cases, nr_uncertainties)
+    
+    n_jobs = [1]
+    while n_jobs[-1] < max_jobs:
+        n_jobs.append(min(2*n_jobs[-1], max_jobs))
+    
+    print('find_box on {} cases, {} uncertainties'.format(nr_cases, 
+                                                          nr_uncertainties))
+    for engine in [prim.SORTED, prim.BASIC]:
+        reference = None
+        for jobs in n_jobs:
+            timing = min(timeit.repeat(lambda: run(x, y, engine, jobs), 
+                                       number=1, repeat=repeat))
+            if reference is None:
+                reference = timing
+            print('{:<8}{:>4} processes {:>10.3f} s {:>8.2f}x'.format(engine, 
+                                            jobs, timing, reference/timing))
+
+
+if __name__ == '__main__':
+    main(*[int(entry) for entry in sys.argv[1:]])
@@ -0,0 +1,71 @@
+'''
+Benchmark comparing the throughput of saving and loading results in the 
+tar.gz format and in the binary format.
+
+Run as a script, e.g. python bench_save_load.py 10000 100
+
+'''
+from __future__ import (absolute_import, print_function, division,
+                        unicode_literals)
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from ema_workbench.util.utilities import (save_results, load_results)
+
+
+def make_results(nr_experiments, nr_timesteps):
+    experiments = np.empty((nr_experiments,), 
+                           dtype=[('a', float), ('b', float), ('c', object),
+                                  ('model', object), ('policy', object)])
+    experiments['a'] = np.random.rand(nr_experiments)
+    experiments['b'] = np.random.rand(nr_experiments)
+    experiments['c'] = np.random.choice(['x', 'y', 'z'], nr_experiments)
+    experiments['model'] = 'model'
+    experiments['policy'] = 'none'
+    
+    outcomes = {'scalar': np.random.rand(nr_experiments),
+                'time_series': np.random.rand(nr_experiments, nr_timesteps),
+                'replications': np.random.rand(nr_experiments, 
+                                               nr_timesteps, 5)}
+    return experiments, outcomes
+
+
+def timed(function, *args, **kwargs):
+    start = time.time()
+    value = function(*args, **kwargs)
+    return time.time() - start, value
+
+
+def main(nr_experiments=10000, nr_timesteps=100):
+    results = make_results(nr_experiments, nr_timesteps)
+    nbytes = sum(v.nbytes for v in results[1].values()) / 1024**2
+    print('{} experiments, {:.1f} MB of outcomes'.format(nr_experiments, 
+                                                         nbytes))
+    
+    directory = tempfile.mkdtemp()
+    try:
+        formats = [('tar.gz', os.path.join(directory, 'results.tar.gz'), 
+                    {}, {}),
+                   ('binary', os.path.join(directory, 'results'), 
+                    {'binary':True}, {}),
+                   ('binary, mmap', os.path.join(directory, 'results_mmap'), 
+                    {'binary':True}, {'mmap_mode':'r'})]
+        
+        for label, fn, save_kwargs, load_kwargs in formats:
+            save_time, _ = timed(save_results, results, fn, **save_kwargs)
+            load_time, _ = timed(load_results, fn, **load_kwargs)
+            print('{:<16} save {:>8.3f} s {:>8.1f} MB/s load {:>8.3f} s '
+                  '{:>8.1f} MB/s'.format(label, save_time, nbytes/save_time,
+                                         load_time, nbytes/load_time))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main(*[int(entry) for entry in sys.argv[1:]])
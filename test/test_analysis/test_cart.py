@@ -10,6 +10,7 @@ import unittest
 import numpy as np
 
 from ema_workbench.analysis import cart
+from ema_workbench.analysis import scenario_discovery_util as sdutil
 from .. import utilities
 
 
@@ -59,7 +60,40 @@ class CartTestCase(unittest.TestCase):
     def test_boxes(self):
         pass
     def test_stats(self):
-        pass
+        random_state = np.random.RandomState(1)
+        x = np.empty((1000,), dtype=[('a', np.float), ('b', np.float),
+                                     ('c', np.object)])
+        x['a'] = random_state.rand(1000)
+        x['b'] = random_state.rand(1000)
+        x['c'] = random_state.choice(['p', 'q', 'r'], 1000)
+        y = ((x['a'] > 0.4) & (x['c'] != 'q')).astype(np.int)
+        
+        for mode in [sdutil.BINARY, sdutil.REGRESSION, 
+                     sdutil.CLASSIFICATION]:
+            cart_algorithm = cart.CART(x, y, mass_min=0.05, mode=mode)
+            cart_algorithm.build_tree()
+            
+            boxes = cart_algorithm.boxes
+            stats = cart_algorithm.stats
+            self.assertEqual(len(boxes), len(stats))
+            
+            for box, boxstats in zip(boxes, stats):
+                y_in_box = y[sdutil._in_box(x, box)]
+                self.assertAlmostEqual(boxstats['mass'], 
+                                       y_in_box.shape[0]/y.shape[0])
+                
+                if mode == sdutil.BINARY:
+                    self.assertAlmostEqual(boxstats['coverage'], 
+                                           np.sum(y_in_box)/np.sum(y))
+                    self.assertAlmostEqual(boxstats['density'], 
+                                           np.mean(y_in_box))
+                elif mode == sdutil.REGRESSION:
+                    self.assertAlmostEqual(boxstats['mean'], 
+                                           np.mean(y_in_box))
+                else:
+                    self.assertEqual(boxstats['box_composition'],
+                                     [np.sum(y_in_box==0), 
+                                      np.sum(y_in_box==1)])
     def test_build_tree(self):
         pass
     
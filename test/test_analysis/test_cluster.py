@@ -4,11 +4,100 @@ Created on Mar 15, 2012
 .. codeauthor:: jhkwakkel <j.h.kwakkel (at) tudelft (dot) nl>
 '''
 
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
 from ema_workbench.analysis import clusterer
+from ema_workbench.analysis.cluster_util import (distance_sse, distance_mse,
+                                                 distance_triangle,
+                                                 distance_gonenc)
+from ema_workbench.analysis.cluster_util.gonenc_distance import (
+                                        construct_features, weighted_sse)
 from ema_workbench.util import ema_logging
 
 from ..utilities import load_scarcity_data
 
+
+class BlockedDistanceTestCase(unittest.TestCase):
+    def test_blocked_distances(self):
+        data = np.random.rand(25, 10) + 10
+        
+        for function in [distance_sse, distance_mse, distance_triangle]:
+            dRow, runLogs = function(data)
+            
+            for block_size, n_jobs in [(4, 1), (7, 3), (100, 1)]:
+                blocked, blocked_logs = function(data, block_size=block_size,
+                                                 n_jobs=n_jobs)
+                np.testing.assert_allclose(blocked, dRow, rtol=1e-10)
+                self.assertEqual(len(blocked_logs), len(runLogs))
+                self.assertEqual(blocked_logs[3][0], runLogs[3][0])
+                np.testing.assert_array_equal(blocked_logs[3][1], 
+                                              runLogs[3][1])
+    
+    def test_near_identical(self):
+        # the sse of (nearly) identical series is calculated directly
+        base = np.random.rand(5, 100)*10
+        data = np.vstack((base, base + np.random.randn(5, 100)*1e-6, 
+                          base + 1e-9))
+        
+        dRow, _ = distance_sse(data)
+        blocked, _ = distance_sse(data, block_size=4)
+        np.testing.assert_allclose(blocked, dRow, rtol=1e-10)
+        self.assertTrue(np.all(blocked > 0))
+    
+    def test_memmap(self):
+        data = np.random.rand(25, 10)
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, 'drow.npy')
+            dRow, _ = distance_sse(data, block_size=8, filename=filename)
+            self.assertIsInstance(dRow, np.memmap)
+            
+            np.testing.assert_allclose(np.load(filename), 
+                                       distance_sse(data)[0], rtol=1e-10)
+            del dRow
+        finally:
+            shutil.rmtree(directory)
+
+class GroupedGonencTestCase(unittest.TestCase):
+    def test_weighted_sse(self):
+        a = np.random.rand(4, 6, 2)*100
+        b = np.concatenate((a, a + 1e-7))
+        
+        error = weighted_sse(a, b, [1, 0.5])
+        expected = [[np.sum(((x-y)**2)*[1, 0.5]) for y in b] for x in a]
+        np.testing.assert_allclose(error, expected, rtol=1e-10)
+        self.assertTrue(np.all(error[:, 0:4][np.eye(4, dtype=bool)] == 0))
+        self.assertTrue(np.all(error >= 0))
+    
+    def test_grouped(self):
+        t = np.linspace(0, 1, 30)
+        data = np.cumsum(np.random.randn(40, 30), axis=1) +\
+               20*np.random.randn(40, 1)*t**2
+        dRow, runLogs = distance_gonenc(data, sisterCount=10)
+        
+        features = construct_features(data, True, 0.1, True, 0.1, True, True)
+        lengths = np.array([feature.shape[1] for feature in features])
+        i, j = np.triu_indices(data.shape[0], 1)
+        same = lengths[i] == lengths[j]
+        
+        for block_size, n_jobs in [(3, 1), (5, 2), (100, 1)]:
+            grouped, grouped_logs = distance_gonenc(data, sisterCount=10,
+                                                    block_size=block_size,
+                                                    n_jobs=n_jobs)
+            self.assertEqual(grouped.shape, dRow.shape)
+            np.testing.assert_allclose(grouped[same], dRow[same])
+            
+            # the sisters are random, so distances between feature vectors
+            # of different lengths differ
+            self.assertTrue(np.all(grouped[~same] >= 0))
+            self.assertEqual(grouped_logs[3][0], runLogs[3][0])
+
+
 if __name__ == "__main__":
     ema_logging.log_to_stderr(ema_logging.INFO)
     
@@ -8,6 +8,12 @@ from __future__ import (absolute_import, print_function, division,
 
 import unittest
 
+import numpy as np
+import pandas as pd
+
+from ema_workbench.analysis import dimensional_stacking
+from ema_workbench.util import EMAError
+
 
 class DimStackTestCase(unittest.TestCase):
     
@@ -26,3 +32,50 @@ class DimStackTestCase(unittest.TestCase):
     def test_plot_pivot_table(self):
         pass
     
+    def test_binned_pivot_table(self):
+        random_state = np.random.RandomState(1)
+        n = 1000
+        x = np.empty((n,), dtype=[('a', np.float), ('b', np.float), 
+                                  ('c', np.int), ('d', np.object)])
+        x['a'] = random_state.rand(n)
+        x['b'] = random_state.rand(n)
+        x['c'] = random_state.randint(0, 2, n)
+        x['d'] = random_state.choice(['p', 'q'], n)
+        y = x['a'] > 0.5
+        
+        # compare with the pandas based pivot table for the numeric factors
+        rows = ['a', 'c']
+        columns = ['b']
+        data = dimensional_stacking.discretize(pd.DataFrame.from_records(
+                                                        x[rows+columns]))
+        data['y'] = y
+        expected = dimensional_stacking.make_pivot_table(data, rows=rows, 
+                                            columns=columns, values='y')
+        
+        table = dimensional_stacking.binned_pivot_table(x, y, rows, columns)
+        self.assertTrue(table.index.equals(expected.index))
+        self.assertTrue(table.columns.equals(expected.columns))
+        np.testing.assert_array_almost_equal(table.values, expected.values)
+        
+        # categorical factor and chunks
+        table = dimensional_stacking.binned_pivot_table(x, y, ['a'], ['d'], 
+                                            statistic='count', chunksize=300)
+        self.assertEqual(table.shape, (3, 2))
+        self.assertEqual(table.values.sum(), n)
+        self.assertEqual(table[1].sum(), np.sum(x['d']=='q'))
+        
+        bins = dimensional_stacking.determine_bins(x, ['a', 'd'])
+        aggregation = dimensional_stacking.BinnedAggregation(bins, ['a'], 
+                                                             ['d'])
+        aggregation.update(x[0:500], y[0:500])
+        aggregation.update(x[500::], y[500::])
+        np.testing.assert_array_equal(aggregation.table('count').values,
+                                      table.values)
+        
+        with self.assertRaises(EMAError):
+            aggregation.table('median')
+        
+        x['a'][0] = 2
+        with self.assertRaises(EMAError):
+            aggregation.update(x, y)
+    
@@ -7,6 +7,11 @@ from __future__ import (absolute_import, print_function, division)
 
 import unittest
 
+try:
+    import unittest.mock as mock
+except ImportError:
+    import mock
+
 import numpy as np
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.ensemble.forest import RandomForestRegressor
@@ -189,6 +194,122 @@ class FeatureScoringTestCase(unittest.TestCase):
                                              random_state=42)
         self.assertEqual(len(scores), len(x.dtype.fields))
         
+    def test_get_feature_scores_all(self):
+        random_state = np.random.RandomState(1)
+        x = np.empty((500,), dtype=[('a', np.float), ('b', np.float),
+                                    ('c', np.object)])
+        x['a'] = random_state.rand(500)
+        x['b'] = random_state.rand(500)
+        x['c'] = random_state.choice(['p', 'q', 'r'], 500)
+        y = {'y1':((x['a'] > 0.4) & (x['c'] != 'q')).astype(np.int),
+             'y2':(x['b'] > 0.5).astype(np.int)}
+        
+        prepared = fs.prepare_experiments(x)
+        self.assertEqual(list(prepared.uncs), ['a', 'b', 'c'])
+        
+        scores = []
+        for data, n_jobs in [(x, 1), (prepared, 1), (prepared, 2)]:
+            scores.append(fs.get_feature_scores_all(data, y, 
+                                            mode=CLASSIFICATION, n_jobs=n_jobs, 
+                                            nr_trees=20, random_state=1))
+        
+        self.assertEqual(scores[0].shape, (3, 2))
+        self.assertEqual(scores[0]['y2'].idxmax(), 'b')
+        for entry in scores[1::]:
+            self.assertTrue(entry.equals(scores[0]))
+        
+        single, _ = fs.get_ex_feature_scores(x, y['y1'], mode=CLASSIFICATION, 
+                                             nr_trees=20, random_state=1)
+        single = single.set_index(0)[1]
+        np.testing.assert_array_equal(scores[0]['y1'].values, single.values)
+        
+    def test_adaptive_nr_trees(self):
+        random_state = np.random.RandomState(1)
+        x = np.empty((500,), dtype=[('a', np.float), ('b', np.float)])
+        x['a'] = random_state.rand(500)
+        x['b'] = random_state.rand(500)
+        y = (x['a'] > 0.4).astype(np.int)
+        
+        for function in [fs.get_ex_feature_scores, fs.get_rf_feature_scores]:
+            # a tolerance of 0 is never reached, so all trees are used
+            _, forest = function(x, y, mode=CLASSIFICATION, nr_trees=35, 
+                                 increment=10, tolerance=0, random_state=1)
+            self.assertEqual(forest.n_estimators, 35)
+            self.assertEqual(len(forest.estimators_), 35)
+            
+            scores, forest = function(x, y, mode=CLASSIFICATION, 
+                                      nr_trees=100, increment=10, 
+                                      tolerance=1, random_state=1)
+            self.assertEqual(forest.n_estimators, 20)
+            self.assertEqual(scores[0][0], 'a')
+    
+    def test_get_feature_scores_over_time(self):
+        random_state = np.random.RandomState(1)
+        x = np.empty((500,), dtype=[('a', np.float), ('b', np.float)])
+        x['a'] = random_state.rand(500)
+        x['b'] = random_state.rand(500)
+        
+        # a matters early on, b later on
+        y = np.empty((500, 10), dtype=np.int)
+        y[:, 0:5] = (x['a'] > 0.5)[:, np.newaxis]
+        y[:, 5:10] = (x['b'] > 0.5)[:, np.newaxis]
+        
+        scores = fs.get_feature_scores_over_time(x, y, mode=CLASSIFICATION,
+                                                 stride=3, nr_trees=20, 
+                                                 random_state=1)
+        self.assertEqual(list(scores.index), [0, 3, 6, 9])
+        self.assertEqual(list(scores.columns), ['a', 'b'])
+        self.assertTrue(np.all(scores.loc[[0, 3], 'a'] > 0.5))
+        self.assertTrue(np.all(scores.loc[[6, 9], 'b'] > 0.5))
+        
+        # the scores match those of scoring each time point separately
+        for t in scores.index:
+            expected, _ = fs.get_ex_feature_scores(x, y[:, t], 
+                                                   mode=CLASSIFICATION, 
+                                                   nr_trees=20, 
+                                                   random_state=1)
+            expected = expected.set_index(0)[1]
+            for unc in ['a', 'b']:
+                self.assertAlmostEqual(scores.loc[t, unc], expected[unc])
+        
+        scores = fs.get_feature_scores_over_time(x, y, mode=CLASSIFICATION,
+                                                 time_points=[1, 8], 
+                                                 warm_start=True,
+                                                 nr_trees=100, increment=10,
+                                                 random_state=1)
+        self.assertEqual(list(scores.index), [1, 8])
+        
+        with self.assertRaises(ValueError):
+            fs.get_feature_scores_over_time(x, y, mode=CLASSIFICATION,
+                                            warm_start=True)
+    
+    def test_warm_start(self):
+        random_state = np.random.RandomState(1)
+        x = np.empty((500,), dtype=[('a', np.float), ('b', np.float)])
+        x['a'] = random_state.rand(500)
+        x['b'] = random_state.rand(500)
+        
+        # noise first, followed by an outcome that depends only on a
+        y = np.empty((500, 3), dtype=np.int)
+        y[:, 0] = random_state.rand(500) > 0.5
+        y[:, 1:3] = (x['a'] > 0.5)[:, np.newaxis]
+        
+        nr_trees = []
+        get_ex_feature_scores = fs.algorithms['extra trees']
+        def record(*args, **kwargs):
+            scores, forest = get_ex_feature_scores(*args, **kwargs)
+            nr_trees.append(forest.n_estimators)
+            return scores, forest
+        
+        with mock.patch.dict(fs.algorithms, {'extra trees':record}):
+            fs.get_feature_scores_over_time(x, y, mode=CLASSIFICATION,
+                                            warm_start=True, nr_trees=100,
+                                            increment=10, tolerance=0.002,
+                                            random_state=1)
+        
+        # the number of trees can go down again
+        self.assertEqual(nr_trees, [40, 30, 30])
+        
 if __name__ == '__main__':
     ema_logging.log_to_stderr(ema_logging.INFO)   
     unittest.main()
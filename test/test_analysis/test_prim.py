@@ -8,9 +8,11 @@ import unittest
 
 import numpy as np
 import numpy.lib.recfunctions as recfunctions
+from scipy.stats import binom
 
 from ema_workbench.analysis import prim
 from ema_workbench.analysis.prim import PrimBox
+from ema_workbench.analysis import scenario_discovery_util as sdutil
 from test import utilities
 
 
@@ -130,6 +132,39 @@ class PrimBoxTestCase(unittest.TestCase):
         self.assertEqual(box.peeling_trajectory['res dim'][1], 1)
         self.assertEqual(box.peeling_trajectory['mass'][1], 2/3)
     
+    def test_long_trajectory(self):
+        x = np.array([(0,1,2),
+                      (2,5,6),
+                      (3,2,1)], 
+                     dtype=[('a', np.float),
+                            ('b', np.float),
+                            ('c', np.float)])
+        y = {'y':np.array([1,1,0])}
+        results = (x,y)
+        
+        prim_obj = prim.setup_prim(results, 'y', threshold=0.8)
+        box = PrimBox(prim_obj, prim_obj.box_init, prim_obj.yi)
+        
+        # more boxes than the initial size of the trajectory arrays
+        for i in range(40):
+            new_box_lim = np.copy(prim_obj.box_init)
+            new_box_lim['c'][1] = 6 - i/10
+            box.update(new_box_lim, np.array([0,1]))
+            
+            self.assertEqual(box.peeling_trajectory.shape, (i+2, 5))
+            self.assertEqual(box.mass, 2/3)
+        
+        self.assertIsInstance(box.box_lims, list)
+        self.assertEqual(len(box.box_lims), 41)
+        self.assertEqual(box.box_lims[0]['c'][1], 6)
+        self.assertEqual(box.box_lims[-1]['c'][1], 2.1)
+        self.assertEqual(box.box_lim['c'][1], 2.1)
+        self.assertEqual(box.res_dim, 1)
+        self.assertEqual(box.peeling_trajectory['res dim'][0], 0)
+        
+        box.select(10)
+        self.assertEqual(box.box_lim['c'][1], 5.1)
+    
     def test_drop_restriction(self):
         x = np.array([(0,1,2),
                       (2,5,6),
@@ -174,7 +209,38 @@ class PrimBoxTestCase(unittest.TestCase):
 
     
     def test_calculate_quasi_p(self):
-        pass
+        random_state = np.random.RandomState(1)
+        x = np.empty((500,), dtype=[('a', np.float), ('b', np.float),
+                                    ('c', np.object)])
+        x['a'] = random_state.rand(500)
+        x['b'] = random_state.rand(500)
+        x['c'] = random_state.choice(['p', 'q', 'r'], 500)
+        y = ((x['a'] > 0.4) & (x['c'] != 'q')).astype(np.int)
+        
+        prim_obj = prim.Prim(x, y, threshold=0.8)
+        box = prim_obj.find_box()
+        qp_values = box.quasi_p_values()
+        
+        self.assertEqual(qp_values.shape[0], len(box.box_lims))
+        self.assertTrue(np.all(np.isnan(qp_values.loc[0])))
+        
+        for i in range(len(box.box_lims)):
+            box_lim = box.box_lims[i]
+            Tbox = int(box.peeling_trajectory['mass'][i] * prim_obj.n)
+            Hbox = int(box.peeling_trajectory['coverage'][i] * 
+                       prim_obj.t_coi)
+            
+            restricted_dims = sdutil._determine_restricted_dims(box_lim, 
+                                                        prim_obj.box_init)
+            for u in restricted_dims:
+                temp_box = np.copy(box_lim)
+                temp_box[u] = box.box_lims[0][u]
+                indices = sdutil._in_box(x, temp_box)
+                p = np.sum(y[indices])/indices.shape[0]
+                
+                qp = binom.sf(Hbox-1, Tbox, p)
+                self.assertEqual(box._calculate_quasi_p(i)[u], qp)
+                self.assertEqual(qp_values.loc[i, u], qp)
 
 class PrimTestCase(unittest.TestCase):
 
@@ -477,6 +543,141 @@ class PrimTestCase(unittest.TestCase):
             self.assertEqual(indices.shape[0], 10)
             self.assertEqual(box_lims[u][0], set(['a','b']))
 
+class SortedPeelingEngineTestCase(unittest.TestCase):
+    def make_data(self, n=1000):
+        random_state = np.random.RandomState(42)
+        x = np.empty((n,), dtype=[('a', np.float), ('b', np.float), 
+                                  ('c', np.int), ('d', np.object)])
+        x['a'] = random_state.rand(n)
+        x['b'] = np.round(random_state.rand(n), 1)
+        x['c'] = random_state.randint(0, 10, n)
+        x['d'] = random_state.choice(['p', 'q', 'r'], n)
+        
+        y = ((x['a'] > 0.5) & (x['c'] < 6) & (x['d'] != 'q')).astype(np.int)
+        noise = random_state.rand(n) < 0.1
+        y[noise] = 1 - y[noise]
+        return x, y
+    
+    def assert_boxes_equal(self, box1, box2):
+        self.assertTrue(box1.peeling_trajectory.equals(
+                                                box2.peeling_trajectory))
+        self.assertEqual(len(box1.box_lims), len(box2.box_lims))
+        for lim1, lim2 in zip(box1.box_lims, box2.box_lims):
+            for name in lim1.dtype.names:
+                self.assertTrue(np.all(lim1[name] == lim2[name]))
+        np.testing.assert_array_equal(box1.yi, box2.yi)
+    
+    def test_peel(self):
+        x, y = self.make_data()
+        
+        for obj_function in [prim.LENIENT1, prim.LENIENT2, prim.ORIGINAL]:
+            boxes = []
+            for engine in [prim.BASIC, prim.SORTED]:
+                prim_obj = prim.Prim(x, y, threshold=0.8, 
+                                     obj_function=obj_function,
+                                     peeling_engine=engine)
+                box = PrimBox(prim_obj, prim_obj.box_init, 
+                              prim_obj.yi_remaining[:])
+                boxes.append(prim_obj._peel(box))
+            
+            self.assertGreater(len(boxes[0].box_lims), 2)
+            self.assert_boxes_equal(*boxes)
+    
+    def test_find_box(self):
+        x, y = self.make_data()
+        y = y + np.random.RandomState(1).rand(y.shape[0])
+        
+        prims = [prim.Prim(x, y, threshold=1.2, peeling_engine=engine) for 
+                 engine in [prim.BASIC, prim.SORTED]]
+        for _ in range(2):
+            boxes = [prim_obj.find_box() for prim_obj in prims]
+            self.assert_boxes_equal(*boxes)
+        
+        with self.assertRaises(prim.PrimException):
+            prim.Prim(x, y, threshold=1.2, peeling_engine='unknown')
+    
+    def test_n_jobs(self):
+        x, y = self.make_data()
+        
+        def find_box(y, n_jobs, **kwargs):
+            prim_obj = prim.Prim(x, y, **kwargs)
+            prim_obj._n_jobs = n_jobs
+            prim_obj._min_parallel_size = 0
+            box = prim_obj.find_box()
+            self.assertIsNone(prim_obj._pool)
+            return box
+        
+        for engine in [prim.BASIC, prim.SORTED]:
+            boxes = [find_box(y, n_jobs, threshold=0.8, peeling_engine=engine)
+                     for n_jobs in [1, 3]]
+            self.assert_boxes_equal(*boxes)
+        
+        # no restricted dimensions, so nothing to paste
+        boxes = [find_box(np.ones(x.shape[0]), n_jobs, threshold=0.5) 
+                 for n_jobs in [1, 2]]
+        self.assert_boxes_equal(*boxes)
+    
+    def test_batch(self):
+        x, y = self.make_data()
+        problems = [(y, 0.8), 
+                    (1-y, 0.8),
+                    (x['a'], 0.2, prim.BELOW)]
+        
+        batch = prim.PrimBatch(x)
+        for n_jobs in [1, 2]:
+            results = batch.run(problems, nr_boxes=2, n_jobs=n_jobs)
+            self.assertEqual(len(results), len(problems))
+            
+            for problem, result in zip(problems, results):
+                self.assertIs(result.x, batch.x)
+                
+                prim_obj = prim.Prim(x, problem[0], problem[1],
+                                     threshold_type=result.threshold_type,
+                                     peeling_engine=prim.SORTED)
+                for box in result._boxes:
+                    self.assert_boxes_equal(box, prim_obj.find_box())
+        
+        with self.assertRaises(prim.PrimException):
+            batch.setup(y[0:10], 0.8)
+    
+    def test_subset(self):
+        x, y = self.make_data()
+        indices = np.sort(np.random.RandomState(3).choice(x.shape[0], 500, 
+                                                          replace=False))
+        
+        prim_obj = prim.Prim(x, y, threshold=0.8, peeling_engine=prim.SORTED)
+        engine = prim.SortedPeelingEngine(prim_obj)
+        
+        boxes = []
+        for subset in [True, False]:
+            sample = prim.Prim(x[indices], y[indices], threshold=0.8, 
+                               peeling_engine=prim.SORTED)
+            if subset:
+                sample._sorted_engine = engine.subset(sample, indices)
+            boxes.append(sample.find_box())
+        self.assert_boxes_equal(*boxes)
+    
+    def test_resample(self):
+        x, y = self.make_data()
+        
+        results = []
+        for engine, n_jobs in [(prim.BASIC, 1), (prim.SORTED, 1), 
+                               (prim.SORTED, 2)]:
+            prim_obj = prim.Prim(x, y, threshold=0.8, peeling_engine=engine)
+            stats, box_lims = prim_obj.resample(4, fraction=0.5, 
+                                                n_jobs=n_jobs, seed=1)
+            self.assertEqual(len(box_lims), 4)
+            results.append(stats)
+        
+        for stats in results[1::]:
+            self.assertTrue(stats.equals(results[0]))
+        self.assertEqual(results[0].loc['a', 'restricted'], 1)
+        self.assertTrue(np.isnan(results[0].loc['d', 'lower mean']))
+        
+        with self.assertRaises(prim.PrimException):
+            prim_obj.resample(4, fraction=1.5)
+
+
 if __name__ == '__main__':
 #     ema_logging.log_to_stderr(ema_logging.INFO)    
 
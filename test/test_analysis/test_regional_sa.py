@@ -0,0 +1,90 @@
+'''
+
+
+'''
+from __future__ import (absolute_import, print_function, division,
+                        unicode_literals)
+
+import unittest
+
+import matplotlib.pyplot as plt
+import numpy as np
+
+from ema_workbench.analysis import regional_sa
+
+
+class RegionalSATestCase(unittest.TestCase):
+    
+    def test_sort_experiments(self):
+        x = np.empty((4,), dtype=[('a', np.float), ('b', np.object)])
+        x['a'] = [0.3, 0.1, 0.3, 0.2]
+        x['b'] = ['q', 'p', 'q', 'r']
+        
+        sorted_experiments = regional_sa.sort_experiments(x)
+        self.assertEqual(list(sorted_experiments.uncs), ['a', 'b'])
+        np.testing.assert_array_equal(sorted_experiments.orders[:, 0], 
+                                      [1, 3, 0, 2])
+        np.testing.assert_array_equal(sorted_experiments.orders[:, 1], 
+                                      [1, 0, 2, 3])
+        np.testing.assert_array_equal(sorted_experiments.last[:, 0], 
+                                      [True, True, False, True])
+        np.testing.assert_array_equal(sorted_experiments.last[:, 1], 
+                                      [True, False, True, True])
+    
+    def test_cdf_distances(self):
+        random_state = np.random.RandomState(1)
+        n = 500
+        x = np.empty((n,), dtype=[('a', np.float), ('b', np.int)])
+        x['a'] = random_state.rand(n)
+        x['b'] = random_state.randint(0, 4, n)
+        y = np.zeros((n,), dtype=np.int)
+        y[x['a'] > 0.4] = 1
+        y[x['a'] > 0.8] = 2
+        
+        distances = regional_sa.cdf_distances(x, y)
+        self.assertEqual(distances.shape, (2, 3))
+        
+        # the maximum distance between the empirical cdfs, calculated 
+        # directly
+        for unc in ['a', 'b']:
+            values = np.unique(x[unc])
+            for i in range(3):
+                in_class = x[unc][y==i]
+                out_class = x[unc][y!=i]
+                expected = np.max(np.abs(
+                      np.searchsorted(np.sort(in_class), values, 'right')/
+                      in_class.shape[0] - 
+                      np.searchsorted(np.sort(out_class), values, 'right')/
+                      out_class.shape[0]))
+                self.assertAlmostEqual(distances.loc[unc, i], expected)
+        
+        distances, p_values = regional_sa.cdf_distances(x, y, 
+                                                        nr_bootstraps=20, 
+                                                        seed=1)
+        self.assertTrue(np.all(p_values.loc['a'] == 1/21))
+        self.assertTrue(np.all(p_values.loc['b'] > 1/21))
+    
+    def test_plot_cdfs(self):
+        random_state = np.random.RandomState(1)
+        n = 100
+        x = np.empty((n,), dtype=[('a', np.float), ('b', np.object)])
+        x['a'] = random_state.rand(n)
+        x['b'] = random_state.choice(['p', 'q', 'r'], n)
+        y = (x['a'] > 0.5).astype(np.int)
+        
+        sorted_experiments = regional_sa.sort_experiments(x)
+        distances = regional_sa.cdf_distances(sorted_experiments, y)
+        fig = regional_sa.plot_cdfs(x, y, 
+                                    sorted_experiments=sorted_experiments,
+                                    distances=distances)
+        
+        # each cdf is annotated with the distance for each class
+        for ax, unc in zip(fig.axes, ['a', 'b']):
+            texts = [text.get_text() for text in ax.texts]
+            for distance in distances.loc[unc]:
+                self.assertIn('D={:.2f}'.format(distance), texts)
+        plt.close(fig)
+
+
+if __name__ == "__main__":
+    unittest.main()
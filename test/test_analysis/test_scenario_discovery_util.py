@@ -99,6 +99,45 @@ class ScenarioDiscoveryUtilTestCase(unittest.TestCase):
         result = sdutil._in_box(x, boxlim)
         self.assertTrue(np.all(correct_result==result))
     
+    def test_encoded_experiments(self):
+        dtype = [('a', np.float),
+                 ('b', np.int),
+                 ('c', np.object)]
+        x = np.array([(0.1, 0, 'a'),
+                      (1.1, 1, 'a'),
+                      (2.1, 2, 'b'),
+                      (3.1, 3, 'b'),
+                      (4.1, 4, 'c'),
+                      (5.1, 5, 'c'),
+                      (6.1, 6, 'd'),
+                      (7.1, 7, 'd'),
+                      (8.1, 8, 'e'),
+                      (9.1, 9, 'e')], 
+                     dtype=dtype)
+        x = np.ma.array(x)
+        x.mask['b'][9] = True
+        x.mask['c'][0] = True
+        
+        box_lims = [np.array([(1.2,0, set(['a','b'])),
+                              (8.0,7, set(['a','b']) )], dtype=dtype),
+                    np.array([(0.1, 0, set(['a','c','e','f'])),
+                              (9.1, 9, set(['a','c','e','f']))], 
+                             dtype=dtype)]
+        
+        encoded = sdutil.EncodedExperiments(x)
+        result = encoded.in_boxes(box_lims)
+        self.assertEqual(result.shape, (10, 2))
+        np.testing.assert_array_equal(np.flatnonzero(result[:, 0]), [2, 3])
+        np.testing.assert_array_equal(np.flatnonzero(result[:, 1]), 
+                                      [1, 4, 5, 8])
+        
+        for box_lim in box_lims:
+            np.testing.assert_array_equal(sdutil._in_box(x, box_lim),
+                                    np.flatnonzero(encoded.in_box(box_lim)))
+        
+        indices = np.array([1, 3, 5])
+        np.testing.assert_array_equal(encoded.in_box(box_lims[1], indices),
+                                      [True, False, True])
     
     def test_make_box(self):
         x = np.array([(0,1,2),
@@ -0,0 +1,195 @@
+'''
+
+
+'''
+from __future__ import (unicode_literals, print_function, absolute_import,
+                        division)
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from ema_workbench.em_framework import (Model, RealParameter, ScalarOutcome,
+                                        Constant, Scenario, Policy,
+                                        SequentialEvaluator, ExperimentCache,
+                                        perform_experiments)
+from ema_workbench.em_framework.cache import experiment_key
+from ema_workbench.util import EMAError, CaseError
+
+
+calls = []
+
+def some_model(a=0, b=0, c=0):
+    calls.append((a, b))
+    return {'y':a*b + c}
+
+
+def create_model():
+    model = Model('somemodel', function=some_model)
+    model.uncertainties = [RealParameter('a', 0, 1)]
+    model.levers = [RealParameter('b', 0, 1)]
+    model.constants = [Constant('c', 1)]
+    model.outcomes = [ScalarOutcome('y')]
+    return model
+
+
+class TestExperimentKey(unittest.TestCase):
+    def test_experiment_key(self):
+        model = create_model()
+        key = experiment_key(model, Scenario(a=0.5), Policy('p1', b=0.1))
+
+        # the key does not depend on names or irrelevant entries
+        self.assertEqual(key, experiment_key(model,
+                                             Scenario('other', a=0.5, d=1),
+                                             Policy('p2', b=0.1)))
+        self.assertEqual(key, experiment_key(model,
+                                             Scenario(a=np.float64(0.5)),
+                                             Policy('p1', b=0.1)))
+
+        # but it does on values, constants, and the version of the model
+        self.assertNotEqual(key, experiment_key(model, Scenario(a=0.4),
+                                                Policy('p1', b=0.1)))
+        model.constants = [Constant('c', 2)]
+        key_c = experiment_key(model, Scenario(a=0.5), Policy('p1', b=0.1))
+        self.assertNotEqual(key, key_c)
+        model.version = '2'
+        self.assertNotEqual(key_c, experiment_key(model, Scenario(a=0.5),
+                                                  Policy('p1', b=0.1)))
+
+
+class TestExperimentCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_get_put(self):
+        cache = ExperimentCache()
+        self.assertIsNone(cache.get('a'))
+
+        cache.put('a', {'y':np.arange(3)})
+        np.testing.assert_array_equal(cache.get('a')['y'], np.arange(3))
+        self.assertEqual(len(cache), 1)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        # replacing a result does not change the size
+        cache.put('a', {'y':1})
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.get('a'), {'y':1})
+
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        self.assertNotIn('a', cache)
+
+        with self.assertRaises(EMAError):
+            ExperimentCache(max_size=0)
+
+    def test_lru_eviction(self):
+        cache = ExperimentCache(max_size=2)
+        cache.put('a', {'y':1})
+        cache.put('b', {'y':2})
+        cache.get('a')
+        cache.put('c', {'y':3})
+
+        self.assertEqual(len(cache), 2)
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertIn('c', cache)
+
+        cache.put_many([('d', {'y':4}), ('e', {'y':5})])
+        self.assertEqual(len(cache), 2)
+        self.assertIn('d', cache)
+        self.assertIn('e', cache)
+
+    def test_persistence(self):
+        filename = os.path.join(self.directory, 'cache.sqlite')
+        cache = ExperimentCache(filename, max_size=2)
+        cache.put('a', {'y':1})
+        cache.put('b', {'y':2})
+        cache.get('a')
+        cache.close()
+
+        # the order of use is retained across sessions
+        cache = ExperimentCache(filename, max_size=2)
+        self.assertEqual(len(cache), 2)
+        cache.put('c', {'y':3})
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        cache.close()
+
+
+class TestPerformExperiments(unittest.TestCase):
+    def test_perform_experiments(self):
+        model = create_model()
+        scenarios = [Scenario(a=a) for a in np.linspace(0, 1, 5)]
+        policies = [Policy('p{}'.format(i), b=b) for i, b in
+                    enumerate([0.1, 0.2])]
+        cache = ExperimentCache()
+
+        del calls[:]
+        evaluator = SequentialEvaluator(model, cache=cache)
+        _, outcomes = perform_experiments(model, scenarios, policies,
+                                          evaluator=evaluator)
+        self.assertEqual(len(calls), 10)
+        self.assertEqual(len(cache), 10)
+        self.assertEqual(cache.misses, 10)
+
+        # only the experiments for the new policy are run
+        del calls[:]
+        policies.append(Policy('p2', b=0.3))
+        experiments, cached = perform_experiments(model, scenarios, policies,
+                                                  evaluator=evaluator)
+        self.assertEqual(len(calls), 5)
+        self.assertEqual(set(b for _, b in calls), {0.3})
+        self.assertEqual((cache.hits, cache.misses), (10, 5))
+
+        # the results are in the order of the experiments
+        expected = experiments['a']*experiments['b'] + 1
+        np.testing.assert_allclose(cached['y'], expected)
+        np.testing.assert_allclose(cached['y'][0:10], outcomes['y'])
+
+        # everything is served from the cache
+        del calls[:]
+        perform_experiments(model, scenarios, policies, evaluator=evaluator)
+        self.assertEqual(len(calls), 0)
+        self.assertEqual(cache.hits, 15)
+
+    def test_failed_experiments(self):
+        failing = [True]
+        def failing_model(a=0, b=0, c=0):
+            calls.append((a, b))
+            if failing[0] and a > 0.5:
+                raise CaseError('a too large', {'a':a})
+            return {'y':a*b + c}
+
+        model = Model('failingmodel', function=failing_model)
+        model.uncertainties = [RealParameter('a', 0, 1)]
+        model.levers = [RealParameter('b', 0, 1)]
+        model.constants = [Constant('c', 1)]
+        model.outcomes = [ScalarOutcome('y')]
+
+        scenarios = [Scenario(a=a) for a in np.linspace(0, 1, 5)]
+        cache = ExperimentCache()
+        evaluator = SequentialEvaluator(model, cache=cache)
+
+        _, outcomes = perform_experiments(model, scenarios, Policy('p', b=1),
+                                          evaluator=evaluator)
+        self.assertEqual(np.sum(np.isnan(outcomes['y'])), 2)
+        self.assertEqual(len(cache), 3)
+
+        # the failed experiments are run again
+        del calls[:]
+        failing[0] = False
+        _, outcomes = perform_experiments(model, scenarios, Policy('p', b=1),
+                                          evaluator=evaluator)
+        self.assertEqual(set(a for a, _ in calls), {0.75, 1})
+        np.testing.assert_allclose(outcomes['y'],
+                                   np.linspace(0, 1, 5) + 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
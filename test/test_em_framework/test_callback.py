@@ -5,14 +5,21 @@ Created on 22 Jan 2013
 '''
 from __future__ import (absolute_import, print_function, division,
                         unicode_literals)
+import itertools
 import random
+import shutil
+import tempfile
 import unittest
 
 import mock
 import numpy as np
 import numpy.lib.recfunctions as rf
 
-from ema_workbench.em_framework.callbacks import DefaultCallback
+from ema_workbench.em_framework.callbacks import (DefaultCallback, 
+                                                  ColumnarCallback,
+                                                  StreamingCallback, 
+                                                  PersistentCallback,
+                                                  AbstractSink, NpzSink)
 from ema_workbench.em_framework.parameters import (CategoricalParameter,
                                                       RealParameter, 
                                                       IntegerParameter)
@@ -181,6 +188,242 @@ class TestDefaultCallback(unittest.TestCase):
         
  
 
+class TestColumnarCallback(unittest.TestCase):
+    def test_init(self):
+        uncs = [RealParameter("a", 0, 1),
+                RealParameter("b", 0, 1)]
+        levers = [RealParameter('c', 0, 10)]
+        outcomes = [TimeSeriesOutcome("test")]
+        callback = ColumnarCallback(uncs, levers, outcomes, 
+                                    nr_experiments=100)
+        
+        self.assertEqual(callback.i, 0)
+        self.assertEqual(callback.nr_experiments, 100)
+        self.assertEqual(callback.outcomes, [o.name for o in outcomes])
+        self.assertEqual(callback.results, {})
+        
+        experiments, _ = callback.get_results()
+        self.assertEqual(experiments.shape[0], 100)
+        names = set(rf.get_names(experiments.dtype))
+        self.assertEqual(names, {'a', 'b', 'c','policy', 'model'})
+
+    def test_store_results(self):
+        nr_experiments = 3
+        uncs = [RealParameter("a", 0, 1),
+               RealParameter("b", 0, 1)]
+        outcomes = [TimeSeriesOutcome("test")]
+        model = NamedObject('test')
+
+        experiment = Experiment(0, model, Policy('policy'), 
+                                Scenario(a=1, b=0), 0)
+     
+        # scalar
+        callback = ColumnarCallback(uncs, [], outcomes, 
+                                    nr_experiments=nr_experiments)
+        callback(experiment, {outcomes[0].name: 1})
+        _, out = callback.get_results()
+        self.assertEqual(out[outcomes[0].name].shape, (3,))
+     
+        # time series
+        callback = ColumnarCallback(uncs, [], outcomes, 
+                                    nr_experiments=nr_experiments)
+        callback(experiment, {outcomes[0].name: np.random.rand(10)})
+        _, out = callback.get_results()
+        self.assertEqual(out[outcomes[0].name].shape, (3,10))
+
+        # maps etc.
+        callback = ColumnarCallback(uncs, [], outcomes, 
+                                    nr_experiments=nr_experiments)
+        callback(experiment, {outcomes[0].name: np.random.rand(2,2)})
+        _, out = callback.get_results()
+        self.assertEqual(out[outcomes[0].name].shape, (3,2,2))
+
+        # assert raises EMAError
+        callback = ColumnarCallback(uncs, [], outcomes, 
+                                    nr_experiments=nr_experiments)
+        result = {outcomes[0].name: np.random.rand(2,2,2)}
+        self.assertRaises(EMAError, callback, experiment, result)
+
+    def test_store_batch(self):
+        uncs = [RealParameter("a", 0, 1),
+                CategoricalParameter('b', ['x', 'y', 'z']),
+                IntegerParameter("c", 0, 5)]
+        levers = [RealParameter("d", 0, 1)]
+        outcomes = [TimeSeriesOutcome("test")]
+        
+        designs = [Scenario(a=random.random(), b=random.choice('xyz'), 
+                            c=random.randint(0, 5)) for _ in range(6)]
+        policies = [Policy('p1', d=0.5), Policy('p2', d=1)]
+        
+        callback = ColumnarCallback(uncs, levers, outcomes, nr_experiments=12)
+        
+        batch = []
+        for i, (policy, scenario) in enumerate(itertools.product(policies,
+                                                                 designs)):
+            experiment = Experiment(str(i), 'model', policy, scenario, i)
+            result = {outcomes[0].name: np.random.rand(5)}
+            batch.append((experiment, result))
+        
+        # store out of order and in two batches
+        shuffled = list(batch)
+        random.shuffle(shuffled)
+        callback.store_batch(shuffled[0:5])
+        callback.store_batch(shuffled[5::])
+        
+        self.assertEqual(callback.i, 12)
+        
+        experiments, out = callback.get_results()
+        
+        self.assertEqual(experiments['b'].dtype, object)
+        self.assertEqual(experiments['c'].dtype, int)
+        for i, (experiment, result) in enumerate(batch):
+            for name in ['a', 'b', 'c']:
+                self.assertEqual(experiments[name][i], 
+                                 experiment.scenario[name])
+            self.assertEqual(experiments['d'][i], experiment.policy['d'])
+            self.assertEqual(experiments['policy'][i], experiment.policy.name)
+            self.assertEqual(experiments['model'][i], 'model')
+            np.testing.assert_array_equal(out['test'][i], result['test'])
+        
+        # categoricals are stored as integer codes
+        column = callback.columns[callback.column_index['b']]
+        self.assertEqual(column.dtype, np.int32)
+
+
+def make_batch(nr_experiments):
+    batch = []
+    for i in range(nr_experiments):
+        scenario = Scenario(a=random.random(), b=random.choice('xy'))
+        experiment = Experiment(str(i), 'model', Policy('none'), 
+                                scenario, i)
+        result = {'test': np.random.rand(4)}
+        batch.append((experiment, result))
+    return batch
+
+
+class ListSink(AbstractSink):
+    def __init__(self):
+        self.chunks = []
+    
+    def write(self, experiment_ids, experiments, outcomes):
+        self.chunks.append((experiment_ids, experiments, outcomes))
+
+
+class TestStreamingCallback(unittest.TestCase):
+    def test_streaming(self):
+        uncs = [RealParameter("a", 0, 1),
+                CategoricalParameter('b', ['x', 'y'])]
+        outcomes = [TimeSeriesOutcome("test")]
+        
+        sink = ListSink()
+        callback = StreamingCallback(uncs, [], outcomes, nr_experiments=25,
+                                     sink=sink, chunk_size=10)
+        
+        batch = make_batch(25)
+        for experiment, result in batch:
+            callback(experiment, result)
+        self.assertEqual(len(sink.chunks), 2)
+        self.assertEqual(len(callback.buffer), 5)
+        
+        self.assertIs(callback.get_results(), sink)
+        self.assertEqual(callback.i, 25)
+        self.assertEqual([c[1].shape[0] for c in sink.chunks], [10, 10, 5])
+        
+        ids, experiments, out = sink.chunks[1]
+        np.testing.assert_array_equal(ids, np.arange(10, 20))
+        for j, i in enumerate(ids):
+            experiment, result = batch[i]
+            self.assertEqual(experiments['a'][j], experiment.scenario['a'])
+            self.assertEqual(experiments['b'][j], experiment.scenario['b'])
+            np.testing.assert_array_equal(out['test'][j], result['test'])
+        
+        with self.assertRaises(ValueError):
+            StreamingCallback(uncs, [], outcomes, nr_experiments=25)
+    
+    def test_npz_sink(self):
+        uncs = [RealParameter("a", 0, 1),
+                CategoricalParameter('b', ['x', 'y'])]
+        outcomes = [TimeSeriesOutcome("test")]
+        
+        directory = tempfile.mkdtemp()
+        try:
+            sink = NpzSink(directory)
+            callback = StreamingCallback(uncs, [], outcomes, 
+                                         nr_experiments=25, sink=sink, 
+                                         chunk_size=10)
+            batch = make_batch(25)
+            random.shuffle(batch)
+            for experiment, result in batch:
+                callback(experiment, result)
+            callback.get_results()
+            
+            self.assertEqual(sink.nr_chunks, 3)
+            
+            experiments, out = sink.load()
+            self.assertEqual(experiments.shape[0], 25)
+            self.assertEqual(out['test'].shape, (25, 4))
+            
+            for experiment, result in batch:
+                i = experiment.experiment_id
+                self.assertEqual(experiments['a'][i], experiment.scenario['a'])
+                self.assertEqual(experiments['b'][i], experiment.scenario['b'])
+                np.testing.assert_array_equal(out['test'][i], result['test'])
+        finally:
+            shutil.rmtree(directory)
+
+
+class TestPersistentCallback(unittest.TestCase):
+    def test_resume(self):
+        uncs = [RealParameter("a", 0, 1),
+                CategoricalParameter('b', ['x', 'y'])]
+        outcomes = [TimeSeriesOutcome("test")]
+        batch = make_batch(25)
+        
+        directory = tempfile.mkdtemp()
+        try:
+            # interrupted run, last incomplete chunk is lost
+            callback = PersistentCallback(uncs, [], outcomes, 
+                                          nr_experiments=25, 
+                                          directory=directory, 
+                                          chunk_size=10)
+            for experiment, result in batch[0:15]:
+                callback(experiment, result)
+            
+            # a store with results can only be resumed
+            with self.assertRaises(EMAError):
+                PersistentCallback(uncs, [], outcomes, nr_experiments=25, 
+                                   directory=directory)
+            
+            # and only for the same design
+            with self.assertRaises(EMAError):
+                PersistentCallback(uncs[0:1], [], outcomes, 
+                                   nr_experiments=25, directory=directory,
+                                   resume=True)
+            
+            callback = PersistentCallback(uncs, [], outcomes, 
+                                          nr_experiments=25, 
+                                          directory=directory, 
+                                          chunk_size=10, resume=True)
+            completed = callback.completed_experiments()
+            self.assertEqual(completed, set(range(10)))
+            
+            for experiment, result in batch:
+                if experiment.experiment_id not in completed:
+                    callback(experiment, result)
+            
+            experiments, out = callback.get_results()
+            self.assertEqual(experiments.shape[0], 25)
+            for experiment, result in batch:
+                i = experiment.experiment_id
+                self.assertEqual(experiments['a'][i], experiment.scenario['a'])
+                np.testing.assert_array_equal(out['test'][i], result['test'])
+        finally:
+            shutil.rmtree(directory)
+        
+        with self.assertRaises(ValueError):
+            PersistentCallback(uncs, [], outcomes, nr_experiments=25)
+
+
 if __name__ == "__main__":
     unittest.main()
     
\ No newline at end of file
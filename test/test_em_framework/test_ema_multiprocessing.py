@@ -5,10 +5,232 @@
 from __future__ import (unicode_literals, print_function, absolute_import,
                                         division)
 
+try:
+    import unittest.mock as mock
+except ImportError:
+    import mock
+import os
+import shutil
+import tempfile
+import unittest
 
+import numpy as np
+
+from ema_workbench.em_framework import ema_multiprocessing
+from ema_workbench.em_framework.ema_multiprocessing import (ChunkSizer, 
+                        add_tasks_chunked, add_tasks_shared, SharedBuffers,
+                        add_tasks_affinity, affinity_chunksize, AUTO)
+from ema_workbench.em_framework.parameters import (RealParameter, Policy, 
+                                                   Scenario, Experiment)
+from ema_workbench.em_framework.experiment_runner import RunStatistics
+from ema_workbench.em_framework.samplers import DesignMatrix
+from ema_workbench.util import EMAError
 
 # Created on 14 Mar 2017
 #
 # .. codeauthor::jhkwakkel <j.h.kwakkel (at) tudelft (dot) nl>
 
-__all__ = []
\ No newline at end of file
+__all__ = []
+
+
+def mock_run_experiments(function):
+    '''mock for ExperimentRunner.run_experiments, calling function for 
+    each experiment'''
+    def run_experiments(experiments, results=None):
+        if results is None:
+            results = []
+        for experiment in experiments:
+            results.append(function(experiment))
+        return results
+    return run_experiments
+
+
+class SynchronousPool(object):
+    '''pool that runs tasks upon submission, for testing'''
+    
+    def __init__(self):
+        self.submitted = []
+    
+    def apply_async(self, func, args, callback=None, error_callback=None):
+        self.submitted.append(args[0])
+        try:
+            value = func(*args)
+        except Exception as e:
+            error_callback(e)
+        else:
+            callback(value)
+    
+    def apply(self, func, args):
+        return func(*args)
+
+
+class TestChunkSizer(unittest.TestCase):
+    def test_fixed(self):
+        sizer = ChunkSizer(10)
+        self.assertEqual(sizer.chunksize, 10)
+        
+        sizer.update(10, 100)
+        self.assertEqual(sizer.chunksize, 10)
+        
+        with self.assertRaises(ValueError):
+            ChunkSizer(0)
+    
+    def test_auto(self):
+        sizer = ChunkSizer(AUTO, target_duration=1, max_chunksize=500)
+        self.assertEqual(sizer.chunksize, 1)
+        
+        sizer.update(1, 0.01)
+        self.assertEqual(sizer.chunksize, 100)
+        
+        # very fast experiments are capped
+        sizer = ChunkSizer(AUTO, target_duration=1, max_chunksize=500)
+        sizer.update(10, 0)
+        self.assertEqual(sizer.chunksize, 500)
+        
+        # very slow experiments still result in chunks of 1
+        sizer = ChunkSizer(AUTO, target_duration=1, max_chunksize=500)
+        sizer.update(1, 10)
+        self.assertEqual(sizer.chunksize, 1)
+
+
+class TestAddTasksChunked(unittest.TestCase):
+    def test_add_tasks_chunked(self):
+        runner = mock.Mock()
+        runner.nr_model_inits = 0
+        runner.run_experiments.side_effect = mock_run_experiments(
+                                                    lambda e: {'o':e})
+        ema_multiprocessing.experiment_runner = runner
+        
+        callback = mock.Mock()
+        pool = SynchronousPool()
+        
+        add_tasks_chunked(pool, iter(range(25)), callback, 2, chunksize=10)
+        
+        self.assertEqual([len(chunk) for chunk in pool.submitted], [10, 10, 5])
+        self.assertEqual(callback.store_batch.call_count, 3)
+        
+        batch = callback.store_batch.call_args_list[0][0][0]
+        self.assertEqual(batch[0], (0, {'o':0}))
+        
+        # if an experiment fails, the results of the experiments before it
+        # are stored, no further chunks are submitted, and an EMAError 
+        # identifying the experiment is raised
+        def fail(e):
+            if e.experiment_id == 13:
+                raise EMAError('some exception')
+            return {'o':e.experiment_id}
+        runner.run_experiments.side_effect = mock_run_experiments(fail)
+        experiments = [Experiment(str(i), 'model', Policy('p'), Scenario(), 
+                                  i) for i in range(25)]
+        
+        callback = mock.Mock()
+        pool = SynchronousPool()
+        with self.assertRaisesRegex(EMAError, 'experiment 13 failed'):
+            add_tasks_chunked(pool, iter(experiments), callback, 1, 
+                              chunksize=10)
+        self.assertEqual(len(pool.submitted), 2)
+        
+        stored = [experiment for entry in callback.store_batch.call_args_list
+                  for experiment, _ in entry[0][0]]
+        self.assertEqual(stored, experiments[0:13])
+        
+        # a chunk failing as a whole is also reported
+        runner.run_experiments.side_effect = None
+        pool = SynchronousPool()
+        with mock.patch.object(ema_multiprocessing, 'chunk_worker', 
+                               side_effect=ValueError('unpicklable')):
+            with self.assertRaisesRegex(EMAError, 'experiments 0 to 9'):
+                add_tasks_chunked(pool, iter(experiments), callback, 1, 
+                                  chunksize=10)
+
+
+class TestAddTasksAffinity(unittest.TestCase):
+    def test_affinity_chunksize(self):
+        self.assertEqual(affinity_chunksize(100, 4), 7)
+        self.assertEqual(affinity_chunksize(100, 5, 2), 10)
+        self.assertEqual(affinity_chunksize(3, 4), 1)
+    
+    @mock.patch('ema_workbench.em_framework.ema_multiprocessing.chunk_worker')
+    def test_add_tasks_affinity(self, mocked_worker):
+        mocked_worker.side_effect = lambda chunk: ([{'o':e} for e in chunk],
+                                                   0.1, 1, None)
+        pool = SynchronousPool()
+        callback = mock.Mock()
+        statistics = RunStatistics()
+        
+        add_tasks_affinity(pool, iter(range(100)), 100, callback, 2, 
+                           chunks_per_process=3, statistics=statistics)
+        
+        self.assertEqual([len(chunk) for chunk in pool.submitted], 
+                         [17, 17, 17, 17, 17, 15])
+        self.assertEqual([e for chunk in pool.submitted for e in chunk],
+                         list(range(100)))
+        self.assertEqual(callback.store_batch.call_count, 6)
+        self.assertEqual(statistics.nr_experiments, 100)
+        self.assertEqual(statistics.nr_model_inits, 6)
+
+
+class TestAddTasksShared(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        ema_multiprocessing.shared_buffers = None
+        shutil.rmtree(self.directory)
+    
+    def test_add_tasks_shared(self):
+        def run_experiment(e):
+            return {'o':e.scenario['a']*e.policy['b'], 
+                    'ts':np.arange(3)*e.scenario['a']}
+        
+        runner = mock.Mock()
+        runner.nr_model_inits = 0
+        runner.run_experiments.side_effect = mock_run_experiments(
+                                                            run_experiment)
+        ema_multiprocessing.experiment_runner = runner
+        
+        designs = DesignMatrix([RealParameter('a', 0, 10)], 
+                               {'a':np.arange(10)})
+        designs.kind = Scenario
+        buffers = SharedBuffers(os.path.join(self.directory, 'buffers'), 
+                                designs)
+        
+        model = mock.Mock()
+        model.name = 'model'
+        policies = [Policy('p1', b=1), Policy('p2', b=2)]
+        
+        callback = mock.Mock()
+        pool = SynchronousPool()
+        add_tasks_shared(pool, buffers, [model], policies, callback, 2, 
+                         chunksize=4, skip=[3, 12])
+        
+        # the first experiment is run on its own, the remaining ones in 
+        # chunks of scenario indices
+        self.assertEqual(pool.submitted, [buffers.directory]*5)
+        self.assertEqual(runner.run_experiments.call_count, 6)
+        
+        batches = [entry[0][0] for entry in 
+                   callback.store_batch.call_args_list]
+        stored = [entry for batch in batches for entry in batch]
+        self.assertEqual(len(stored), 18)
+        
+        for experiment, result in stored:
+            self.assertNotIn(experiment.experiment_id, [3, 12])
+            self.assertEqual(experiment.experiment_id, 
+                             experiment.scenario['a'] + 
+                             10*(experiment.policy.name=='p2'))
+            self.assertEqual(result['o'], experiment.scenario['a'] * 
+                                          experiment.policy['b'])
+            np.testing.assert_array_equal(result['ts'], 
+                                    np.arange(3)*experiment.scenario['a'])
+        
+        # the skipped experiments have no results
+        self.assertTrue(np.all(np.isnan(buffers.results['o'][[3, 12]])))
+        
+        # outcomes should have the same shape for all experiments
+        with self.assertRaises(EMAError):
+            buffers.store([0], [{'ts':np.arange(4)}])
+
+
+if __name__ == '__main__':
+    unittest.main()
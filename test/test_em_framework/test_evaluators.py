@@ -53,6 +53,29 @@ class TestEvaluators(unittest.TestCase):
         
             mocked_add_task.assert_called_once()
 
+    @mock.patch('ema_workbench.em_framework.evaluators.multiprocessing')   
+    @mock.patch('ema_workbench.em_framework.evaluators.DefaultCallback')
+    @mock.patch('ema_workbench.em_framework.evaluators.experiment_generator')
+    @mock.patch('ema_workbench.em_framework.evaluators.add_tasks')
+    @mock.patch('ema_workbench.em_framework.evaluators.add_tasks_chunked')
+    def test_multiprocessing_evaluator_chunked(self, mocked_add_chunked,
+                                 mocked_add_task, mocked_generator,
+                                 mocked_callback, mocked_multiprocessing):
+        model = mock.Mock(spec=ema_workbench.Model)
+        model.name = "test"
+        mocked_generator.return_value = [1]
+        
+        with evaluators.MultiprocessingEvaluator(model, 2, 
+                                             chunksize='auto') as evaluator:
+            evaluator.evaluate_experiments(10, 10, mocked_callback)
+        
+            mocked_add_task.assert_not_called()
+            mocked_add_chunked.assert_called_once()
+            
+            args, kwargs = mocked_add_chunked.call_args
+            self.assertEqual(args[3], 2)
+            self.assertEqual(kwargs['chunksize'], 'auto')
+
     @mock.patch('ema_workbench.em_framework.evaluators.set_engine_logger')
     @mock.patch('ema_workbench.em_framework.evaluators.initialize_engines')
     @mock.patch('ema_workbench.em_framework.evaluators.start_logwatcher')
@@ -67,14 +90,67 @@ class TestEvaluators(unittest.TestCase):
         
         client = mock.MagicMock(spec=ipyparallel.Client)
         lb_view = mock.Mock()
-        lb_view.map.return_value = [(1,1)]
+        lb_view.map.return_value = [(1, 1, 1, 0.1)]
         
         client.load_balanced_view.return_value = lb_view 
         
         with evaluators.IpyparallelEvaluator(model, client) as evaluator:
             evaluator.evaluate_experiments(10, 10, mocked_callback)
-            lb_view.map.called_once()
+            lb_view.map.assert_called_once()
+            self.assertEqual(evaluator.statistics.nr_model_inits, 1)
+        
+        # with policy affinity, the experiments are mapped in a few large
+        # chunks for each engine
+        mocked_generator.return_value = iter(range(100))
+        client.ids = [0, 1]
+        lb_view.map.return_value = [([(1, 1)]*50, 2, 1.0)]*2
+        
+        with evaluators.IpyparallelEvaluator(model, client, 
+                                        policy_affinity=True) as evaluator:
+            evaluator.evaluate_experiments([1]*50, [1]*2, mocked_callback)
+            
+            args, _ = lb_view.map.call_args
+            self.assertEqual(args[0], evaluators._run_experiments)
+            self.assertEqual([len(chunk) for chunk in args[1]], [13]*7+[9])
+            self.assertEqual(evaluator.statistics.nr_experiments, 100)
+            self.assertEqual(evaluator.statistics.nr_model_inits, 4)
+    
+    def test_sequential_statistics(self):
+        calls = []
+        def some_model(a=0, b=0):
+            calls.append(a)
+            return {'y':a*b}
+        
+        model = ema_workbench.Model('somemodel', function=some_model)
+        model.uncertainties = [ema_workbench.RealParameter('a', 0, 1)]
+        model.levers = [ema_workbench.RealParameter('b', 0, 1)]
+        model.outcomes = [ema_workbench.ScalarOutcome('y')]
+        
+        evaluator = evaluators.SequentialEvaluator(model)
+        evaluators.perform_experiments(model, 5, 3, evaluator=evaluator)
+        self.assertEqual(evaluator.statistics.nr_experiments, 15)
+        self.assertEqual(evaluator.statistics.nr_model_inits, 3)
     
+    def test_resume(self):
+        model = ema_workbench.Model('test', function=lambda a=0: {'y':a})
+        model.uncertainties = [ema_workbench.RealParameter('a', 0, 1)]
+        model.outcomes = [ema_workbench.ScalarOutcome('y')]
+        evaluator = evaluators.SequentialEvaluator(model)
+
+        # the default callback cannot resume
+        with self.assertRaises(ema_workbench.EMAError):
+            evaluators.perform_experiments(model, 5, evaluator=evaluator,
+                                           resume=True)
+
+        # a TypeError raised by a callback that can resume is not masked
+        def callback(uncs, levers, outcomes, nr_experiments,
+                     reporting_interval=None, resume=False):
+            raise TypeError('a bug')
+
+        with self.assertRaises(TypeError):
+            evaluators.perform_experiments(model, 5, evaluator=evaluator,
+                                           callback=callback, resume=True)
+
     def test_perform_experiments(self):
         pass
 
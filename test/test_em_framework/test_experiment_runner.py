@@ -14,7 +14,8 @@ except ImportError:
 import unittest
 
 from ema_workbench.em_framework.experiment_runner import ExperimentRunner
-from ema_workbench.em_framework.model import Model, AbstractModel
+from ema_workbench.em_framework.model import (Model, AbstractModel, 
+                                              VectorizedModel)
 from ema_workbench.util import EMAError, CaseError
 from ema_workbench.em_framework.parameters import Policy, Experiment, Scenario,\
     RealParameter
@@ -83,6 +84,60 @@ class ExperimentRunnerTestCase(unittest.TestCase):
                       Scenario(a=1, b=2),0)
 
         runner.run_experiment(experiment)
+    
+    def test_run_experiments(self):
+        mockMSI = mock.Mock(spec=Model)
+        mockMSI.name = 'test'
+        mockMSI.output = {'a':1}
+        
+        msis = NamedObjectMap(AbstractModel)
+        msis['test'] = mockMSI
+        runner = ExperimentRunner(msis)
+        
+        experiments = [Experiment(str(i), mockMSI.name, Policy('none'),  
+                                  Scenario(a=i), i) for i in range(3)]
+        results = runner.run_experiments(experiments)
+        
+        self.assertEqual(len(results), 3)
+        self.assertEqual(mockMSI.run_model.call_count, 3)
+        self.assertEqual(mockMSI.reset_model.call_count, 3)
+        
+        # calls to model_init are counted
+        mockMSI.initialized.side_effect = [False, True, False]
+        runner.run_experiments(experiments)
+        self.assertEqual(runner.nr_model_inits, 2)
+    
+    def test_run_experiments_vectorized(self):
+        mockMSI = mock.Mock(spec=VectorizedModel)
+        mockMSI.name = 'test'
+        mockMSI.run_block.side_effect = lambda scenarios, policy: [{'a':1}]*\
+                                                            len(scenarios)
+        
+        msis = NamedObjectMap(AbstractModel)
+        msis['test'] = mockMSI
+        runner = ExperimentRunner(msis)
+        
+        # consecutive experiments with the same policy form a block
+        policies = [Policy('1'), Policy('1'), Policy('2'), Policy('1')]
+        experiments = [Experiment(str(i), mockMSI.name, policy,  
+                                  Scenario(a=i), i) for i, policy in 
+                       enumerate(policies)]
+        results = runner.run_experiments(experiments)
+        
+        self.assertEqual(len(results), 4)
+        self.assertEqual(mockMSI.run_block.call_count, 3)
+        mockMSI.run_model.assert_not_called()
+        
+        # a CaseError results in running the block experiment by experiment
+        mockMSI.run_block.side_effect = CaseError("message", {})
+        mockMSI.output = {'a':1}
+        results = runner.run_experiments(experiments[0:2])
+        self.assertEqual(len(results), 2)
+        self.assertEqual(mockMSI.run_model.call_count, 2)
+        
+        mockMSI.run_block.side_effect = Exception('some exception')
+        with self.assertRaises(EMAError):
+            runner.run_experiments(experiments)
         
 if __name__ == "__main__":
     unittest.main()
@@ -9,15 +9,20 @@ from __future__ import (print_function, absolute_import, unicode_literals,
 
 import unittest
 
+import numpy as np
+
 try:
     import unittest.mock as mock
 except ImportError:
     import mock
 
-from ema_workbench.em_framework.model import Model, FileModel
+from ema_workbench.em_framework.model import (Model, FileModel, 
+                                              VectorizedModel)
 from ema_workbench.em_framework.parameters import (RealParameter, Policy, 
                                                    Scenario,
-    CategoricalParameter, Category)
+    CategoricalParameter, Category, Constant)
+from ema_workbench.em_framework.outcomes import (ScalarOutcome, 
+                                                 TimeSeriesOutcome)
 from ema_workbench.util import EMAError
 
 class FileModelTest(FileModel):
@@ -143,6 +148,45 @@ class TestModel(unittest.TestCase):
         self.assertTrue(len(list(model.uncertainties.keys()))==1)
         self.assertTrue(unc_a.name in model.uncertainties)
 
+
+class TestVectorizedModel(unittest.TestCase):
+    
+    def setUp(self):
+        def function(a=None, b=None, c=None, d=None):
+            return {'e':a*c+d, 'f':np.outer(a, np.arange(3))}
+        self.function = mock.Mock(side_effect=function)
+        
+        model = VectorizedModel('modelname', self.function)
+        model.uncertainties = [RealParameter('a', 0, 1), 
+                               CategoricalParameter('b', ['x', 'y'])]
+        model.levers = [RealParameter('c', 0, 1)]
+        model.constants = [Constant('d', 10)]
+        model.outcomes = [ScalarOutcome('e'), TimeSeriesOutcome('f')]
+        self.model = model
+    
+    def test_run_block(self):
+        scenarios = [Scenario(a=0.1, b='x'), Scenario(a=0.2, b='y')]
+        outputs = self.model.run_block(scenarios, Policy('test', c=2))
+        
+        self.function.assert_called_once()
+        kwargs = self.function.call_args[1]
+        np.testing.assert_array_equal(kwargs['a'], [0.1, 0.2])
+        np.testing.assert_array_equal(kwargs['b'], ['x', 'y'])
+        self.assertEqual(kwargs['c'], 2)
+        self.assertEqual(kwargs['d'], 10)
+        
+        self.assertEqual(len(outputs), 2)
+        self.assertAlmostEqual(outputs[1]['e'], 10.4)
+        np.testing.assert_array_equal(outputs[1]['f'], [0, 0.2, 0.4])
+    
+    def test_run_model(self):
+        self.model.run_model(Scenario(a=0.1, b='x'), Policy('test', c=2))
+        self.assertAlmostEqual(self.model.output['e'], 10.2)
+        
+        self.model.reset_model()
+        self.assertEqual(self.model.output, {})
+
+
 if __name__ == "__main__":
     #import sys;sys.argv = ['', 'Test.testName']
     unittest.main()
\ No newline at end of file
@@ -5,10 +5,41 @@
 from __future__ import (unicode_literals, print_function, absolute_import,
                                         division)
 
+import unittest
 
+from ema_workbench.em_framework.salib_samplers import SobolSampler
+from ema_workbench.em_framework.parameters import (RealParameter, 
+                                                      IntegerParameter, 
+                                                      CategoricalParameter,
+                                                      Scenario)
 
 # Created on 14 Mar 2017
 #
 # .. codeauthor::jhkwakkel <j.h.kwakkel (at) tudelft (dot) nl>
 
-__all__ = []
\ No newline at end of file
+__all__ = []
+
+
+class SobolSamplerTestCase(unittest.TestCase):
+    def test_generate_designs(self):
+        uncertainties = [RealParameter("1", 0, 10),
+                         IntegerParameter("2", 0, 10),
+                         CategoricalParameter('3', ['a','b', 'c'])]
+        
+        sampler = SobolSampler()
+        designs = sampler.generate_designs(uncertainties, 8)
+        designs.kind = Scenario
+        
+        designs_list = list(designs)
+        self.assertEqual(designs.n, len(designs_list))
+        
+        # designs are generated lazily, so can be iterated more than once
+        self.assertEqual(designs.n, len(list(designs)))
+        
+        for design in designs_list:
+            self.assertIsInstance(design['2'], int)
+            self.assertIn(design['3'], ['a', 'b', 'c'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -7,11 +7,14 @@ from __future__ import (absolute_import, unicode_literals, division,
                         print_function)
 
 import mock
+import pickle
 import unittest
 
+import numpy as np
+
 from ema_workbench.em_framework.samplers import (LHSSampler, MonteCarloSampler, 
                                 FullFactorialSampler, PartialFactorialSampler,
-                                determine_parameters)
+                                determine_parameters, DesignMatrix)
 from ema_workbench.em_framework.parameters import (RealParameter, 
                                                       IntegerParameter, 
                                                       CategoricalParameter)
@@ -37,6 +40,9 @@ class SamplerTestCase(unittest.TestCase):
         self.assertIn('2', design, msg)
         self.assertIn('3', design, msg)
         self.assertEqual(designs.n, actual_nr_designs, msg) 
+        
+        # designs are generated lazily, so can be iterated more than once
+        self.assertEqual(designs.n, len(list(designs)), msg)
     
     def test_lhs_sampler(self):
         sampler = LHSSampler()
@@ -76,6 +82,45 @@ class SamplerTestCase(unittest.TestCase):
         expected = {'c', 'd'}
         self.assertEqual(received, expected)
  
+    def test_design_matrix(self):
+        uncs = [RealParameter('a', 0, 1),
+                IntegerParameter('b', 0, 10),
+                CategoricalParameter('c', ['x', 'y'])]
+        designs = DesignMatrix(uncs, {'a':[0.1, 0.2, 0.3], 
+                                      'b':[1.0, 2.0, 3.0],
+                                      'c':[1, 0, 1]})
+        
+        self.assertEqual(designs.n, 3)
+        self.assertEqual(designs.column('b').dtype, np.int64)
+        np.testing.assert_array_equal(designs.column('c', [0, 2]), [1, 1])
+        
+        self.assertEqual(designs[1], {'a':0.2, 'b':2, 'c':'x'})
+        self.assertEqual(designs[-1], {'a':0.3, 'b':3, 'c':'y'})
+        with self.assertRaises(IndexError):
+            designs[3]
+        
+        designs.kind = Scenario
+        designs.chunk_size = 2
+        scenarios = list(designs)
+        self.assertEqual(len(scenarios), 3)
+        self.assertIsInstance(scenarios[2], Scenario)
+        self.assertEqual(scenarios[2]['c'], 'y')
+        
+        # the product varies the last design matrix fastest
+        other = DesignMatrix([RealParameter('d', 0, 1)], {'d':[0.5, 0.6]})
+        product = DesignMatrix.product(designs, other)
+        self.assertEqual(product.n, 6)
+        self.assertEqual(product.params, ['a', 'b', 'c', 'd'])
+        np.testing.assert_array_equal(product.column('b'), 
+                                      [1, 1, 2, 2, 3, 3])
+        np.testing.assert_array_equal(product.column('d'), 
+                                      [0.5, 0.6, 0.5, 0.6, 0.5, 0.6])
+        self.assertEqual(product[3], {'a':0.2, 'b':2, 'c':'x', 'd':0.6})
+        self.assertEqual(list(product)[3], product[3])
+        
+        unpickled = pickle.loads(pickle.dumps(product))
+        self.assertEqual(list(unpickled), list(product))
+ 
     def test_determine_parameters(self):
         function = mock.Mock()
         model_a = Model("A", function)
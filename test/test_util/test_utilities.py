@@ -5,12 +5,29 @@ Created on 22 nov. 2012
 '''
 from __future__ import (absolute_import, print_function, division)
 import os
+import shutil
+import tempfile
 import unittest
 
 import numpy as np
 
 from ema_workbench.util.utilities import (save_results, load_results,
-                                          get_ema_project_home_dir)
+                                          get_ema_project_home_dir,
+                                          save_results_binary, 
+                                          load_results_binary, 
+                                          ResultsStore, merge_results)
+from ema_workbench.util import EMAError
+
+
+def make_results(experiment_ids):
+    n = len(experiment_ids)
+    experiments = np.empty((n,), dtype=[('x', float), ('c', object)])
+    experiments['x'] = experiment_ids
+    experiments['c'] = np.random.choice(['a', 'b'], n)
+    
+    outcomes = {'scalar': np.asarray(experiment_ids, dtype=float),
+                'time series': np.random.rand(n, 10)}
+    return experiments, outcomes
 
 
 def setUpModule():
@@ -117,11 +134,144 @@ class LoadResultsTestCase(unittest.TestCase):
 #         if logical:
 #             ema_logging.info('3d loaded successfully')
     
+class BinaryResultsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = os.path.join(tempfile.mkdtemp(), 'results')
+    
+    def tearDown(self):
+        shutil.rmtree(os.path.dirname(self.directory))
+    
+    def test_save_load_binary(self):
+        nr_experiments = 1000
+        experiments = np.empty((nr_experiments,), 
+                               dtype=[('x', float), ('y', int), 
+                                      ('c', object), ('policy', object)])
+        experiments['x'] = np.random.rand(nr_experiments)
+        experiments['y'] = np.random.randint(0, 10, nr_experiments)
+        experiments['c'] = np.random.choice([1, 'a', True], nr_experiments)
+        experiments['policy'] = 'none'
+        
+        outcomes = {'scalar': np.random.rand(nr_experiments),
+                    'time series': np.random.rand(nr_experiments, 10),
+                    'replications': np.random.rand(nr_experiments, 10, 3)}
+        
+        save_results((experiments, outcomes), self.directory, binary=True)
+        
+        for mmap_mode in [None, 'r']:
+            loaded_experiments, loaded_outcomes = load_results(self.directory,
+                                                        mmap_mode=mmap_mode)
+            
+            self.assertEqual(loaded_experiments.dtype, experiments.dtype)
+            for name in experiments.dtype.names:
+                self.assertEqual(list(loaded_experiments[name]), 
+                                 list(experiments[name]))
+            
+            self.assertEqual(set(loaded_outcomes.keys()), 
+                             set(outcomes.keys()))
+            for key, value in outcomes.items():
+                np.testing.assert_array_equal(loaded_outcomes[key], value)
+                
+                if mmap_mode:
+                    self.assertIsInstance(loaded_outcomes[key], np.memmap)
+    
+    def test_memmap_experiments(self):
+        nr_experiments = 100
+        experiments = np.zeros((nr_experiments,), dtype=[('x', float)])
+        outcomes = {'a': np.random.rand(nr_experiments)}
+        
+        save_results_binary((experiments, outcomes), self.directory)
+        experiments, _ = load_results_binary(self.directory, mmap_mode='r')
+        
+        # without object columns, the experiments can be memory mapped
+        self.assertIsInstance(experiments, np.memmap)
+
+
+class ResultsStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = os.path.join(tempfile.mkdtemp(), 'store')
+    
+    def tearDown(self):
+        shutil.rmtree(os.path.dirname(self.directory))
+    
+    def test_write_load(self):
+        store = ResultsStore(self.directory, nr_experiments=20)
+        self.assertEqual(len(store), 0)
+        
+        for ids in [[5, 3, 9, 1, 7], [0, 2, 4, 6, 8]]:
+            store.write(np.asarray(ids), *make_results(ids))
+        
+        # reopening finds the written chunks
+        store = ResultsStore(self.directory, nr_experiments=20)
+        self.assertEqual(len(store), 10)
+        np.testing.assert_array_equal(store.experiment_ids(), np.arange(10))
+        
+        experiments, outcomes = store.load()
+        np.testing.assert_array_equal(experiments['x'], np.arange(10))
+        np.testing.assert_array_equal(outcomes['scalar'], np.arange(10))
+        self.assertEqual(outcomes['time series'].shape, (10, 10))
+        
+        with self.assertRaises(EMAError):
+            ResultsStore(self.directory, nr_experiments=10)
+        
+        # experiments can only be written once
+        with self.assertRaises(EMAError):
+            store.write(np.asarray([10, 3]), *make_results([10, 3]))
+        with self.assertRaises(EMAError):
+            store.write(np.asarray([10, 10]), *make_results([10, 10]))
+        self.assertEqual(len(store), 10)
+    
+    def test_parameters(self):
+        ResultsStore(self.directory, 20, parameters=['x'])
+        ResultsStore(self.directory, 20, parameters=['x'])
+        
+        with self.assertRaises(EMAError):
+            ResultsStore(self.directory, 20, parameters=['x', 'y'])
+    
+    def test_incomplete_chunk(self):
+        store = ResultsStore(self.directory)
+        store.write(np.arange(5), *make_results(range(5)))
+        
+        # simulate a crash while writing a chunk
+        tmp_dir = os.path.join(self.directory, 
+                               ResultsStore.TMP+ResultsStore.CHUNK.format(1))
+        os.makedirs(tmp_dir)
+        
+        store = ResultsStore(self.directory)
+        self.assertFalse(os.path.exists(tmp_dir))
+        self.assertEqual(len(store), 5)
+
+
 class ExperimentsToCasesTestCase(unittest.TestCase):
     pass
 
 class MergeResultsTestCase(unittest.TestCase):
-    pass
+    def test_merge_stores(self):
+        root = tempfile.mkdtemp()
+        try:
+            store1 = ResultsStore(os.path.join(root, '1'), nr_experiments=10)
+            store1.write(np.arange(10), *make_results(range(10)))
+            
+            store2 = ResultsStore(os.path.join(root, '2'), nr_experiments=6)
+            store2.write(np.arange(3, 6), *make_results(range(3, 6)))
+            store2.write(np.arange(3), *make_results(range(3)))
+            
+            with self.assertRaises(EMAError):
+                merge_results(store1, store2)
+            
+            merged = merge_results(store1, store2, downsample=2,
+                                   directory=os.path.join(root, 'merged'))
+            self.assertIsInstance(merged, ResultsStore)
+            self.assertEqual(merged.nr_experiments, 16)
+            np.testing.assert_array_equal(merged.experiment_ids(), 
+                                          np.arange(16))
+            
+            experiments, outcomes = merged.load()
+            np.testing.assert_array_equal(experiments['x'], 
+                                  np.concatenate((np.arange(10), 
+                                                  np.arange(6))))
+            self.assertEqual(outcomes['time series'].shape, (16, 5))
+        finally:
+            shutil.rmtree(root)
 
 class ConfigTestCase(unittest.TestCase):
     def test_get_home_dir(self):